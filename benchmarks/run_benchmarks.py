@@ -0,0 +1,211 @@
+"""Benchmark suite for the EHR access layer.
+
+Times parse_data and the Patient API on synthetic data at several sizes
+and records the results as JSON; pass --compare to flag regressions
+against an earlier run.
+"""
+import argparse
+import datetime
+import json
+import pathlib
+import platform
+import random
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Callable
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+sys.path[:0] = [str(ROOT / "src"), str(ROOT / "tests")]
+
+import functionality  # noqa: E402
+import make_synthetic_data  # noqa: E402
+
+DEFAULT_SIZES = "1000:10000,10000:100000,100000:1000000"
+SAMPLE_PATIENTS = 200
+THRESHOLD_LAB = "METABOLIC: POTASSIUM"
+
+
+def parse_sizes(sizes: str) -> list[tuple[int, int]]:
+    """Parse "patients:labs,..." into (patients, labs) pairs."""
+    pairs = [size.split(":") for size in sizes.split(",")]
+    return [(int(patients), int(labs)) for patients, labs in pairs]
+
+
+def best_of(repeat: int, run: Callable[[], Any]) -> float:
+    """Get the fastest wall time in seconds over repeat runs."""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def bench_size(
+    n_patients: int, n_labs: int, repeat: int, seed: int
+) -> list[dict[str, Any]]:
+    """Run every benchmark against one synthetic data size."""
+    results = []
+
+    def record(name: str, calls: int, seconds: float) -> None:
+        results.append(
+            {
+                "benchmark": name,
+                "patients": n_patients,
+                "labs": n_labs,
+                "calls": calls,
+                "seconds": seconds,
+                "per_call": seconds / calls,
+            }
+        )
+        print(f"{n_patients:>9} {n_labs:>10} {name:<32} {seconds:10.4f}s")
+
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        subjects, labs = make_synthetic_data.write_synthetic_files(
+            tmpdirname, n_patients, n_labs, seed
+        )
+        # cache_size=0 measures the uncached query path on every call
+        database = functionality.Database(
+            str(pathlib.Path(tmpdirname) / "bench.db"), cache_size=0
+        )
+        record(
+            "parse_data",
+            1,
+            best_of(
+                1,
+                lambda: functionality.parse_data(
+                    subjects, labs, None, database
+                ),
+            ),
+        )
+        with_labs = [
+            row[0]
+            for row in database.execute("SELECT DISTINCT PatientID FROM Labs")
+        ]
+        pat_ids = random.Random(seed).sample(
+            with_labs, min(SAMPLE_PATIENTS, len(with_labs))
+        )
+        patients = [
+            functionality.Patient(pat_id, database) for pat_id in pat_ids
+        ]
+        calls = len(patients)
+        benchmarks: dict[str, Callable[[functionality.Patient], Any]] = {
+            "Patient.labs": lambda patient: patient.labs,
+            "Patient.is_sick": lambda patient: patient.is_sick(
+                THRESHOLD_LAB, ">", 5.5
+            ),
+            "Patient.get_lab_test_values": lambda patient: (
+                patient.get_lab_test_values(THRESHOLD_LAB)
+            ),
+            "Patient.get_age_at_first_lab": lambda patient: (
+                patient.get_age_at_first_lab()
+            ),
+            "Patient.lab_summary": lambda patient: (
+                patient.lab_summary(THRESHOLD_LAB)
+            ),
+            "Patient.age": lambda patient: patient.age,
+        }
+        for name, benchmark in benchmarks.items():
+            record(
+                name,
+                calls,
+                best_of(
+                    repeat,
+                    lambda: [benchmark(patient) for patient in patients],
+                ),
+            )
+
+        cohort = functionality.Cohort(db=database)
+        record("Cohort.ages", n_patients, best_of(repeat, cohort.ages))
+
+        def add_labs() -> None:
+            for patient in patients:
+                patient.add_labs(
+                    THRESHOLD_LAB, 4.0, "mmol/L", "2020-01-01 00:00:00.000"
+                )
+
+        record("Patient.add_labs", calls, best_of(repeat, add_labs))
+        database.close()
+    return results
+
+
+def git_commit() -> str:
+    """Get the current git commit, or "unknown" outside a checkout."""
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=ROOT,
+            capture_output=True,
+            check=True,
+            text=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def compare(
+    baseline: dict[str, Any], current: dict[str, Any], tolerance: float
+) -> list[str]:
+    """List benchmarks more than tolerance slower than the baseline."""
+    previous = {
+        (result["benchmark"], result["patients"], result["labs"]): result
+        for result in baseline["results"]
+    }
+    regressions = []
+    for result in current["results"]:
+        key = (result["benchmark"], result["patients"], result["labs"])
+        if key not in previous:
+            continue
+        ratio = result["per_call"] / previous[key]["per_call"]
+        if ratio > 1 + tolerance:
+            regressions.append(
+                f"{key[0]} at {key[1]} patients / {key[2]} labs is "
+                f"{ratio:.2f}x slower"
+            )
+    return regressions
+
+
+def main() -> int:
+    """Run the benchmarks from the command line."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--sizes",
+        default=DEFAULT_SIZES,
+        help="comma separated patients:labs pairs",
+    )
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="bench_output.json")
+    parser.add_argument("--compare", help="baseline JSON to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+
+    report = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "machine": platform.machine(),
+        "created": datetime.datetime.now().isoformat(),
+        "results": [
+            result
+            for n_patients, n_labs in parse_sizes(args.sizes)
+            for result in bench_size(
+                n_patients, n_labs, args.repeat, args.seed
+            )
+        ],
+    }
+    pathlib.Path(args.output).write_text(json.dumps(report, indent=2))
+    if args.compare:
+        baseline = json.loads(pathlib.Path(args.compare).read_text())
+        regressions = compare(baseline, report, args.tolerance)
+        for regression in regressions:
+            print("REGRESSION:", regression)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
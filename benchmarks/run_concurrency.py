@@ -0,0 +1,128 @@
+"""Mixed read/write throughput benchmark for the EHR access layer.
+
+Runs N reader threads calling Patient.get_lab_test_values while feed
+threads call Patient.add_labs, once with the default rollback journal and
+once with Database(concurrent=True), and prints reads and writes per
+second along with any "database is locked" errors.
+"""
+import argparse
+import pathlib
+import random
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+sys.path[:0] = [str(ROOT / "src"), str(ROOT / "tests")]
+
+import functionality  # noqa: E402
+import make_synthetic_data  # noqa: E402
+
+THRESHOLD_LAB = "METABOLIC: POTASSIUM"
+
+
+def run_mix(
+    database: functionality.Database,
+    pat_ids: list[str],
+    readers: int,
+    writers: int,
+    seconds: float,
+) -> dict[str, float]:
+    """Run readers and writers for seconds and count what they finished."""
+    counts = {"reads": 0, "writes": 0, "locked": 0}
+    lock = threading.Lock()
+    stop = threading.Event()
+
+    def count(key: str) -> None:
+        with lock:
+            counts[key] += 1
+
+    def read(seed: int) -> None:
+        rng = random.Random(seed)
+        while not stop.is_set():
+            patient = functionality.Patient(rng.choice(pat_ids), database)
+            try:
+                patient.get_lab_test_values(THRESHOLD_LAB)
+            except sqlite3.OperationalError:
+                count("locked")
+            else:
+                count("reads")
+
+    def write(seed: int) -> None:
+        rng = random.Random(seed)
+        while not stop.is_set():
+            patient = functionality.Patient(rng.choice(pat_ids), database)
+            try:
+                patient.add_labs(
+                    THRESHOLD_LAB, 4.0, "mmol/L", "2020-01-01 00:00:00.000"
+                )
+            except sqlite3.OperationalError:
+                count("locked")
+            else:
+                count("writes")
+
+    threads = [
+        threading.Thread(target=read, args=(i,)) for i in range(readers)
+    ]
+    threads += [
+        threading.Thread(target=write, args=(-i,)) for i in range(writers)
+    ]
+    for thread in threads:
+        thread.start()
+    time.sleep(seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    return {key: value / seconds for key, value in counts.items()}
+
+
+def main() -> int:
+    """Run the benchmark from the command line."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--patients", type=int, default=10_000)
+    parser.add_argument("--labs", type=int, default=100_000)
+    parser.add_argument("--readers", default="1,4,8")
+    parser.add_argument("--writers", type=int, default=1)
+    parser.add_argument("--seconds", type=float, default=3.0)
+    parser.add_argument("--busy-timeout", type=float, default=5.0)
+    args = parser.parse_args()
+
+    print(
+        f"{'mode':<10} {'readers':>7} {'reads/s':>9} {'writes/s':>9} "
+        f"{'locked/s':>9}"
+    )
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        subjects, labs = make_synthetic_data.write_synthetic_files(
+            tmpdirname, args.patients, args.labs, 0
+        )
+        for concurrent in [False, True]:
+            mode = "wal" if concurrent else "rollback"
+            for readers in map(int, args.readers.split(",")):
+                database = functionality.Database(
+                    str(pathlib.Path(tmpdirname) / f"{mode}.db"),
+                    cache_size=0,
+                    concurrent=concurrent,
+                    busy_timeout=args.busy_timeout,
+                )
+                functionality.parse_data(subjects, labs, None, database)
+                pat_ids = [
+                    row[0]
+                    for row in database.execute(
+                        "SELECT DISTINCT PatientID FROM Labs"
+                    )
+                ]
+                rates = run_mix(
+                    database, pat_ids, readers, args.writers, args.seconds
+                )
+                database.close()
+                print(
+                    f"{mode:<10} {readers:>7} {rates['reads']:>9.0f} "
+                    f"{rates['writes']:>9.0f} {rates['locked']:>9.1f}"
+                )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,233 @@
+"""Parquet and Arrow export and import for the EHR database.
+
+Tables are streamed in bounded record batches with typed columns:
+timestamps, float64 values and dictionary-encoded categorical strings.
+Requires pyarrow, which only this module uses.
+"""
+
+import itertools
+from typing import Any, Callable, Iterator
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+import functionality
+
+DICTIONARY = pa.dictionary(pa.int32(), pa.string())
+TIMESTAMP = pa.timestamp("us")
+BATCH_SIZE = 65_536
+
+# (arrow column, sql expression, arrow type) for each exported table
+ARROW_COLUMNS: dict[str, list[tuple[str, str, Any]]] = {
+    "Patients": [
+        ("PatientID", "PatientID", pa.string()),
+        ("PatientGender", "PatientGender", DICTIONARY),
+        ("PatientDateOfBirth", "PatientBirthEpoch", TIMESTAMP),
+        ("PatientRace", "PatientRace", DICTIONARY),
+        ("PatientMaritalStatus", "PatientMaritalStatus", DICTIONARY),
+        ("PatientLanguage", "PatientLanguage", DICTIONARY),
+        (
+            "PatientPopulationPercentageBelowPoverty",
+            "PatientPopulationPercentageBelowPoverty",
+            pa.float64(),
+        ),
+    ],
+    "Labs": [
+        ("LabID", "LabID", pa.int64()),
+        ("PatientID", "PatientID", pa.string()),
+        ("AdmissionID", "AdmissionID", pa.string()),
+        ("LabName", "LabName", DICTIONARY),
+        ("LabValue", "LabValue", pa.float64()),
+        ("LabUnits", "LabUnits", DICTIONARY),
+        ("LabDateTime", "LabEpoch", TIMESTAMP),
+    ],
+}
+
+
+def table_schema(table: str) -> Any:
+    """Get the arrow schema a table is exported with."""
+    return pa.schema([(name, type) for name, _, type in ARROW_COLUMNS[table]])
+
+
+def to_array(values: list[Any], type: Any) -> Any:
+    """Build an arrow column, dictionary-encoding categorical strings."""
+    if pa.types.is_dictionary(type):
+        return pa.array(values, pa.string()).dictionary_encode()
+    return pa.array(values, type)
+
+
+def record_batches(
+    table: str,
+    database: functionality.Database | None = None,
+    batch_size: int = BATCH_SIZE,
+) -> Iterator[Any]:
+    """Stream a table as record batches of at most batch_size rows."""
+    database = database or functionality.get_database()
+    columns = ARROW_COLUMNS[table]
+    schema = table_schema(table)
+    rows = database.stream(
+        f"""SELECT {", ".join(sql for _, sql, _ in columns)}
+        FROM {table}
+        ORDER BY rowid""",
+        (),
+        batch_size,
+    )
+    while chunk := list(itertools.islice(rows, batch_size)):
+        yield pa.record_batch(
+            [
+                to_array(list(values), type)
+                for values, (_, _, type) in zip(zip(*chunk), columns)
+            ],
+            schema=schema,
+        )
+
+
+def export_parquet(
+    table: str,
+    path: str,
+    database: functionality.Database | None = None,
+    batch_size: int = BATCH_SIZE,
+) -> int:  # memory O(batch_size)
+    """Write a table to a Parquet file with one row group per batch.
+
+    Returns the number of rows written.
+    """
+    written = 0
+    with pq.ParquetWriter(path, table_schema(table)) as writer:
+        for batch in record_batches(table, database, batch_size):
+            writer.write_batch(batch)
+            written += batch.num_rows
+    return written
+
+
+def export_arrow(
+    table: str,
+    path: str,
+    database: functionality.Database | None = None,
+    batch_size: int = BATCH_SIZE,
+) -> int:  # memory O(batch_size)
+    """Write a table to an Arrow IPC stream file.
+
+    The stream format is used because each batch carries its own
+    dictionaries, which the IPC file format does not allow. Returns the
+    number of rows written.
+    """
+    written = 0
+    with pa.ipc.new_stream(path, table_schema(table)) as writer:
+        for batch in record_batches(table, database, batch_size):
+            writer.write_batch(batch)
+            written += batch.num_rows
+    return written
+
+
+def read_batches(path: str, batch_size: int = BATCH_SIZE) -> Iterator[Any]:
+    """Stream record batches from a .parquet file or an Arrow IPC stream."""
+    if path.endswith(".parquet"):
+        yield from pq.ParquetFile(path).iter_batches(batch_size=batch_size)
+        return
+    with pa.ipc.open_stream(path) as reader:
+        yield from reader
+
+
+def column_values(batch: Any, name: str) -> list[Any]:
+    """Get a column as python values, with timestamps as epochs."""
+    column = batch.column(name)
+    if pa.types.is_timestamp(column.type):
+        column = column.cast(TIMESTAMP).cast(pa.int64())
+    values: list[Any] = column.to_pylist()
+    return values
+
+
+def typed_time(time: int | str | None) -> tuple[str, int]:
+    """Get (timestamp text, epoch) from an epoch or a timestamp string."""
+    if time is None:
+        raise ValueError("Missing timestamp.")
+    if isinstance(time, str):
+        return time, functionality.to_epoch(time)
+    text = functionality.from_epoch(time).strftime(
+        functionality.DATETIME_FORMAT
+    )
+    return text[:-3], time  # millisecond text like the source files
+
+
+def type_patient_values(row: tuple[Any, ...]) -> tuple[Any, ...]:
+    """Convert SUBJECT_COLUMNS values to a typed Patients row."""
+    pat_id, gender, dob, race, marital_status, language, poverty = row
+    dob_text, dob_epoch = typed_time(dob)
+    return functionality.with_percentage(
+        (pat_id, gender, dob_text, race, dob_epoch, marital_status, language),
+        "" if poverty is None else str(poverty),
+    )
+
+
+def type_lab_values(row: tuple[Any, ...]) -> tuple[Any, ...]:
+    """Convert LAB_COLUMNS values to a typed Labs row."""
+    pat_id, admission_id, lab_name, value, units, time = row
+    if value is None:
+        raise ValueError("Missing lab value.")
+    time_text, epoch = typed_time(time)
+    return (
+        pat_id,
+        None if admission_id is None else str(admission_id),
+        lab_name,
+        functionality.to_lab_value(str(value)),
+        units,
+        time_text,
+        epoch,
+    )
+
+
+ROW_TYPES: dict[str, Callable[[tuple[Any, ...]], tuple[Any, ...]]] = {
+    "Patients": type_patient_values,
+    "Labs": type_lab_values,
+}
+
+
+def type_batches(
+    path: str, table: str, options: functionality.LoadOptions
+) -> Iterator[functionality.TypedChunk]:
+    """Stream (typed rows, quarantined rows) chunks from an arrow file.
+
+    Columns are read by name, so extra columns and column order do not
+    matter; LabID is not imported, sqlite allocates new ids.
+    """
+    names = [name for name, _, _ in ARROW_COLUMNS[table] if name != "LabID"]
+    type_row = ROW_TYPES[table]
+    for batch in read_batches(path, options.chunk_size):
+        missing = set(names) - set(batch.schema.names)
+        if missing:
+            raise ValueError(f"{path} is missing columns {sorted(missing)}.")
+        typed = []
+        quarantine = []
+        for row in zip(*(column_values(batch, name) for name in names)):
+            try:
+                typed.append(type_row(row))
+            except ValueError as error:
+                if options.bad_rows == "raise":
+                    raise ValueError(f"Bad {table} row {row}: {error}")
+                if isinstance(error, functionality.FieldError):
+                    typed.append(error.row)
+                quarantine.append(
+                    (table, "\t".join(map(str, row)), str(error))
+                )
+        yield typed, quarantine
+
+
+def import_files(
+    subjects_path: str,
+    labs_path: str,
+    options: functionality.LoadOptions | None = None,
+    database: functionality.Database | None = None,
+) -> dict[str, functionality.LoadReport]:
+    """Load Parquet or Arrow stream files into the sqlite database.
+
+    Works like parse_data (same LoadOptions, quarantine and append
+    merging) but reads typed columns instead of parsing tsv text.
+    """
+    options = options or functionality.LoadOptions()
+    return functionality.write_tables(
+        database or functionality.get_database(),
+        options,
+        type_batches(subjects_path, "Patients", options),
+        type_batches(labs_path, "Labs", options),
+    )
@@ -0,0 +1,347 @@
+"""Asyncio API for patient queries.
+
+Queries run on a bounded thread pool so they never block the event loop.
+Per-patient requests made concurrently (for example from asyncio.gather or
+from many request handlers) are coalesced into one IN (...) query per
+kind of request.
+"""
+
+import asyncio
+import concurrent.futures
+from dataclasses import dataclass, field
+import datetime
+from typing import Any, Callable, Generic, TypeVar
+
+import functionality
+
+V = TypeVar("V")
+R = TypeVar("R")
+
+DEMOGRAPHICS_SELECT = """SELECT PatientID, PatientDateOfBirth,
+    PatientBirthEpoch, PatientGender, PatientRace, PatientMaritalStatus,
+    PatientLanguage, PatientPopulationPercentageBelowPoverty FROM Patients"""
+
+
+class Batcher(Generic[V]):
+    """Coalesce concurrent requests for single keys into batched loads.
+
+    Keys requested before the event loop next runs its callbacks are loaded
+    together by one loader call on the executor; a key requested twice in
+    the same batch is loaded once. A batcher is dropped from its database
+    when it flushes, so later requests of its kind start a new one.
+    """
+
+    def __init__(
+        self,
+        database: "AsyncDatabase",
+        key: tuple[Any, ...],
+        loader: Callable[[list[str]], dict[str, V]],
+        missing: Callable[[str], Exception],
+    ):
+        """Create a batcher around loader, a blocking batch lookup."""
+        self.database = database
+        self.key = key
+        self.loader = loader
+        self.missing = missing
+        self._pending: dict[str, asyncio.Future[V]] = {}
+        self._tasks: set[asyncio.Task[None]] = set()
+
+    async def load(self, key: str) -> V:
+        """Get the value for key, sharing a query with concurrent calls."""
+        future = self._pending.get(key)
+        if future is None:
+            loop = asyncio.get_running_loop()
+            if not self._pending:
+                loop.call_soon(self._flush)
+            future = loop.create_future()
+            self._pending[key] = future
+        return await asyncio.shield(future)
+
+    def _flush(self) -> None:
+        """Start loading every pending key as one batch."""
+        pending, self._pending = self._pending, {}
+        self.database._drop_batcher(self)
+        task = asyncio.ensure_future(self._resolve(pending))
+        self._tasks.add(task)  # keep a reference until the batch finishes
+        task.add_done_callback(self._tasks.discard)
+
+    async def _resolve(self, pending: dict[str, asyncio.Future[V]]) -> None:
+        """Run the loader and hand each waiter its value."""
+        try:
+            results = await self.database.run(self.loader, list(pending))
+        except Exception as error:
+            for future in pending.values():
+                future.set_exception(error)
+            return
+        for key, future in pending.items():
+            if key in results:
+                future.set_result(results[key])
+            else:
+                future.set_exception(self.missing(key))
+
+
+class AsyncDatabase:
+    """Asyncio front end to a Database.
+
+    Blocking sqlite calls run on a pool of max_workers threads (each with
+    its own connection), which bounds how many queries run at once.
+    """
+
+    def __init__(
+        self,
+        database: functionality.Database | None = None,
+        max_workers: int = 4,
+    ):
+        """Wrap database (the default database if not given)."""
+        self.db = database or functionality.get_database()
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers, thread_name_prefix="ehr-async"
+        )
+        self._batchers: dict[tuple[Any, ...], Batcher[Any]] = {}
+
+    async def run(self, function: Callable[..., R], *args: Any) -> R:
+        """Run a blocking function on the query pool."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, function, *args)
+
+    def batcher(
+        self,
+        key: tuple[Any, ...],
+        loader: Callable[[list[str]], dict[str, V]],
+        missing: Callable[[str], Exception],
+    ) -> Batcher[V]:
+        """Get the batcher collecting this round's requests of one kind."""
+        if key not in self._batchers:
+            self._batchers[key] = Batcher(self, key, loader, missing)
+        batcher: Batcher[V] = self._batchers[key]
+        return batcher
+
+    def _drop_batcher(self, batcher: Batcher[Any]) -> None:
+        """Forget a batcher once it has nothing pending."""
+        if self._batchers.get(batcher.key) is batcher:
+            del self._batchers[batcher.key]
+
+    def _load_demographics(
+        self, pat_ids: list[str]
+    ) -> dict[str, tuple[Any, ...]]:
+        """Get Patients rows by patient id."""
+        return {
+            row[0]: row[1:]
+            for row in self._select_in(
+                DEMOGRAPHICS_SELECT, "PatientID", pat_ids
+            )
+        }
+
+    def _load_labs(self, lab_ids: list[str]) -> dict[str, functionality.Lab]:
+        """Get hydrated labs by lab id."""
+        return {
+            str(row[0]): functionality.Lab.from_row(row, self.db)
+            for row in self._select_in(
+                functionality.LAB_SELECT, "LabID", lab_ids
+            )
+        }
+
+    def _select_in(
+        self, select: str, column: str, keys: list[str]
+    ) -> list[tuple[Any, ...]]:
+        """Run select for keys, MAX_QUERY_PARAMETERS keys per query."""
+        rows = []
+        for start in range(0, len(keys), functionality.MAX_QUERY_PARAMETERS):
+            end = start + functionality.MAX_QUERY_PARAMETERS
+            batch = tuple(keys[start:end])
+            placeholders = ", ".join("?" * len(batch))
+            rows += self.db.execute(
+                f"{select} WHERE {column} IN ({placeholders})", batch
+            )
+        return rows
+
+    async def demographics(self, pat_id: str) -> tuple[Any, ...]:
+        """Get a patient's Patients row after PatientID."""
+        return await self.batcher(
+            ("demographics",),
+            self._load_demographics,
+            lambda pat_id: ValueError(f"Patient {pat_id} not found."),
+        ).load(pat_id)
+
+    async def lab(self, lab_id: int) -> functionality.Lab:
+        """Get a hydrated lab by id."""
+        return await self.batcher(
+            ("lab",),
+            self._load_labs,
+            lambda lab_id: ValueError(f"Lab {lab_id} not found."),
+        ).load(str(lab_id))
+
+    def patient(self, pat_id: str) -> "AsyncPatient":
+        """Get an async view of one patient."""
+        return AsyncPatient(pat_id, self)
+
+    def cohort(self, pat_ids: list[str] | None = None) -> "AsyncCohort":
+        """Get an async view of a cohort."""
+        return AsyncCohort(pat_ids, self)
+
+    def close(self) -> None:
+        """Wait for running queries and stop the query pool."""
+        self._executor.shutdown()
+
+
+@dataclass
+class AsyncPatient:
+    """Patient with awaitable versions of the Patient API."""
+
+    pat_id: str
+    db: AsyncDatabase = field(repr=False, compare=False)
+
+    async def dob(self) -> datetime.datetime:
+        """Patient DOB."""
+        dob, dob_epoch = (await self.db.demographics(self.pat_id))[:2]
+        return functionality.birth_datetime(self.pat_id, dob, dob_epoch)
+
+    async def gender(self) -> str:
+        """Patient gender."""
+        return str((await self.db.demographics(self.pat_id))[2])
+
+    async def race(self) -> str:
+        """Patient race."""
+        return str((await self.db.demographics(self.pat_id))[3])
+
+    async def marital_status(self) -> str:
+        """Patient marital status."""
+        return str((await self.db.demographics(self.pat_id))[4])
+
+    async def language(self) -> str:
+        """Patient language."""
+        return str((await self.db.demographics(self.pat_id))[5])
+
+    async def poverty_percentage(self) -> float | None:
+        """Percentage of the patient's population below the poverty line."""
+        percentage: float | None = (await self.db.demographics(self.pat_id))[6]
+        return percentage
+
+    async def age(self) -> int:
+        """Get patient age."""
+        time_since_birth = datetime.datetime.now() - await self.dob()
+        return int(time_since_birth.total_seconds() / 60 / 60 / 24 / 365.25)
+
+    async def labs(
+        self,
+        start: functionality.TimeBound = None,
+        end: functionality.TimeBound = None,
+    ) -> dict[str, list[functionality.Lab]]:
+        """Get patient labs in [start, end) by lab name, sorted by time."""
+        window = functionality.time_window(start, end)
+        pat_labs = await self.db.batcher(
+            ("labs",) + window,
+            lambda pat_ids: functionality.load_labs(
+                pat_ids, self.db.db, start, end
+            ),
+            lambda pat_id: ValueError(f"Patient {pat_id} not found."),
+        ).load(self.pat_id)
+        return {name: list(labs) for name, labs in pat_labs.items()}
+
+    async def is_sick(
+        self,
+        lab_name: str,
+        operator: str,
+        value: float,
+        start: functionality.TimeBound = None,
+        end: functionality.TimeBound = None,
+    ) -> bool:
+        """Check if patient is sick.
+
+        Concurrent checks against the same threshold and window share one
+        query.
+        """
+        sql_operator = functionality.check_operator(operator)
+        threshold = functionality.check_threshold(value)
+        window = functionality.time_window(start, end)
+
+        def load(pat_ids: list[str]) -> dict[str, bool]:
+            cohort = functionality.Cohort(pat_ids, self.db.db)
+            sick = set(
+                cohort.is_sick(lab_name, sql_operator, threshold, start, end)
+            )
+            return {pat_id: pat_id in sick for pat_id in pat_ids}
+
+        return await self.db.batcher(
+            ("is_sick", lab_name, sql_operator, threshold) + window,
+            load,
+            lambda pat_id: ValueError(f"Patient {pat_id} not found."),
+        ).load(self.pat_id)
+
+    async def add_labs(
+        self,
+        lab_name: str,
+        value: float,
+        units: str,
+        time: str,
+        admission_id: str | None = None,
+    ) -> None:
+        """Add lab to patient profile."""
+        patient = functionality.Patient(self.pat_id, self.db.db)
+        await self.db.run(
+            patient.add_labs, lab_name, value, units, time, admission_id
+        )
+
+    async def get_age_at_first_lab(self) -> int:
+        """Get patient age at first lab.
+
+        Concurrent calls share one grouped query; patients it cannot answer
+        (no typed epochs) fall back to Patient.get_age_at_first_lab.
+        """
+
+        def load(pat_ids: list[str]) -> dict[str, int]:
+            cohort = functionality.Cohort(pat_ids, self.db.db)
+            return dict(cohort.age_at_first_lab())
+
+        try:
+            return await self.db.batcher(
+                ("age_at_first_lab",),
+                load,
+                lambda pat_id: LookupError(pat_id),
+            ).load(self.pat_id)
+        except LookupError:
+            patient = functionality.Patient(self.pat_id, self.db.db)
+            return await self.db.run(patient.get_age_at_first_lab)
+
+    async def get_lab_test_values(
+        self,
+        lab_name: str,
+        start: functionality.TimeBound = None,
+        end: functionality.TimeBound = None,
+    ) -> str | list[float]:
+        """Get patient lab for specific test if exists, sorted by time."""
+        labs = await self.labs(start, end)
+        if lab_name not in labs:
+            return f"Patient has no tests for {lab_name}"
+        return [lab.value for lab in labs[lab_name]]
+
+
+@dataclass
+class AsyncCohort:
+    """Cohort with awaitable versions of the Cohort API."""
+
+    pat_ids: list[str] | None
+    db: AsyncDatabase = field(repr=False, compare=False)
+
+    def _cohort(self) -> functionality.Cohort:
+        """Get the blocking cohort this wraps."""
+        return functionality.Cohort(self.pat_ids, self.db.db)
+
+    async def is_sick(
+        self,
+        lab_name: str,
+        operator: str,
+        value: float,
+        start: functionality.TimeBound = None,
+        end: functionality.TimeBound = None,
+    ) -> list[str]:
+        """Get ids of cohort patients with any lab meeting the threshold."""
+        cohort = self._cohort()
+        return await self.db.run(
+            lambda: list(cohort.is_sick(lab_name, operator, value, start, end))
+        )
+
+    async def age_at_first_lab(self) -> list[tuple[str, int]]:
+        """Get (patient id, age at first lab) for the cohort."""
+        cohort = self._cohort()
+        return await self.db.run(lambda: list(cohort.age_at_first_lab()))
@@ -0,0 +1,339 @@
+"""Columnar in-memory EHR store backed by NumPy arrays."""
+
+from dataclasses import dataclass
+import datetime
+
+import numpy as np
+import numpy.typing as npt
+
+import functionality
+
+# Let...
+# P = Number of patients
+# I = Number of labs
+# K = Number of labs for one patient
+
+NO_DOB = np.iinfo(np.int64).min  # patients only seen in the labs file
+
+
+class ColumnarStore:
+    """In-memory store of labs as columnar arrays sorted by patient.
+
+    Labs are held as parallel arrays (patient index, lab-name code, value,
+    epoch) sorted by patient, lab name and time. offsets[p]:offsets[p + 1]
+    is the slice of labs for patient index p. Values are also converted to
+    canonical units as parse_data does, NaN where units do not convert,
+    and thresholds compare only those, skipping NaN like sqlite's NULL.
+    """
+
+    def __init__(
+        self,
+        pat_ids: list[str],
+        genders: list[str],
+        races: list[str],
+        dob_epochs: npt.NDArray[np.int64],
+        lab_names: list[str],
+        lab_units: list[str],
+        lab_patients: npt.NDArray[np.int64],
+        lab_codes: npt.NDArray[np.int32],
+        lab_unit_codes: npt.NDArray[np.int32],
+        lab_values: npt.NDArray[np.float64],
+        lab_epochs: npt.NDArray[np.int64],
+    ):
+        """Sort lab columns, build offsets and convert to canonical units."""
+        self.pat_ids = pat_ids
+        self.genders = genders
+        self.races = races
+        self.dob_epochs = dob_epochs
+        self.lab_names = lab_names
+        self.lab_units = lab_units
+        self.patient_index = {pat_id: i for i, pat_id in enumerate(pat_ids)}
+        self.name_codes = {name: i for i, name in enumerate(lab_names)}
+        order = np.lexsort((lab_epochs, lab_codes, lab_patients))  # O(I log I)
+        self.lab_patients = lab_patients[order]
+        self.lab_codes = lab_codes[order]
+        self.lab_unit_codes = lab_unit_codes[order]
+        self.lab_values = lab_values[order]
+        self.lab_epochs = lab_epochs[order]
+        self.offsets = np.searchsorted(
+            self.lab_patients, np.arange(len(pat_ids) + 1)
+        )  # O(P log I)
+        pair_counts = np.bincount(
+            self.lab_codes.astype(np.int64) * len(lab_units)
+            + self.lab_unit_codes,
+            minlength=len(lab_names) * len(lab_units),
+        )  # O(I)
+        pair_counts = pair_counts.reshape(len(lab_names), len(lab_units))
+        factors = np.full(pair_counts.shape, np.nan)
+        self.lab_canonical_units: list[str] = []
+        for code, name in enumerate(lab_names):  # O(names * units)
+            seen = np.flatnonzero(pair_counts[code])
+            frequencies = {
+                lab_units[unit_code]: int(pair_counts[code, unit_code])
+                for unit_code in seen
+            }
+            canonical = functionality.choose_canonical_units(name, frequencies)
+            self.lab_canonical_units.append(canonical)
+            for unit_code in seen:
+                factor = functionality.unit_factor(
+                    name, lab_units[unit_code], canonical
+                )
+                if factor is not None:
+                    factors[code, unit_code] = factor
+        self.lab_canonical_values = (
+            self.lab_values * factors[self.lab_codes, self.lab_unit_codes]
+        )
+
+    @classmethod
+    def from_files(
+        cls,
+        subjects_file_name: str,
+        labs_file_name: str,
+        options: functionality.LoadOptions | None = None,
+    ) -> "ColumnarStore":
+        """Build a store from the same files parse_data accepts.
+
+        Bad rows are dropped (or raise with bad_rows="raise") exactly as
+        parse_data would quarantine them.
+        """
+        options = options or functionality.LoadOptions()
+        pat_ids: list[str] = []
+        genders: list[str] = []
+        races: list[str] = []
+        dob_epochs: list[int] = []
+        for rows, _ in functionality.type_file(
+            subjects_file_name, "Patients", options
+        ):  # O(MJ)
+            for pat_id, gender, _, race, dob_epoch, *_ in rows:
+                pat_ids.append(pat_id)
+                genders.append(gender)
+                races.append(race)
+                dob_epochs.append(dob_epoch)
+        patient_index = {pat_id: i for i, pat_id in enumerate(pat_ids)}
+        name_codes: dict[str, int] = {}
+        unit_codes: dict[str, int] = {}
+        patient_chunks, code_chunks, unit_chunks = [], [], []
+        value_chunks, epoch_chunks = [], []
+        for rows, _ in functionality.type_file(
+            labs_file_name, "Labs", options
+        ):  # O(NI)
+            for row in rows:
+                if row[0] not in patient_index:
+                    patient_index[row[0]] = len(pat_ids)
+                    pat_ids.append(row[0])
+                    genders.append("")
+                    races.append("")
+                    dob_epochs.append(NO_DOB)
+            patient_chunks.append(
+                np.array([patient_index[row[0]] for row in rows], np.int64)
+            )
+            code_chunks.append(
+                np.array(
+                    [
+                        name_codes.setdefault(row[2], len(name_codes))
+                        for row in rows
+                    ],
+                    np.int32,
+                )
+            )
+            unit_chunks.append(
+                np.array(
+                    [
+                        unit_codes.setdefault(row[4], len(unit_codes))
+                        for row in rows
+                    ],
+                    np.int32,
+                )
+            )
+            value_chunks.append(np.array([row[3] for row in rows], np.float64))
+            epoch_chunks.append(np.array([row[6] for row in rows], np.int64))
+        return cls(
+            pat_ids,
+            genders,
+            races,
+            np.array(dob_epochs, np.int64),
+            list(name_codes),
+            list(unit_codes),
+            np.concatenate(patient_chunks or [np.empty(0, np.int64)]),
+            np.concatenate(code_chunks or [np.empty(0, np.int32)]),
+            np.concatenate(unit_chunks or [np.empty(0, np.int32)]),
+            np.concatenate(value_chunks or [np.empty(0, np.float64)]),
+            np.concatenate(epoch_chunks or [np.empty(0, np.int64)]),
+        )
+
+    def canonical_units(self, lab_name: str) -> str | None:
+        """Get the units thresholds for lab_name are in."""
+        code = self.name_codes.get(lab_name)
+        return None if code is None else self.lab_canonical_units[code]
+
+    def patient(self, pat_id: str) -> "ColumnarPatient":
+        """Get a Patient-style view of one patient."""
+        return ColumnarPatient(pat_id, self, self.patient_index[pat_id])
+
+    def lab_slice(self, index: int, lab_name: str | None = None) -> slice:
+        """Get the slice of a patient's labs, optionally for one lab name."""
+        start, end = int(self.offsets[index]), int(self.offsets[index + 1])
+        if lab_name is None:
+            return slice(start, end)
+        code = self.name_codes.get(lab_name)
+        if code is None:
+            return slice(start, start)
+        codes = self.lab_codes[start:end]  # sorted within a patient
+        return slice(
+            start + int(np.searchsorted(codes, code, "left")),
+            start + int(np.searchsorted(codes, code, "right")),
+        )  # O(log K)
+
+    def window_slice(
+        self,
+        lab_slice: slice,
+        start: functionality.TimeBound = None,
+        end: functionality.TimeBound = None,
+    ) -> slice:
+        """Narrow a one-lab-name slice to labs taken in [start, end)."""
+        epochs = self.lab_epochs[lab_slice]  # sorted within a lab name
+        first, last = 0, len(epochs)
+        if start is not None:
+            first = int(
+                np.searchsorted(epochs, functionality.bound_epoch(start))
+            )
+        if end is not None:
+            last = int(np.searchsorted(epochs, functionality.bound_epoch(end)))
+        return slice(
+            lab_slice.start + first, lab_slice.start + max(first, last)
+        )
+
+    def is_sick(
+        self,
+        lab_name: str,
+        operator: str,
+        value: float,
+        start: functionality.TimeBound = None,
+        end: functionality.TimeBound = None,
+    ) -> list[str]:  # O(I)
+        """Get ids of every patient with a lab meeting the threshold.
+
+        With start or end only labs taken in [start, end) are considered.
+        """
+        compare = functionality.COMPARISONS[
+            functionality.check_operator(operator)
+        ]
+        code = self.name_codes.get(lab_name)
+        if code is None:
+            return []
+        values = self.lab_canonical_values
+        mask = (
+            (self.lab_codes == code)
+            & ~np.isnan(values)
+            & compare(values, functionality.check_threshold(value))
+        )
+        if start is not None:
+            mask &= self.lab_epochs >= functionality.bound_epoch(start)
+        if end is not None:
+            mask &= self.lab_epochs < functionality.bound_epoch(end)
+        return [self.pat_ids[i] for i in np.unique(self.lab_patients[mask])]
+
+
+@dataclass
+class ColumnarPatient:
+    """Patient view over a ColumnarStore with the Patient API."""
+
+    pat_id: str
+    store: ColumnarStore
+    index: int
+
+    @property
+    def dob(self) -> datetime.datetime:
+        """Patient DOB."""
+        dob_epoch = int(self.store.dob_epochs[self.index])
+        if dob_epoch == NO_DOB:
+            raise ValueError(f"Patient {self.pat_id} has no DOB.")
+        return functionality.from_epoch(dob_epoch)
+
+    @property
+    def gender(self) -> str:
+        """Patient gender."""
+        return self.store.genders[self.index]
+
+    @property
+    def race(self) -> str:
+        """Patient race."""
+        return self.store.races[self.index]
+
+    @property
+    def age(self) -> int:
+        """Get patient age."""
+        time_since_birth = datetime.datetime.now() - self.dob
+        return int(time_since_birth.total_seconds() / 60 / 60 / 24 / 365.25)
+
+    @property
+    def labs(self) -> dict[str, list[functionality.Lab]]:
+        """Get patient labs and organize into dictionary by lab name."""
+        store = self.store
+        lab_slice = store.lab_slice(self.index)
+        labs = [
+            functionality.Lab(
+                i,
+                pat_id=self.pat_id,
+                _name=store.lab_names[store.lab_codes[i]],
+                _value=float(store.lab_values[i]),
+                _units=store.lab_units[store.lab_unit_codes[i]],
+                _time=functionality.from_epoch(
+                    int(store.lab_epochs[i])
+                ).strftime(functionality.DATETIME_FORMAT),
+                _epoch=int(store.lab_epochs[i]),
+            )
+            for i in range(lab_slice.start, lab_slice.stop)
+        ]  # O(K)
+        return functionality.group_labs(labs)
+
+    def is_sick(
+        self,
+        lab_name: str,
+        operator: str,
+        value: float,
+        start: functionality.TimeBound = None,
+        end: functionality.TimeBound = None,
+    ) -> bool:  # O(log K + k)
+        """Check if patient is sick, optionally within [start, end)."""
+        compare = functionality.COMPARISONS[
+            functionality.check_operator(operator)
+        ]
+        values = self.store.lab_canonical_values[
+            self.store.window_slice(
+                self.store.lab_slice(self.index, lab_name), start, end
+            )
+        ]
+        return bool(
+            (
+                ~np.isnan(values)
+                & compare(values, functionality.check_threshold(value))
+            ).any()
+        )
+
+    def get_lab_test_values(
+        self,
+        lab_name: str,
+        start: functionality.TimeBound = None,
+        end: functionality.TimeBound = None,
+    ) -> str | list[float]:
+        """Get patient lab for specific test if exists, sorted by time."""
+        values = self.store.lab_values[
+            self.store.window_slice(
+                self.store.lab_slice(self.index, lab_name), start, end
+            )
+        ]
+        if len(values) == 0:
+            return f"Patient has no tests for {lab_name}"
+        return [float(value) for value in values]
+
+    def get_age_at_first_lab(self) -> int:  # O(K)
+        """Get patient age at first lab."""
+        epochs = self.store.lab_epochs[self.store.lab_slice(self.index)]
+        if len(epochs) == 0:
+            raise ValueError(f"Patient {self.pat_id} has no labs.")
+        min_lab_date = functionality.from_epoch(int(epochs.min()))
+        pat_age_at_first = (
+            (min_lab_date - self.dob).total_seconds() / 60 / 60 / 24 / 365.25
+        )
+        return int(pat_age_at_first)
@@ -2,11 +2,30 @@
 
 # import dependencies and create needed types
 
+import collections
+import concurrent.futures
+from contextlib import contextmanager
 import datetime
-from dataclasses import dataclass
+import glob
+import itertools
+import math
+import mmap
+import os
+import queue
+from dataclasses import dataclass, field, replace
+from operator import eq, ge, gt, le, lt, ne
 import sqlite3
+import sys
+import threading
+import time
+from typing import Any, Callable, Iterable, Iterator, NamedTuple
+from typing import TypeVar
+
+import numpy as np
+import numpy.typing as npt
 
 list_of_list = list[list[str]]
+T = TypeVar("T")
 
 # create helper functions
 
@@ -36,15 +55,12 @@ def seperate_lines(row_list: list[str]) -> list_of_list:
     # O(NI) for labs file
 
 
-def reorder_columns(
-    column_order: list[str], list_of_list: list_of_list
-) -> list_of_list:
-    """Reorder Columns.
+def column_indices(column_order: list[str], header: list[str]) -> list[int]:
+    """Column Indices.
 
-    Reorders "columns" in list of list based on predisposed proper order
-    (column_order).
+    Map each column in column_order to its index in header, raising if the
+    two do not contain the same columns.
     """
-    header = list_of_list[0]  # O(1)
     col_order_greater_than_header = list(
         set(column_order) - set(header)
     )  # O(N) / O(M)
@@ -57,88 +73,1002 @@ def reorder_columns(
         raise ValueError(  # O(1)
             f"Column order and true headers dont match. Add \
                 {header_greater_than_col_order} to column order \
-                    and remove {header_greater_than_col_order} \
+                    and remove {col_order_greater_than_header} \
                         from column order."
         )  # O(1)
     reorder_dict = {header[i]: i for i in range(len(header))}  # O(N) / O(M)
-    index_header = [
+    return [
         reorder_dict[column_order[i]] for i in range(len(column_order))
     ]  # O(# of columns): O(N) for labs and O(M) for subjects
-    if not any(item is None for item in index_header):
-        reorder = [[row[idx] for idx in index_header] for row in list_of_list]
-        # O(# columns * # Rows) = O(NI) for labs and O(MJ) for subjects
+
+
+def reorder_columns(
+    column_order: list[str], list_of_list: list_of_list
+) -> list_of_list:
+    """Reorder Columns.
+
+    Reorders "columns" in list of list based on predisposed proper order
+    (column_order).
+    """
+    header = list_of_list[0]  # O(1)
+    index_header = column_indices(column_order, header)  # O(N) / O(M)
+    reorder = [[row[idx] for idx in index_header] for row in list_of_list]
+    # O(# columns * # Rows) = O(NI) for labs and O(MJ) for subjects
     return reorder[1:]  # remove column row
 
 
+class ShortRow(list[str]):
+    """Raw fields of a row with fewer fields than the header.
+
+    Yielded as is, not reordered, so typing rejects it like any other
+    malformed row.
+    """
+
+
+def stream_rows(
+    filename: str, column_order: list[str], chunk_size: int = 50_000
+) -> Iterator[list_of_list]:
+    """Stream Rows.
+
+    Lazily read a tsv file and yield its rows, reordered to column_order,
+    in chunks of at most chunk_size rows. The header is mapped to column
+    indices once, so memory stays O(chunk_size) regardless of file size.
+    Rows missing a column are yielded as a ShortRow.
+    """
+    if chunk_size < 1:
+        raise ValueError("chunk_size must be a positive integer.")
+    with open(filename, mode="r", encoding="utf-8-sig") as file:
+        header = file.readline().strip().split("\t")  # O(N) / O(M)
+        index_header = column_indices(column_order, header)
+        max_index = max(index_header, default=0)
+        chunk: list_of_list = []
+        for line in file:  # O(NI) / O(MJ) total, one line at a time
+            if not line.strip():
+                continue
+            row = line.rstrip("\r\n").split("\t")  # keeps empty last fields
+            if len(row) <= max_index:
+                chunk.append(ShortRow(row))
+            else:
+                chunk.append([row[idx] for idx in index_header])
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+
+MMAP_BLOCK_SIZE = 1 << 22  # bytes of the mapped file split per pass
+
+
+def mmap_rows(
+    filename: str,
+    column_order: list[str],
+    chunk_size: int = 50_000,
+    used_columns: list[str] | None = None,
+) -> Iterator[list_of_list]:
+    """Memory-Mapped Rows.
+
+    Same output as stream_rows, but the file is memory-mapped and split as
+    raw bytes a block at a time. Only the columns in used_columns (default
+    all of column_order) are decoded; the others are left as "" and fields
+    past the last used column are never split out of the line. Rows
+    missing a column are yielded as a ShortRow.
+    """
+    if chunk_size < 1:
+        raise ValueError("chunk_size must be a positive integer.")
+    with open(filename, mode="rb") as file:
+        if os.fstat(file.fileno()).st_size == 0:  # mmap rejects empty files
+            column_indices(column_order, [""])
+            return
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            size = len(buffer)
+            header_end = buffer.find(b"\n")
+            header_end = size if header_end == -1 else header_end
+            header = buffer[:header_end].decode("utf-8-sig").strip()
+            index_header = column_indices(column_order, header.split("\t"))
+            used = set(column_order if used_columns is None else used_columns)
+            decoded = [
+                (position, index)
+                for position, (name, index) in enumerate(
+                    zip(column_order, index_header)
+                )
+                if name in used
+            ]
+            max_split = max([index for _, index in decoded], default=0) + 1
+            max_index = max(index_header, default=0)
+            width = len(column_order)
+            chunk: list_of_list = []
+            start = header_end + 1
+            while start < size:  # O(NI) / O(MJ) total, one block at a time
+                end = size
+                if start + MMAP_BLOCK_SIZE < size:  # cut at the last newline
+                    end = buffer.rfind(b"\n", start, start + MMAP_BLOCK_SIZE)
+                    if end == -1:  # a single line longer than the block
+                        end = buffer.find(b"\n", start + MMAP_BLOCK_SIZE)
+                        end = size if end == -1 else end
+                for line in buffer[start:end].split(b"\n"):
+                    if not line.strip():
+                        continue
+                    line = line.rstrip(b"\r")
+                    if line.count(b"\t") < max_index:
+                        text = line.decode("utf-8", "replace")
+                        row: list[str] = ShortRow(text.split("\t"))
+                    else:
+                        fields = line.split(b"\t", max_split)
+                        row = [""] * width
+                        for position, index in decoded:
+                            row[position] = fields[index].decode("utf-8")
+                    chunk.append(row)
+                    if len(chunk) >= chunk_size:
+                        yield chunk
+                        chunk = []
+                start = end + 1
+            if chunk:
+                yield chunk
+
+
+DATETIME_FORMAT = "%Y-%m-%d %H:%M:%S.%f"
+EPOCH = datetime.datetime(1970, 1, 1)
+MICROSECOND = datetime.timedelta(microseconds=1)
+MICROSECONDS_PER_YEAR = 365.25 * 24 * 60 * 60 * 1_000_000
+
+
+def parse_timestamp(timestamp: str) -> datetime.datetime:
+    """Parse a "%Y-%m-%d %H:%M:%S.%f" timestamp string.
+
+    Zero-padded timestamps with 3 or 6 fraction digits, as in the source
+    files, take the fromisoformat fast path (about 50x faster than
+    strptime); anything else falls back to strptime.
+    """
+    if (
+        len(timestamp) in (23, 26)
+        and timestamp[10] == " "
+        and timestamp[19] == "."
+        and timestamp[4] == timestamp[7] == "-"
+        and timestamp[13] == timestamp[16] == ":"
+        and timestamp[20:].isdigit()
+    ):
+        try:
+            return datetime.datetime.fromisoformat(timestamp)
+        except ValueError:
+            pass  # let strptime raise its usual error
+    return datetime.datetime.strptime(timestamp, DATETIME_FORMAT)
+
+
+def to_epoch(timestamp: str) -> int:
+    """Convert a timestamp string to integer microseconds since 1970."""
+    return (parse_timestamp(timestamp) - EPOCH) // MICROSECOND
+
+
+def from_epoch(epoch: int) -> datetime.datetime:
+    """Convert integer microseconds since 1970 to a datetime."""
+    return EPOCH + epoch * MICROSECOND
+
+
+TimeBound = datetime.datetime | str | None
+
+
+def bound_epoch(time: datetime.datetime | str) -> int:
+    """Convert a datetime or timestamp string to an epoch."""
+    if isinstance(time, str):
+        return to_epoch(time)
+    return (time - EPOCH) // MICROSECOND
+
+
+def ages_at(
+    birth_epochs: npt.NDArray[np.int64], as_of: TimeBound = None
+) -> npt.NDArray[np.int64]:  # O(P)
+    """Get whole-year ages at as_of (default now) from birth epochs.
+
+    Truncates like Patient.age, with one vectorized pass over all births.
+    """
+    reference = bound_epoch(as_of or datetime.datetime.now())
+    years = (reference - birth_epochs) / MICROSECONDS_PER_YEAR
+    return years.astype(np.int64)
+
+
+def time_window(
+    start: TimeBound = None,
+    end: TimeBound = None,
+) -> tuple[str, tuple[int, ...]]:
+    """Get an sql filter and parameters keeping start <= lab time < end.
+
+    A bound of None leaves that side of the window open.
+    """
+    sql = ""
+    parameters: tuple[int, ...] = ()
+    if start is not None:
+        sql += " AND LabEpoch >= ?"
+        parameters += (bound_epoch(start),)
+    if end is not None:
+        sql += " AND LabEpoch < ?"
+        parameters += (bound_epoch(end),)
+    return sql, parameters
+
+
+def to_lab_value(value: str) -> float:
+    """Convert a lab value string to a finite float."""
+    lab_value = float(value)
+    if not math.isfinite(lab_value):
+        raise ValueError(f"Lab value '{value}' is not finite.")
+    return lab_value
+
+
+class CacheInfo(NamedTuple):
+    """Hit/miss statistics of an LRUCache."""
+
+    hits: int
+    misses: int
+    maxsize: int
+    currsize: int
+    weight: int = 0
+
+
+class LRUCache:
+    """Thread-safe least-recently-used cache.
+
+    Bounded both by entry count and by total weight, so a few huge values
+    cannot grow it without limit; Patient weighs lab groupings by their
+    number of labs and everything else as 1.
+    """
+
+    def __init__(self, maxsize: int = 4096, max_weight: int = 1_000_000):
+        """Create an empty cache of at most maxsize entries and max_weight."""
+        self.maxsize = maxsize
+        self.max_weight = max_weight
+        self.hits = 0
+        self.misses = 0
+        self.weight = 0
+        self._entries: collections.OrderedDict[
+            tuple[str, str], tuple[Any, int]
+        ] = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(
+        self,
+        key: tuple[str, str],
+        loader: Callable[[], T],
+        weigh: Callable[[T], int] | None = None,
+    ) -> T:
+        """Get a cached value, calling loader to fill it on a miss."""
+        with self._lock:
+            if key in self._entries:
+                self.hits += 1
+                self._entries.move_to_end(key)
+                cached: T = self._entries[key][0]
+                return cached
+            self.misses += 1
+        value = loader()  # outside the lock so slow loads don't serialize
+        weight = 1 if weigh is None else max(weigh(value), 1)
+        if weight > self.max_weight:
+            return value  # would evict everything else
+        with self._lock:
+            if key in self._entries:
+                self.weight -= self._entries[key][1]
+            self._entries[key] = (value, weight)
+            self._entries.move_to_end(key)
+            self.weight += weight
+            while (
+                len(self._entries) > self.maxsize
+                or self.weight > self.max_weight
+            ):
+                self.weight -= self._entries.popitem(last=False)[1][1]
+        return value
+
+    def invalidate(self, pat_id: str) -> None:
+        """Drop every entry cached for one patient."""
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == pat_id]:
+                self.weight -= self._entries.pop(key)[1]
+
+    def clear(self) -> None:
+        """Drop every entry."""
+        with self._lock:
+            self._entries.clear()
+            self.weight = 0
+
+    def info(self) -> CacheInfo:
+        """Get hit/miss statistics for sizing the cache."""
+        with self._lock:
+            return CacheInfo(
+                self.hits,
+                self.misses,
+                self.maxsize,
+                len(self._entries),
+                self.weight,
+            )
+
+
 @dataclass
-class Lab:
-    """Lab class."""
+class QueryEvent:
+    """One instrumented database operation.
+
+    kind is "query" for a statement or "connect" for a connection opened.
+    site is the outermost function of this module on the call stack, such
+    as "Patient.labs" or "Lab.value".
+    """
+
+    kind: str
+    site: str
+    sql: str
+    seconds: float
+    rows: int
+
+
+@dataclass
+class SiteStats:
+    """Aggregated query statistics for one call site."""
+
+    queries: int = 0
+    connections: int = 0
+    rows: int = 0
+    seconds: float = 0.0
+    max_seconds: float = 0.0
+
+
+def call_site() -> str:
+    """Name the outermost frame of this module on the current stack."""
+    site = "<unknown>"
+    frame = sys._getframe(1)
+    while frame is not None and frame.f_globals is globals():
+        name = frame.f_code.co_name
+        if not name.startswith("<"):
+            owner = frame.f_locals.get("self", frame.f_locals.get("cls"))
+            if owner is None:
+                site = name
+            else:
+                owner_type = owner if isinstance(owner, type) else type(owner)
+                site = f"{owner_type.__name__}.{name}"
+        frame = frame.f_back  # type: ignore[assignment]
+    return site
+
+
+class QueryProfiler:
+    """Query event listener that aggregates timings by call site.
+
+    Use it through Database.profile(), or register it (or any callable
+    taking a QueryEvent) in Database.listeners.
+    """
+
+    def __init__(self) -> None:
+        """Create an empty profiler."""
+        self.events: list[QueryEvent] = []
+        self._lock = threading.Lock()
+
+    def __call__(self, event: QueryEvent) -> None:
+        """Record one event."""
+        with self._lock:
+            self.events.append(event)
+
+    def summary(self) -> dict[str, SiteStats]:
+        """Aggregate recorded events by call site."""
+        stats: dict[str, SiteStats] = {}
+        with self._lock:
+            events = list(self.events)
+        for event in events:
+            site = stats.setdefault(event.site, SiteStats())
+            if event.kind == "connect":
+                site.connections += 1
+                continue
+            site.queries += 1
+            site.rows += event.rows
+            site.seconds += event.seconds
+            site.max_seconds = max(site.max_seconds, event.seconds)
+        return stats
+
+    def report(self) -> str:
+        """Format the summary as a table, slowest call sites first."""
+        lines = [
+            f"{'site':<32} {'queries':>8} {'conns':>6} {'rows':>9} "
+            f"{'total s':>9} {'max s':>9}"
+        ]
+        summary = sorted(
+            self.summary().items(), key=lambda item: -item[1].seconds
+        )
+        for site, stats in summary:
+            lines.append(
+                f"{site:<32} {stats.queries:>8} {stats.connections:>6} "
+                f"{stats.rows:>9} {stats.seconds:>9.4f} "
+                f"{stats.max_seconds:>9.4f}"
+            )
+        return "\n".join(lines)
+
+
+WriteRequest = tuple[
+    str, list[tuple[Any, ...]], "concurrent.futures.Future[int]"
+]
+
+
+class GroupCommitWriter:
+    """Single writer that commits queued writes in groups.
+
+    Writers queue their statement, then whichever holds the commit lock
+    applies everything queued so far in one transaction on the writer's
+    own connection, each write in a savepoint so a failing one does not
+    undo the others. Writes that arrive during a commit are committed
+    together by the next lock holder, so many small add_labs calls share
+    one commit instead of each taking sqlite's write lock, and no thread
+    handoff is needed.
+    """
+
+    def __init__(self, database: "Database", max_batch: int = 256):
+        """Open the writer's connection."""
+        self.max_batch = max_batch
+        self.commits = 0
+        self.writes = 0
+        self._connection = database.connect(
+            isolation_level=None, check_same_thread=False
+        )
+        self._queue: queue.Queue[WriteRequest] = queue.Queue()
+        self._lock = threading.Lock()
+
+    def submit(
+        self, sql: str, rows: list[tuple[Any, ...]]
+    ) -> "concurrent.futures.Future[int]":
+        """Queue a statement to run for each row; resolves to rows changed.
+
+        The write is committed by the next call to write or flush.
+        """
+        future: concurrent.futures.Future[int] = concurrent.futures.Future()
+        self._queue.put((sql, rows, future))
+        return future
+
+    def write(self, sql: str, rows: list[tuple[Any, ...]]) -> int:
+        """Queue a write and wait until a group commit includes it."""
+        future = self.submit(sql, rows)
+        with self._lock:
+            while not future.done():  # not committed by the last holder
+                self._flush()
+        return future.result()
+
+    def flush(self) -> None:
+        """Commit every queued write."""
+        with self._lock:
+            while not self._queue.empty():
+                self._flush()
+
+    def _flush(self) -> None:
+        """Commit up to max_batch queued writes; needs the commit lock."""
+        batch: list[WriteRequest] = []
+        while len(batch) < self.max_batch:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        if batch:
+            self._commit(batch)
+
+    def _commit(self, batch: list[WriteRequest]) -> None:
+        """Apply a batch of writes and resolve their futures."""
+        connection = self._connection
+        results: list[tuple[concurrent.futures.Future[int], Any]] = []
+        try:
+            connection.execute("BEGIN IMMEDIATE")
+            for sql, rows, future in batch:
+                connection.execute("SAVEPOINT write")
+                try:
+                    count = connection.executemany(sql, rows).rowcount
+                except sqlite3.Error as error:
+                    connection.execute("ROLLBACK TO write")
+                    results.append((future, error))
+                else:
+                    results.append((future, count))
+                connection.execute("RELEASE write")
+            connection.execute("COMMIT")
+        except Exception as error:  # nothing in the batch was written
+            if connection.in_transaction:
+                connection.execute("ROLLBACK")
+            for _, _, future in batch:
+                future.set_exception(error)
+            return
+        self.commits += 1
+        self.writes += len(batch)
+        for future, result in results:
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    def close(self) -> None:
+        """Commit the queued writes and close the writer's connection."""
+        self.flush()
+        self._connection.close()
+
+
+class Database:
+    """Database handle for the ehr sqlite file.
+
+    Each thread lazily opens one connection that is reused for every query,
+    so sqlite's per-connection statement cache lets repeated queries skip
+    re-preparing their SQL. Demographics and lab groupings are memoized in
+    a process-wide LRU cache keyed by (patient id, kind), bounded by
+    cache_size entries and cache_labs cached labs. It is invalidated by
+    add_labs and parse_data, and cleared when sqlite's data_version shows
+    another connection has committed. data_version is checked at most
+    every cache_check_interval seconds per thread, so hits cost no query
+    and writes made outside this handle may be served stale for that
+    long (0 checks on every access).
+
+    Callables in listeners receive a QueryEvent for every query and every
+    connection opened; with no listeners nothing is timed.
+
+    With concurrent=True the file is switched to WAL, so readers never
+    block the writer or each other, and write() sends writes through one
+    GroupCommitWriter connection. Every connection waits up to busy_timeout
+    seconds for a lock instead of failing with "database is locked".
+    """
+
+    def __init__(
+        self,
+        path: str = "ehr.db",
+        cached_statements: int = 256,
+        cache_size: int = 4096,
+        concurrent: bool = False,
+        busy_timeout: float = 5.0,
+        cache_labs: int = 1_000_000,
+        cache_check_interval: float = 0.1,
+    ):
+        """Create a handle; no connection is opened until first use."""
+        self.path = path
+        self.cached_statements = cached_statements
+        self.cache = LRUCache(cache_size, cache_labs)
+        self.cache_check_interval = cache_check_interval
+        self.concurrent = concurrent
+        self.busy_timeout = busy_timeout
+        self.listeners: list[Callable[[QueryEvent], None]] = []
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections: list[sqlite3.Connection] = []
+        self._writer: GroupCommitWriter | None = None
+        self._labs_ready = False
+
+    def _emit(self, kind: str, sql: str, start: float, rows: int) -> None:
+        """Send an event to every listener."""
+        event = QueryEvent(
+            kind, call_site(), sql, time.perf_counter() - start, rows
+        )
+        for listener in list(self.listeners):
+            listener(event)
+
+    @contextmanager
+    def profile(self) -> Iterator[QueryProfiler]:
+        """Record every query run on this database inside the block."""
+        profiler = QueryProfiler()
+        self.listeners.append(profiler)
+        try:
+            yield profiler
+        finally:
+            self.listeners.remove(profiler)
 
-    lab_id: str
+    def connect(self, **kwargs: Any) -> sqlite3.Connection:
+        """Open a new, unshared connection to the database."""
+        start = time.perf_counter()
+        kwargs.setdefault("cached_statements", self.cached_statements)
+        kwargs.setdefault("timeout", self.busy_timeout)
+        connection: sqlite3.Connection = sqlite3.connect(self.path, **kwargs)
+        if self.concurrent:  # WAL persists in the file; NORMAL is safe in it
+            connection.execute("PRAGMA journal_mode = WAL")
+            connection.execute("PRAGMA synchronous = NORMAL")
+        if self.listeners:
+            self._emit("connect", self.path, start, 0)
+        return connection
 
     @property
-    def time(self) -> str:
-        """Get lab value."""
-        connection = sqlite3.connect("ehr.db")
+    def connection(self) -> sqlite3.Connection:
+        """Get this thread's shared connection, opening it if needed."""
+        connection: sqlite3.Connection | None = getattr(
+            self._local, "connection", None
+        )
+        if connection is None:
+            # closed from another thread in close(), hence no thread check
+            connection = self.connect(check_same_thread=False)
+            self._local.connection = connection
+            with self._lock:
+                self._connections.append(connection)
+        return connection
+
+    def execute(
+        self, sql: str, parameters: tuple[Any, ...] = ()
+    ) -> list[tuple[Any, ...]]:
+        """Run a query on this thread's connection and fetch all rows."""
+        if not self.listeners:
+            return self.connection.execute(sql, parameters).fetchall()
+        start = time.perf_counter()
+        rows = self.connection.execute(sql, parameters).fetchall()
+        self._emit("query", sql, start, len(rows))
+        return rows
+
+    def stream(
+        self, sql: str, parameters: tuple[Any, ...] = (), fetch_size: int = 1
+    ) -> Iterator[tuple[Any, ...]]:
+        """Run a query and yield its rows, fetching fetch_size at a time."""
+        start = time.perf_counter()
+        count = 0
+        cursor = self.connection.execute(sql, parameters)
+        try:
+            while rows := cursor.fetchmany(fetch_size):
+                count += len(rows)
+                yield from rows
+        finally:
+            cursor.close()
+            if self.listeners:  # includes time the caller spent consuming
+                self._emit("query", sql, start, count)
+
+    def executemany(self, sql: str, rows: Iterable[tuple[Any, ...]]) -> int:
+        """Run a statement for each row in one transaction on this thread.
+
+        Returns the number of rows modified; rolls back on error. Raises
+        RuntimeError inside snapshot(), whose transaction this would end.
+        """
+        if getattr(self._local, "snapshot", False):
+            raise RuntimeError(
+                "Cannot write inside a snapshot unless concurrent=True."
+            )
+        start = time.perf_counter()
+        connection = self.connection
+        with connection:
+            count = connection.executemany(sql, rows).rowcount
+        if self.listeners:
+            self._emit("query", sql, start, count)
+        return count
+
+    def prepare_lab_writes(self) -> None:
+        """Add the unit conversion schema lab inserts need, once per handle.
+
+        Files loaded before unit normalization, or built by hand, lack
+        LabCanonicalValue and the unit tables. They are added, and existing
+        labs converted, in one transaction on its own connection.
+        """
+        snapshot = getattr(self._local, "snapshot", False)
+        if self._labs_ready or (snapshot and not self.concurrent):
+            return  # a write in a rollback-journal snapshot raises anyway
+        connection = self.connect(isolation_level=None)
         cursor = connection.cursor()
-        pat_dob_info = cursor.execute(
-            f"""SELECT LabID, LabDateTime
-            FROM Labs
-            WHERE LabID= ?""",
-            (self.lab_id,),
+        try:
+            cursor.execute("BEGIN IMMEDIATE")
+            columns = {
+                row[1] for row in cursor.execute("PRAGMA table_info(Labs)")
+            }
+            if columns:  # without Labs the insert reports the real problem
+                if "LabCanonicalValue" not in columns:
+                    cursor.execute(
+                        "ALTER TABLE Labs ADD COLUMN LabCanonicalValue REAL"
+                    )
+                create_unit_conversions(cursor)
+            cursor.execute("COMMIT")
+        except BaseException:
+            if connection.in_transaction:
+                cursor.execute("ROLLBACK")
+            raise
+        finally:
+            connection.close()
+        self._labs_ready = True
+
+    @property
+    def writer(self) -> GroupCommitWriter:
+        """Get the group-commit writer, opening it if needed."""
+        with self._lock:
+            if self._writer is None:
+                self._writer = GroupCommitWriter(self)
+            return self._writer
+
+    def write(self, sql: str, rows: Iterable[tuple[Any, ...]]) -> int:
+        """Run a statement for each row, atomically, and wait for commit.
+
+        Rows are built on the calling thread, so errors in them surface
+        here before anything is queued. In concurrent mode the write goes
+        through the GroupCommitWriter, committed together with any other
+        writes queued meanwhile; otherwise this is executemany.
+        """
+        if not self.concurrent:
+            return self.executemany(sql, rows)
+        start = time.perf_counter()
+        count = self.writer.write(sql, list(rows))
+        if self.listeners:  # includes time spent queued behind other writes
+            self._emit("query", sql, start, count)
+        return count
+
+    @contextmanager
+    def snapshot(self) -> Iterator[None]:
+        """Run this thread's queries in the block in one read transaction.
+
+        Every query sees the database as of the block's first read, even
+        while other connections commit; the LRU cache is bypassed so no
+        newer cached value leaks in. In concurrent mode writers carry on
+        meanwhile, including write() from inside the block; with a rollback
+        journal they wait for the block to end and writing from inside it
+        raises RuntimeError.
+        """
+        connection = self.connection
+        if connection.in_transaction:
+            raise RuntimeError("A transaction is already open.")
+        connection.execute("BEGIN")
+        self._local.snapshot = True
+        try:
+            yield
+        finally:
+            self._local.snapshot = False
+            connection.execute("COMMIT")
+
+    def cached(
+        self,
+        pat_id: str,
+        kind: str,
+        loader: Callable[[], T],
+        weigh: Callable[[T], int] | None = None,
+    ) -> T:
+        """Get a memoized per-patient value, loading it on a miss."""
+        if getattr(self._local, "snapshot", False):
+            return loader()
+        now = time.monotonic()
+        if now >= getattr(self._local, "next_check", 0.0):
+            self._local.next_check = now + self.cache_check_interval
+            data_version = self.connection.execute(
+                "PRAGMA data_version"
+            ).fetchone()[0]
+            if getattr(self._local, "data_version", data_version) != (
+                data_version
+            ):
+                self.cache.clear()  # another connection wrote to the file
+            self._local.data_version = data_version
+        return self.cache.get((pat_id, kind), loader, weigh)
+
+    def close(self) -> None:
+        """Stop the writer and close the shared connections of every thread."""
+        with self._lock:
+            writer, self._writer = self._writer, None
+        if writer is not None:
+            writer.close()
+        with self._lock:
+            connections, self._connections = self._connections, []
+            self._local = threading.local()
+        for connection in connections:
+            connection.close()
+
+
+_database = Database()
+
+
+def get_database() -> Database:
+    """Get the default database used by Patient and Lab."""
+    return _database
+
+
+def set_database(database: str | Database) -> Database:
+    """Point the default database at a new path or handle."""
+    global _database
+    new_database = (
+        database if isinstance(database, Database) else Database(database)
+    )
+    if new_database is not _database:
+        _database.close()
+    _database = new_database
+    return _database
+
+
+COMPARISONS: dict[str, Callable[[Any, Any], Any]] = {
+    "<": lt,
+    "<=": le,
+    ">": gt,
+    ">=": ge,
+    "==": eq,
+    "!=": ne,
+}
+
+
+def check_operator(operator: str) -> str:
+    """Validate a comparison operator, returning it for use in sql."""
+    if operator not in COMPARISONS:
+        raise ValueError(
+            f"Operator '{operator}' is not one of {list(COMPARISONS)}."
         )
-        recieved = pat_dob_info.fetchall()
-        connection.close()
-        time = str(recieved[0][1])
-        return time
+    return operator
+
+
+def check_threshold(value: float | str) -> float:
+    """Convert a comparison threshold to a float."""
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"Threshold '{value}' is not a number.")
+
+
+LAB_SELECT = """SELECT LabID, PatientID, LabName, LabValue, LabUnits,
+    LabDateTime, LabEpoch FROM Labs"""
+MAX_QUERY_PARAMETERS = 900  # stays under sqlite's default variable limit
+
+
+@dataclass(slots=True)
+class Lab:
+    """Lab class.
+
+    Labs built by Patient.labs are hydrated with every column from a single
+    query. A Lab built from just a lab_id is lazy and loads all of its
+    columns in one query on first access.
+    """
+
+    lab_id: int
+    db: Database = field(
+        default_factory=get_database, repr=False, compare=False
+    )
+    pat_id: str | None = None
+    _name: str | None = field(default=None, repr=False)
+    _value: float | None = field(default=None, repr=False)
+    _units: str | None = field(default=None, repr=False)
+    _time: str | None = field(default=None, repr=False)
+    _epoch: int | None = field(default=None, repr=False)
+
+    @classmethod
+    def from_row(cls, row: tuple[Any, ...], db: Database) -> "Lab":
+        """Build a hydrated lab from a LAB_SELECT row."""
+        lab_id, pat_id, name, value, units, time, epoch = row
+        return cls(
+            lab_id,
+            db,
+            pat_id,
+            str(name),
+            float(value),
+            str(units),
+            str(time),
+            epoch,
+        )
+
+    def _load(self) -> "Lab":
+        """Fill every column of a lazy lab with one query."""
+        recieved = self.db.execute(
+            LAB_SELECT + " WHERE LabID = ?", (self.lab_id,)
+        )
+        loaded = Lab.from_row(recieved[0], self.db)
+        self.pat_id = loaded.pat_id
+        self._name = loaded._name
+        self._value = loaded._value
+        self._units = loaded._units
+        self._time = loaded._time
+        self._epoch = loaded._epoch
+        return loaded
+
+    @property
+    def time(self) -> str:
+        """Get lab time."""
+        if self._time is None:
+            return self._load().time
+        return self._time
+
+    @property
+    def datetime(self) -> datetime.datetime:
+        """Get lab time as a datetime, parsing only rows loaded untyped."""
+        if self._time is None:
+            return self._load().datetime
+        if self._epoch is None:
+            return parse_timestamp(self._time)
+        return from_epoch(self._epoch)
 
     @property
     def value(self) -> float:
         """Get lab value."""
-        connection = sqlite3.connect("ehr.db")
-        cursor = connection.cursor()
-        pat_dob_info = cursor.execute(
-            f"""SELECT LabID, LabValue
-            FROM Labs
-            WHERE LabID = ?""",
-            (self.lab_id,),
-        )
-        recieved = pat_dob_info.fetchall()
-        connection.close()
-        value = float(recieved[0][1])
-        return value
+        if self._value is None:
+            return self._load().value
+        return self._value
 
     @property
     def units(self) -> str:
         """Get unit."""
-        connection = sqlite3.connect("ehr.db")
-        cursor = connection.cursor()
-        pat_dob_info = cursor.execute(
-            f"""SELECT LabID, LabUnits
-            FROM Labs
-            WHERE LabID = ?""",
-            (self.lab_id,),
-        )
-        recieved = pat_dob_info.fetchall()
-        connection.close()
-        units = str(recieved[0][1])
-        return units
+        if self._units is None:
+            return self._load().units
+        return self._units
 
     @property
     def name(self) -> str:
         """Get lab name."""
-        connection = sqlite3.connect("ehr.db")
-        cursor = connection.cursor()
-        pat_dob_info = cursor.execute(
-            f"""SELECT LabID, LabUnits
-            FROM Labs
-            WHERE LabID = ?""",
-            (self.lab_id,),
+        if self._name is None:
+            return self._load().name
+        return self._name
+
+
+def group_labs(labs: list[Lab]) -> dict[str, list[Lab]]:
+    """Organize labs into a dictionary by lab name."""
+    pat_labs: dict[str, list[Lab]] = dict()
+    for lab in labs:  # O(J)
+        if lab.name in pat_labs.keys():
+            pat_labs[lab.name].append(lab)
+        else:
+            pat_labs[lab.name] = [lab]
+    return pat_labs
+
+
+class LabSummary(NamedTuple):
+    """Aggregates of one patient's numeric values for one lab name."""
+
+    n_labs: int
+    minimum: float
+    maximum: float
+    mean: float
+    latest_value: float
+    latest_time: datetime.datetime | None
+
+    @classmethod
+    def from_row(cls, row: tuple[Any, ...]) -> "LabSummary":
+        """Build a summary from a LAB_SUMMARY_SELECT row (after its keys)."""
+        n_labs, minimum, maximum, total, latest_value, latest_epoch = row
+        return cls(
+            n_labs,
+            minimum,
+            maximum,
+            total / n_labs,
+            latest_value,
+            None if latest_epoch is None else from_epoch(latest_epoch),
+        )
+
+
+class Admission(NamedTuple):
+    """One admission of a patient, spanned by its first and last labs."""
+
+    admission_id: str
+    first_lab_time: datetime.datetime
+    last_lab_time: datetime.datetime
+    n_labs: int
+
+
+LAB_SUMMARY_SELECT = """SELECT PatientID, LabName, LabCount, LabMin, LabMax,
+    LabSum, LatestValue, LatestEpoch FROM LabSummary"""
+
+
+def load_labs(
+    pat_ids: list[str],
+    database: Database | None = None,
+    start: TimeBound = None,
+    end: TimeBound = None,
+) -> dict[str, dict[str, list[Lab]]]:
+    """Load hydrated labs for a batch of patients.
+
+    Issues one query per MAX_QUERY_PARAMETERS patients instead of one per
+    patient (or one per lab column). Only labs taken in [start, end) are
+    loaded, sorted by time within each lab name.
+    """
+    database = database or get_database()
+    window, window_parameters = time_window(start, end)
+    by_patient: dict[str, list[Lab]] = {pat_id: [] for pat_id in pat_ids}
+    for first in range(0, len(pat_ids), MAX_QUERY_PARAMETERS):
+        last = first + MAX_QUERY_PARAMETERS
+        batch = pat_ids[first:last]
+        placeholders = ", ".join("?" * len(batch))
+        rows = database.execute(
+            LAB_SELECT
+            + f""" WHERE PatientID IN ({placeholders}){window}
+            ORDER BY PatientID, LabName, LabEpoch""",
+            tuple(batch) + window_parameters,
+        )  # O(P log I + J) with idx_labs_patient
+        for row in rows:
+            by_patient[row[1]].append(Lab.from_row(row, database))
+    return {pat_id: group_labs(labs) for pat_id, labs in by_patient.items()}
+
+
+def canonical_units(
+    lab_name: str, database: Database | None = None
+) -> str | None:  # O(log I)
+    """Get the units thresholds and summaries for lab_name are in."""
+    recieved = (database or get_database()).execute(
+        """SELECT CanonicalUnits FROM UnitConversions
+        WHERE LabName = ?
+        LIMIT 1""",
+        (lab_name,),
+    )
+    return recieved[0][0] if recieved else None
+
+
+def birth_datetime(
+    pat_id: str, dob: str, dob_epoch: int | None
+) -> datetime.datetime:
+    """Get a DOB from its epoch, parsing the text only for untyped rows."""
+    if dob_epoch is not None:
+        return from_epoch(dob_epoch)
+    try:
+        return parse_timestamp(dob)
+    except ValueError:
+        raise ValueError(
+            f"DOB '{dob}' for patient {pat_id} is incorrectly \
+                formatted"
         )
-        recieved = pat_dob_info.fetchall()
-        connection.close()
-        name = str(recieved[0][1])
-        return name
 
 
 @dataclass
@@ -146,60 +1076,56 @@ class Patient:
     """Patient Class."""
 
     pat_id: str
+    db: Database = field(
+        default_factory=get_database, repr=False, compare=False
+    )
+
+    def _demographics(self) -> tuple[Any, ...]:
+        """Get the patient's Patients row, memoized in the db cache."""
+        return self.db.cached(
+            self.pat_id,
+            "demographics",
+            lambda: self.db.execute(
+                """SELECT PatientDateOfBirth, PatientBirthEpoch,
+                PatientGender, PatientRace, PatientMaritalStatus,
+                PatientLanguage, PatientPopulationPercentageBelowPoverty
+                FROM Patients
+                WHERE PatientID = ?""",
+                (self.pat_id,),
+            )[0],
+        )
 
     @property
     def dob(self) -> datetime.datetime:
         """Pateint DOB."""
-        connection = sqlite3.connect("ehr.db")
-        cursor = connection.cursor()
-        pat_dob_info = cursor.execute(
-            f"""SELECT PatientDateOfBirth
-            FROM Patients
-            WHERE PatientID = ?""",
-            (self.pat_id,),
-        )
-        recieved = pat_dob_info.fetchall()
-        connection.close()
-        dob = recieved[0][0]
-        try:
-            return datetime.datetime.strptime(dob, "%Y-%m-%d %H:%M:%S.%f")
-        except ValueError:
-            raise ValueError(
-                f"DOB '{dob}' for patient {self.pat_id} is incorrectly \
-                    formatted"
-            )
+        dob, dob_epoch = self._demographics()[:2]
+        return birth_datetime(self.pat_id, dob, dob_epoch)
 
     @property
     def gender(self) -> str:
         """Patient gender."""
-        connection = sqlite3.connect("ehr.db")
-        cursor = connection.cursor()
-        pat_dob_info = cursor.execute(
-            f"""SELECT PatientGender
-            FROM Patients
-            WHERE PatientID = ?""",
-            (self.pat_id,),
-        )
-        recieved = pat_dob_info.fetchall()
-        connection.close()
-        gender = str(recieved[0][0])
-        return gender
+        return str(self._demographics()[2])
 
     @property
     def race(self) -> str:
         """Patient race."""
-        connection = sqlite3.connect("ehr.db")
-        cursor = connection.cursor()
-        pat_dob_info = cursor.execute(
-            f"""SELECT PatientRace
-            FROM Patients
-            WHERE PatientID = ?""",
-            (self.pat_id,),
-        )
-        recieved = pat_dob_info.fetchall()
-        connection.close()
-        race = str(recieved[0][0])
-        return race
+        return str(self._demographics()[3])
+
+    @property
+    def marital_status(self) -> str:
+        """Patient marital status."""
+        return str(self._demographics()[4])
+
+    @property
+    def language(self) -> str:
+        """Patient language."""
+        return str(self._demographics()[5])
+
+    @property
+    def poverty_percentage(self) -> float | None:
+        """Percentage of the patient's population below the poverty line."""
+        percentage: float | None = self._demographics()[6]
+        return percentage
 
     @property
     def age(self) -> int:  # O(1)
@@ -213,95 +1139,229 @@ class Patient:
     @property
     def labs(self) -> dict[str, list[Lab]]:
         """Get patient labs and organize into dictionary by lab name."""
-        connection = sqlite3.connect("ehr.db")
-        cursor = connection.cursor()
-        lab_info_ex = cursor.execute("""SELECT LabID, LabName FROM Labs""")
-        lab_info = lab_info_ex.fetchall()
-        connection.close()
+        return self.load_labs()
+
+    def load_labs(
+        self,
+        lazy: bool = False,
+        start: TimeBound = None,
+        end: TimeBound = None,
+    ) -> dict[str, list[Lab]]:
+        """Load patient labs by lab name, sorted by time.
+
+        Labs are hydrated from one query (memoized in the db cache) unless
+        lazy is set, in which case only ids are fetched and each lab loads
+        its columns on first use. With start or end only labs taken in
+        [start, end) are loaded, using a range scan of the index.
+        """
+        if not lazy and start is None and end is None:
+            cached_labs = self.db.cached(
+                self.pat_id,
+                "labs",
+                lambda: load_labs([self.pat_id], self.db)[self.pat_id],
+                lambda grouped: sum(map(len, grouped.values())),
+            )
+            return {name: list(labs) for name, labs in cached_labs.items()}
+        if not lazy:
+            return load_labs([self.pat_id], self.db, start, end)[self.pat_id]
+        window, window_parameters = time_window(start, end)
+        lab_info = self.db.execute(
+            f"""SELECT LabID, LabName
+            FROM Labs
+            WHERE PatientID = ?{window}
+            ORDER BY LabName, LabEpoch""",
+            (self.pat_id,) + window_parameters,
+        )  # O(log I + J) with idx_labs_patient
         pat_labs: dict[str, list[Lab]] = dict()
-        for lab in lab_info:
-            lab_id = lab[0]
-            lab_name = lab[1]
-            if lab_name in pat_labs.keys():
-                pat_labs[lab_name].append(Lab(lab_id))
-            else:
-                pat_labs[lab_name] = [Lab(lab_id)]
+        for lab_id, lab_name in lab_info:
+            pat_labs.setdefault(lab_name, []).append(Lab(lab_id, self.db))
         return pat_labs
 
     def is_sick(
-        self, lab_name: str, operator: str, value: float
-    ) -> bool:  # O(J)
-        """Check if patient is sick."""
-        lab_values = self.labs[lab_name]  # O(1)
-        try:
-            sick_list = [
-                eval(str(lab_value.value) + operator + str(value))  # O(J)
-                for lab_value in lab_values
-            ]
-        except SyntaxError:
-            raise ValueError(
-                "Lab values for patient '{self.pat_id}' lab '{lab_name}' are \
-                    not validly formatted."
-            )  # O(1)
-        return any(sick_list)  # O(1)
+        self,
+        lab_name: str,
+        operator: str,
+        value: float,
+        start: TimeBound = None,
+        end: TimeBound = None,
+    ) -> bool:  # O(log I + J) worst case, stops at the first match
+        """Check if patient is sick.
+
+        The comparison runs inside sqlite as an EXISTS query, so it stops at
+        the first matching lab instead of pulling every value into Python.
+        Values are compared in the lab's canonical units (see
+        canonical_units); non-numeric values and units without a known
+        conversion never match. With start or end only labs taken in
+        [start, end) are considered.
+        """
+        sql_operator = check_operator(operator)
+        threshold = check_threshold(value)
+        window, window_parameters = time_window(start, end)
+        recieved = self.db.execute(
+            f"""SELECT EXISTS (
+                SELECT 1
+                FROM Labs
+                WHERE PatientID = ?
+                AND LabName = ?{window}
+                AND LabCanonicalValue {sql_operator} ?)""",
+            (self.pat_id, lab_name) + window_parameters + (threshold,),
+        )
+        return bool(recieved[0][0])
 
     def add_labs(
-        self, lab_name: str, value: float, units: str, time: str
-    ) -> None:  # O(1)
-        """Add lab to patient profile."""
-        connection = sqlite3.connect("ehr.db")
-        cursor = connection.cursor()
-        lab_ids_ex = cursor.execute("""SELECT LabID FROM Labs""")
-        lab_ids = lab_ids_ex.fetchall()
-        try:
-            max_lab_id = max([lab_id[0] for lab_id in lab_ids])
-        except ValueError:
-            max_lab_id = 0
-        cursor.execute(
-            """INSERT INTO Labs VALUES (?, ?, ?, ?, ?, ?)""",
+        self,
+        lab_name: str,
+        value: float,
+        units: str,
+        time: str,
+        admission_id: str | None = None,
+    ) -> None:  # O(log I)
+        """Add lab to patient profile.
+
+        The LabID is allocated by sqlite as the table's integer primary key.
+        """
+        self.add_labs_bulk([(lab_name, value, units, time)], admission_id)
+
+    def add_labs_bulk(
+        self,
+        labs: Iterable[tuple[str, float, str, str]],
+        admission_id: str | None = None,
+    ) -> int:  # O(K log I)
+        """Add many (lab_name, value, units, time) labs in one transaction.
+
+        Returns the number of labs added. Raises ValueError, adding none of
+        the labs, if any time or value is malformed.
+        """
+        self.db.prepare_lab_writes()
+        added = self.db.write(
+            LAB_INSERT_CONVERTED,
             (
-                max_lab_id + 1,
-                self.pat_id,
-                lab_name,
-                value,
-                units,
-                time,
+                (
+                    self.pat_id,
+                    admission_id,
+                    lab_name,
+                    to_lab_value(str(value)),
+                    units,
+                    time,
+                    to_epoch(time),
+                )
+                for lab_name, value, units, time in labs
             ),
         )
-        connection.commit()
-        connection.close()
+        self.db.cache.invalidate(self.pat_id)
+        return added
 
-    def get_age_at_first_lab(self) -> int:  # O(J)
-        """Get patient age at first lab."""
-        times = []
-        for key, item in self.labs.items():  # O(J)
+    def lab_summary(self, lab_name: str) -> LabSummary | None:  # O(log I)
+        """Get lab count, min, max, mean and latest value for one lab name.
+
+        Read from the materialized LabSummary table rather than the labs
+        themselves, in the lab's canonical units; None if the patient has
+        no convertible numeric values for it.
+        """
+        recieved = self.db.execute(
+            LAB_SUMMARY_SELECT + " WHERE PatientID = ? AND LabName = ?",
+            (self.pat_id, lab_name),
+        )
+        return LabSummary.from_row(recieved[0][2:]) if recieved else None
+
+    def lab_summaries(self) -> dict[str, LabSummary]:  # O(log I + names)
+        """Get the lab summary of every lab name the patient has."""
+        recieved = self.db.execute(
+            LAB_SUMMARY_SELECT + " WHERE PatientID = ? ORDER BY LabName",
+            (self.pat_id,),
+        )
+        return {row[1]: LabSummary.from_row(row[2:]) for row in recieved}
+
+    def admissions(self) -> list[Admission]:  # O(log I + admissions)
+        """Get the patient's admissions in order of their first lab."""
+        recieved = self.db.execute(
+            """SELECT AdmissionID, FirstLabEpoch, LastLabEpoch,
+            AdmissionLabCount
+            FROM Admissions
+            WHERE PatientID = ?
+            ORDER BY FirstLabEpoch, AdmissionID""",
+            (self.pat_id,),
+        )
+        return [
+            Admission(admission_id, from_epoch(first), from_epoch(last), n)
+            for admission_id, first, last, n in recieved
+        ]
+
+    def admission_labs(
+        self, admission_id: str
+    ) -> dict[str, list[Lab]]:  # O(log I + J)
+        """Get the labs of one admission by lab name, sorted by time."""
+        recieved = self.db.execute(
+            LAB_SELECT
+            + """ WHERE PatientID = ? AND AdmissionID = ?
+            ORDER BY LabName, LabEpoch""",
+            (self.pat_id, str(admission_id)),
+        )  # with idx_labs_admission
+        return group_labs([Lab.from_row(row, self.db) for row in recieved])
+
+    def get_age_at_first_lab(self) -> int:  # O(log I)
+        """Get patient age at first lab.
+
+        Computed from one MIN() aggregate over the (PatientID, LabEpoch)
+        index and the patient's typed DOB.
+        """
+        recieved = self.db.execute(
+            """SELECT MIN(LabEpoch)
+            FROM Labs
+            WHERE PatientID = ?""",
+            (self.pat_id,),
+        )  # O(log I) with idx_labs_patient_epoch
+        min_lab_epoch = recieved[0][0]
+        if min_lab_epoch is None:  # no labs, or none with a typed epoch
+            recieved = self.db.execute(
+                """SELECT MIN(LabDateTime)
+                FROM Labs
+                WHERE PatientID = ?""",
+                (self.pat_id,),
+            )
+            min_lab_time = recieved[0][0]
+            if min_lab_time is None:
+                raise ValueError(f"Patient {self.pat_id} has no labs.")
             try:
-                times.extend(
-                    [
-                        datetime.datetime.strptime(
-                            lab.time, "%Y-%m-%d %H:%M:%S.%f"
-                        )
-                        for lab in item
-                    ]
-                )  # O(J)
+                min_lab_epoch = to_epoch(min_lab_time)
             except ValueError:
                 raise ValueError(
-                    "Lab time values for patient {self.pat_id} \
-                        lab {key} are not validly formatted."
+                    f"Lab time values for patient {self.pat_id} \
+                        are not validly formatted."
                 )  # O(1)
-        min_lab_date = min(times)  # O(J)
+        min_lab_date = from_epoch(min_lab_epoch)  # O(1)
         pat_age_at_first = (
             (min_lab_date - self.dob).total_seconds() / 60 / 60 / 24 / 365.25
         )  # O(1)
         return int(pat_age_at_first)  # O(1)
 
-    def get_lab_test_values(self, lab_name: str) -> str | list[float]:  # O(J)
-        """Get patient lab for specific test if exists."""
-        if lab_name in self.labs.keys():
+    def get_lab_test_values(
+        self,
+        lab_name: str,
+        start: TimeBound = None,
+        end: TimeBound = None,
+    ) -> str | list[float]:  # O(J)
+        """Get patient lab for specific test if exists, sorted by time.
+
+        With start or end only labs taken in [start, end) are returned.
+        """
+        if start is not None or end is not None:
+            window, window_parameters = time_window(start, end)
+            values = self.db.execute(
+                f"""SELECT LabValue
+                FROM Labs
+                WHERE PatientID = ?
+                AND LabName = ?{window}
+                ORDER BY LabEpoch""",
+                (self.pat_id, lab_name) + window_parameters,
+            )  # O(log I + J) with idx_labs_patient
+            if not values:
+                return f"Patient has no tests for {lab_name}"
+            return [float(value) for value, in values]
+        labs = self.labs
+        if lab_name in labs.keys():
             try:
-                return [
-                    float(info.value) for info in self.labs[lab_name]
-                ]  # O(J)
+                return [float(info.value) for info in labs[lab_name]]  # O(J)
             except ValueError:
                 raise ValueError(
                     "Lab values for patient '{self.pat_id}' lab '{lab_name}' \
@@ -311,93 +1371,1162 @@ class Patient:
             return f"Patient has no tests for {lab_name}"  # O(1)
 
 
-# Big O: O(MJ + NI + J^2)
-def parse_data(subjects_file_name: str, labs_file_name: str) -> None:
-    """Parse read files into dictionary of patient classes."""
-    # reads data files
-    try:
-        subject_data = read_data(subjects_file_name)  # O(MJ)
-    except ValueError:
-        ValueError("Incorrect subjects file path.")
+@dataclass
+class Cohort:
+    """Cohort of patients for set-based queries.
+
+    A cohort without pat_ids covers every patient in the database.
+    """
+
+    pat_ids: list[str] | None = None
+    db: Database = field(
+        default_factory=get_database, repr=False, compare=False
+    )
+    fetch_size: int = 10_000
+
+    def _batches(
+        self, column: str = "PatientID"
+    ) -> Iterator[tuple[str, tuple[str, ...]]]:
+        """Yield (sql filter, parameters) pairs covering the cohort."""
+        if self.pat_ids is None:
+            yield "", ()
+            return
+        for start in range(0, len(self.pat_ids), MAX_QUERY_PARAMETERS):
+            end = start + MAX_QUERY_PARAMETERS
+            batch = tuple(self.pat_ids[start:end])
+            placeholders = ", ".join("?" * len(batch))
+            yield f"AND {column} IN ({placeholders})", batch
+
+    def _stream(
+        self, sql: str, parameters: tuple[Any, ...]
+    ) -> Iterator[tuple[Any, ...]]:
+        """Stream query rows in fetch_size chunks."""
+        return self.db.stream(sql, parameters, self.fetch_size)
+
+    def is_sick(
+        self,
+        lab_name: str,
+        operator: str,
+        value: float,
+        start: TimeBound = None,
+        end: TimeBound = None,
+    ) -> Iterator[str]:  # O(log I + K) with idx_labs_name_canonical
+        """Stream ids of cohort patients with any lab meeting the threshold.
+
+        Evaluated as one set-based query (per batch of seed ids) rather
+        than one is_sick call per patient, in canonical units. With start
+        or end only labs taken in [start, end) are considered.
+        """
+        sql_operator = check_operator(operator)
+        threshold = check_threshold(value)
+        window, window_parameters = time_window(start, end)
+        for pat_filter, batch in self._batches():
+            rows = self._stream(
+                f"""SELECT DISTINCT PatientID
+                FROM Labs
+                WHERE LabName = ?
+                AND LabCanonicalValue {sql_operator} ?{window}
+                {pat_filter}
+                ORDER BY PatientID""",
+                (lab_name, threshold) + window_parameters + batch,
+            )
+            for row in rows:
+                yield row[0]
+
+    def lab_summary(
+        self, lab_name: str
+    ) -> Iterator[tuple[str, LabSummary]]:  # O(log I + K)
+        """Stream (patient id, lab summary) for one lab name.
+
+        Patients without numeric values for the lab are skipped.
+        """
+        for pat_filter, batch in self._batches():
+            rows = self._stream(
+                LAB_SUMMARY_SELECT
+                + f"""
+                WHERE LabName = ?
+                {pat_filter}
+                ORDER BY PatientID""",
+                (lab_name,) + batch,
+            )  # with idx_lab_summary_name
+            for row in rows:
+                yield row[0], LabSummary.from_row(row[2:])
+
+    def age_at_first_lab(self) -> Iterator[tuple[str, int]]:
+        """Stream (patient id, age at first lab) for the cohort.
+
+        One grouped query per batch of seed ids; patients without labs or
+        without a typed DOB are skipped.
+        """
+        for pat_filter, batch in self._batches("Patients.PatientID"):
+            rows = self._stream(
+                f"""SELECT Patients.PatientID,
+                CAST(
+                    (MIN(Labs.LabEpoch) - Patients.PatientBirthEpoch)
+                    / {MICROSECONDS_PER_YEAR}
+                    AS INTEGER
+                )
+                FROM Patients
+                JOIN Labs ON Labs.PatientID = Patients.PatientID
+                WHERE Labs.LabEpoch IS NOT NULL
+                AND Patients.PatientBirthEpoch IS NOT NULL
+                {pat_filter}
+                GROUP BY Patients.PatientID
+                ORDER BY Patients.PatientID""",
+                batch,
+            )
+            for pat_id, age in rows:
+                yield pat_id, age
+
+    def _births(
+        self,
+    ) -> tuple[list[str], list[tuple[Any, Any]], npt.NDArray[np.int64]]:
+        """Get ids, (gender, race) pairs and birth epochs in one scan.
+
+        Patients without a typed DOB are skipped.
+        """
+        pat_ids: list[str] = []
+        groups: list[tuple[Any, Any]] = []
+        epochs: list[int] = []
+        for pat_filter, batch in self._batches():
+            rows = self._stream(
+                f"""SELECT PatientID, PatientGender, PatientRace,
+                PatientBirthEpoch
+                FROM Patients
+                WHERE PatientBirthEpoch IS NOT NULL
+                {pat_filter}
+                ORDER BY PatientID""",
+                batch,
+            )
+            for pat_id, gender, race, epoch in rows:
+                pat_ids.append(pat_id)
+                groups.append((gender, race))
+                epochs.append(epoch)
+        return pat_ids, groups, np.array(epochs, dtype=np.int64)
+
+    def ages(
+        self, as_of: TimeBound = None
+    ) -> tuple[list[str], npt.NDArray[np.int64]]:  # O(P)
+        """Get (patient ids, ages in whole years at as_of) for the cohort.
+
+        One query per batch of seed ids and one vectorized pass, against a
+        fixed reference time (default now, read once). Patients without a
+        typed DOB are skipped.
+        """
+        pat_ids, _, epochs = self._births()
+        return pat_ids, ages_at(epochs, as_of)
+
+    def age_histogram(
+        self, bucket_years: int = 10, as_of: TimeBound = None
+    ) -> dict[tuple[Any, Any], dict[int, int]]:  # O(P)
+        """Count patients per age bucket, grouped by (gender, race).
+
+        Buckets are keyed by their lowest age, so with bucket_years=10 key
+        20 counts ages 20 to 29. Empty buckets are left out.
+        """
+        if bucket_years < 1:
+            raise ValueError(f"Bucket width '{bucket_years}' is not >= 1.")
+        _, groups, epochs = self._births()
+        if not groups:
+            return {}
+        codes: dict[tuple[Any, Any], int] = {}
+        group_codes = np.array(
+            [codes.setdefault(group, len(codes)) for group in groups]
+        )
+        buckets = ages_at(epochs, as_of) // bucket_years
+        lowest = int(buckets.min())
+        width = int(buckets.max()) - lowest + 1
+        counts = np.bincount(
+            group_codes * width + buckets - lowest,
+            minlength=len(codes) * width,
+        ).reshape(len(codes), width)
+        histogram = {
+            group: {
+                (lowest + bucket) * bucket_years: int(counts[code, bucket])
+                for bucket in np.flatnonzero(counts[code]).tolist()
+            }
+            for group, code in codes.items()
+        }
+        return dict(sorted(histogram.items(), key=lambda item: str(item[0])))
+
+
+SUBJECT_COLUMNS = [
+    "PatientID",
+    "PatientGender",
+    "PatientDateOfBirth",
+    "PatientRace",
+    "PatientMaritalStatus",
+    "PatientLanguage",
+    "PatientPopulationPercentageBelowPoverty",
+]
+LAB_COLUMNS = [
+    "PatientID",
+    "AdmissionID",
+    "LabName",
+    "LabValue",
+    "LabUnits",
+    "LabDateTime",
+]
+
+BAD_ROW_MODES = {"quarantine", "raise"}
+LOAD_MODES = {"replace", "append"}
+JOURNAL_MODES = {"DELETE", "TRUNCATE", "PERSIST", "MEMORY", "WAL", "OFF"}
+SYNCHRONOUS_MODES = {"OFF", "NORMAL", "FULL", "EXTRA"}
+
+
+@dataclass
+class LoadOptions:
+    """Tunable settings for bulk loading files into sqlite.
+
+    cache_size follows sqlite semantics: negative values are KiB, positive
+    values are pages. bad_rows is "quarantine" to divert rows with a
+    malformed date or value into the Quarantine table, or "raise" to abort
+    the load. mode is "replace" to rebuild the tables or "append" to merge
+    rows into the existing tables by natural key.
+    """
+
+    chunk_size: int = 50_000
+    journal_mode: str = "MEMORY"
+    synchronous: str = "OFF"
+    cache_size: int = -65_536
+    bad_rows: str = "quarantine"
+    mode: str = "replace"
+
+    def apply(self, cursor: sqlite3.Cursor) -> None:
+        """Apply pragmas to a connection (must be outside a transaction)."""
+        journal_mode = self.journal_mode.upper()
+        synchronous = self.synchronous.upper()
+        if journal_mode not in JOURNAL_MODES:
+            raise ValueError(f"Unknown journal mode '{self.journal_mode}'.")
+        if synchronous not in SYNCHRONOUS_MODES:
+            raise ValueError(f"Unknown synchronous mode '{self.synchronous}'.")
+        if self.bad_rows not in BAD_ROW_MODES:
+            raise ValueError(f"Unknown bad row mode '{self.bad_rows}'.")
+        if self.mode not in LOAD_MODES:
+            raise ValueError(f"Unknown load mode '{self.mode}'.")
+        cursor.execute(f"PRAGMA journal_mode = {journal_mode}")
+        cursor.execute(f"PRAGMA synchronous = {synchronous}")
+        cursor.execute(f"PRAGMA cache_size = {int(self.cache_size)}")
+
+
+def to_percentage(value: str) -> float | None:
+    """Convert a percentage string to a float, or None if blank."""
+    if not value.strip():
+        return None
+    percentage = float(value)
+    if not 0 <= percentage <= 100:
+        raise ValueError(f"Percentage '{value}' is not between 0 and 100.")
+    return percentage
+
+
+class FieldError(ValueError):
+    """A bad optional field; row is the typed row with that field NULL."""
+
+    def __init__(self, message: str, row: tuple[Any, ...]):
+        """Keep the typed row so only the field is quarantined."""
+        super().__init__(message)
+        self.row = row
+
+
+def with_percentage(typed: tuple[Any, ...], value: str) -> tuple[Any, ...]:
+    """Append a poverty percentage, raising FieldError if it is invalid."""
     try:
-        lab_data = read_data(labs_file_name)  # O(NI)
-    except ValueError:
-        ValueError("Incorrect labs file path.")
-
-    # reorders columns for proper variable assignent
-    subject_values = reorder_columns(
-        column_order=[
-            "PatientID",
-            "PatientGender",
-            "PatientDateOfBirth",
-            "PatientRace",
-            "PatientMaritalStatus",
-            "PatientLanguage",
-            "PatientPopulationPercentageBelowPoverty",
-        ],
-        list_of_list=seperate_lines(subject_data),
-    )  # O(MJ) + O(MJ)
-    lab_values = reorder_columns(
-        column_order=[
-            "PatientID",
-            "AdmissionID",
-            "LabName",
-            "LabValue",
-            "LabUnits",
-            "LabDateTime",
-        ],
-        list_of_list=seperate_lines(lab_data),
-    )  # O(NI) + O(NI)
-
-    # creates sql database
-    connection = sqlite3.connect("ehr.db")
-    cursor = connection.cursor()
-    cursor.execute("DROP TABLE IF EXISTS Patients")
-    cursor.execute("DROP TABLE IF EXISTS Labs")
+        return typed + (to_percentage(value),)
+    except ValueError as error:
+        raise FieldError(
+            f"PatientPopulationPercentageBelowPoverty: {error}",
+            typed + (None,),
+        )
+
+
+def type_subject_row(row: list[str]) -> tuple[Any, ...]:
+    """Convert a reordered subjects row to a typed Patients row."""
+    return with_percentage(
+        (row[0], row[1], row[2], row[3], to_epoch(row[2]), row[4], row[5]),
+        row[6],
+    )
+
+
+def type_lab_row(row: list[str]) -> tuple[Any, ...]:
+    """Convert a reordered labs row to a typed Labs row."""
+    return (
+        row[0],
+        row[1],
+        row[2],
+        to_lab_value(row[3]),
+        row[4],
+        row[5],
+        to_epoch(row[5]),
+    )
+
+
+def type_rows(
+    chunk: list_of_list,
+    type_row: Callable[[list[str]], tuple[Any, ...]],
+    table: str,
+    quarantine: list[tuple[str, str, str]] | None,
+) -> list[tuple[Any, ...]]:
+    """Type a chunk of rows, quarantining bad rows or raising if None.
+
+    A row with only a bad optional field (FieldError) is kept with that
+    field NULL and the field's value is quarantined.
+    """
+    typed = []
+    for row in chunk:
+        try:
+            if isinstance(row, ShortRow):
+                raise ValueError(f"Row has only {len(row)} fields.")
+            typed.append(type_row(row))
+        except ValueError as error:
+            if quarantine is None:
+                raise ValueError(f"Bad {table} row {row}: {error}")
+            if isinstance(error, FieldError):
+                typed.append(error.row)
+            quarantine.append((table, "\t".join(row), str(error)))
+    return typed
+
+
+def create_indexes(cursor: sqlite3.Cursor) -> None:
+    """Create the indexes backing per-patient and cohort lab lookups."""
+    cursor.execute(
+        """CREATE INDEX IF NOT EXISTS idx_labs_patient
+        ON Labs(PatientID, LabName, LabEpoch)"""
+    )
+    cursor.execute(
+        """CREATE INDEX IF NOT EXISTS idx_labs_name_canonical
+        ON Labs(LabName, LabCanonicalValue)"""
+    )
+    cursor.execute(
+        """CREATE INDEX IF NOT EXISTS idx_labs_patient_epoch
+        ON Labs(PatientID, LabEpoch)"""
+    )
     cursor.execute(
-        """CREATE TABLE Labs(
-                LabID VARCHAR PRIMARY KEY,
+        """CREATE INDEX IF NOT EXISTS idx_labs_admission
+        ON Labs(PatientID, AdmissionID, LabName, LabEpoch)"""
+    )
+
+
+TypedChunk = tuple[list[tuple[Any, ...]], list[tuple[str, str, str]]]
+TABLE_FORMATS = {
+    "Patients": (SUBJECT_COLUMNS, SUBJECT_COLUMNS, type_subject_row),
+    "Labs": (LAB_COLUMNS, LAB_COLUMNS, type_lab_row),
+}
+
+
+def type_file(
+    filename: str, table: str, options: LoadOptions
+) -> Iterator[TypedChunk]:
+    """Stream (typed rows, quarantined rows) chunks from a tsv file.
+
+    Columns the table does not store are never decoded.
+    """
+    column_order, used_columns, type_row = TABLE_FORMATS[table]
+    for chunk in mmap_rows(
+        filename, column_order, options.chunk_size, used_columns
+    ):
+        quarantine: list[tuple[str, str, str]] | None = (
+            [] if options.bad_rows == "quarantine" else None
+        )
+        typed = type_rows(chunk, type_row, table, quarantine)
+        yield typed, quarantine or []
+
+
+def type_file_chunks(
+    filename: str, table: str, options: LoadOptions
+) -> list[TypedChunk]:
+    """Type a whole shard; run in worker processes by parse_files."""
+    return list(type_file(filename, table, options))
+
+
+@dataclass
+class LoadReport:
+    """Row counts for one table from a load."""
+
+    inserted: int = 0
+    updated: int = 0
+    skipped: int = 0
+    quarantined: int = 0
+
+
+def create_tables(cursor: sqlite3.Cursor) -> None:
+    """Create the Patients, Labs and Quarantine tables if missing."""
+    cursor.execute(
+        """CREATE TABLE IF NOT EXISTS Labs(
+                LabID INTEGER PRIMARY KEY,
                 PatientID VARCHAR,
                 LabName VARCHAR,
-                LabValue FLOAT,
+                LabValue REAL,
                 LabUnits VARCHAR,
-                LabDateTime TIMESTAMP)"""
+                LabDateTime TIMESTAMP,
+                LabEpoch INTEGER,
+                AdmissionID VARCHAR,
+                LabCanonicalValue REAL)"""
     )
     cursor.execute(
-        """CREATE TABLE Patients(
+        """CREATE TABLE IF NOT EXISTS Patients(
                 PatientID VARCHAR PRIMARY KEY,
                 PatientGender VARCHAR,
                 PatientDateOfBirth TIMESTAMP,
-                PatientRace VARCHAR)"""
+                PatientRace VARCHAR,
+                PatientBirthEpoch INTEGER,
+                PatientMaritalStatus VARCHAR,
+                PatientLanguage VARCHAR,
+                PatientPopulationPercentageBelowPoverty REAL)"""
+    )
+    cursor.execute(
+        """CREATE TABLE IF NOT EXISTS Quarantine(
+                TableName VARCHAR,
+                RowData VARCHAR,
+                Reason VARCHAR)"""
     )
 
-    # adds patient for each patient
 
-    for patient_info in subject_values:
+# (analyte, from units, to units, factor): a value in from units times
+# factor is the value in to units. An empty analyte applies to every lab;
+# otherwise it applies to lab names containing it. Inverses are implied.
+# mEq/L equals mmol/L only for monovalent ions, so it is listed per ion;
+# ions with no fixed valence (phosphate) are left unconverted.
+UNIT_FACTORS = [
+    ("", "g/dL", "mg/dL", 1000.0),
+    ("", "gm/dL", "g/dL", 1.0),
+    ("", "gm/dL", "mg/dL", 1000.0),
+    ("", "g/L", "g/dL", 0.1),
+    ("", "g/L", "mg/dL", 100.0),
+    ("", "mg/L", "mg/dL", 0.1),
+    ("SODIUM", "mEq/L", "mmol/L", 1.0),
+    ("POTASSIUM", "mEq/L", "mmol/L", 1.0),
+    ("CHLORIDE", "mEq/L", "mmol/L", 1.0),
+    ("BICARBONATE", "mEq/L", "mmol/L", 1.0),
+    ("MAGNESIUM", "mEq/L", "mmol/L", 0.5),
+    ("", "k/cumm", "10^3/uL", 1.0),
+    ("", "k/cumm", "10^9/L", 1.0),
+    ("", "10^3/uL", "10^9/L", 1.0),
+    ("CALCIUM", "mEq/L", "mmol/L", 0.5),
+    ("CALCIUM", "mg/dL", "mmol/L", 0.2495),
+    ("CALCIUM", "mg/dL", "mEq/L", 0.499),
+    ("GLUCOSE", "mg/dL", "mmol/L", 0.05551),
+    ("CREATININE", "mg/dL", "umol/L", 88.42),
+    ("BUN", "mg/dL", "mmol/L", 0.357),
+    ("UREA NITROGEN", "mg/dL", "mmol/L", 0.357),
+    ("CHOLESTEROL", "mg/dL", "mmol/L", 0.02586),
+    ("TRIGLYCERIDE", "mg/dL", "mmol/L", 0.01129),
+    ("HEMOGLOBIN", "g/dL", "mmol/L", 0.6206),
+    ("HEMOGLOBIN", "gm/dL", "mmol/L", 0.6206),
+]
+
+
+# (analyte, canonical units): labs whose name contains analyte (the longest
+# match wins) are converted to these units when any of their units can be.
+# Other labs keep their most frequent units when first loaded.
+CANONICAL_UNITS = [
+    ("SODIUM", "mmol/L"),
+    ("POTASSIUM", "mmol/L"),
+    ("CHLORIDE", "mmol/L"),
+    ("BICARBONATE", "mmol/L"),
+    ("CALCIUM", "mg/dL"),
+    ("GLUCOSE", "mg/dL"),
+    ("CREATININE", "mg/dL"),
+    ("BUN", "mg/dL"),
+    ("UREA NITROGEN", "mg/dL"),
+    ("CHOLESTEROL", "mg/dL"),
+    ("TRIGLYCERIDE", "mg/dL"),
+    ("HEMOGLOBIN", "g/dL"),
+    ("ALBUMIN", "g/dL"),
+    ("WHITE BLOOD CELL", "10^3/uL"),
+    ("PLATELET", "10^3/uL"),
+]
+
+
+def unit_factor_rows() -> list[tuple[str, str, str, float]]:
+    """Get UNIT_FACTORS with inverses, as keys matched by unit_key."""
+    rows = []
+    for analyte, from_units, to_units, factor in UNIT_FACTORS:
+        from_key, to_key = from_units.lower(), to_units.lower()
+        rows.append((analyte.upper(), from_key, to_key, factor))
+        rows.append((analyte.upper(), to_key, from_key, 1 / factor))
+    return rows
+
+
+def unit_key(units: str) -> str:
+    """Get sql normalizing units text for comparison."""
+    return f"lower(trim(COALESCE({units}, '')))"
+
+
+def unit_factor(
+    lab_name: str, from_units: str, to_units: str
+) -> float | None:  # O(F)
+    """Get the factor converting lab_name values from_units to to_units."""
+    from_key, to_key = (
+        from_units.strip(" ").lower(),
+        to_units.strip(" ").lower(),
+    )
+    if from_key == to_key:
+        return 1.0
+    matches = [
+        (len(analyte), factor)
+        for analyte, *units, factor in unit_factor_rows()
+        if units == [from_key, to_key] and analyte in lab_name.upper()
+    ]
+    return max(matches)[1] if matches else None
+
+
+def choose_canonical_units(lab_name: str, frequencies: dict[str, int]) -> str:
+    """Pick canonical units for a new lab from counts of its units.
+
+    Mirrors register_units_sql for stores that convert in Python.
+    """
+    catalog = [
+        (len(analyte), units)
+        for analyte, units in CANONICAL_UNITS
+        if analyte in lab_name.upper()
+    ]
+    if catalog:
+        canonical = max(catalog)[1]
+        if any(
+            unit_factor(lab_name, units, canonical) is not None
+            for units in frequencies
+        ):
+            return canonical
+    return min(frequencies, key=lambda units: (-frequencies[units], units))
+
+
+def unit_factor_sql(lab_name: str, from_units: str, to_units: str) -> str:
+    """Get sql for the factor converting from_units to to_units."""
+    return f"""CASE
+        WHEN {unit_key(from_units)} = {unit_key(to_units)}
+        THEN 1.0
+        ELSE (
+            SELECT Factor
+            FROM UnitFactors
+            WHERE FromUnits = {unit_key(from_units)}
+            AND ToUnits = {unit_key(to_units)}
+            AND instr(upper({lab_name}), Analyte) > 0
+            ORDER BY length(Analyte) DESC
+            LIMIT 1
+        )
+    END"""
+
+
+def register_units_sql(source: str) -> str:
+    """Get sql adding UnitConversions rows for new (lab, units) in source.
+
+    A lab name already in UnitConversions keeps its canonical units. A new
+    one takes its UnitCatalog units when any of its units convert to them,
+    else its most frequent units in source. The factor is NULL when
+    UnitFactors has no conversion, so those values never enter thresholds
+    or aggregates.
+    """
+    to_catalog = unit_factor_sql(
+        "Named.LabName", "Named.LabUnits", "Named.CatalogUnits"
+    )
+    return f"""INSERT OR IGNORE INTO UnitConversions
+        SELECT LabName, LabUnits, CanonicalUnits,
+        {unit_factor_sql("LabName", "LabUnits", "CanonicalUnits")}
+        FROM (
+            SELECT Named.LabName, Named.LabUnits,
+            COALESCE(
+                (
+                    SELECT Known.CanonicalUnits
+                    FROM UnitConversions AS Known
+                    WHERE Known.LabName = Named.LabName
+                    LIMIT 1
+                ),
+                CASE
+                    WHEN MAX({to_catalog} IS NOT NULL)
+                    OVER (PARTITION BY Named.LabName)
+                    THEN Named.CatalogUnits
+                END,
+                FIRST_VALUE(Named.LabUnits) OVER (
+                    PARTITION BY Named.LabName
+                    ORDER BY Named.Frequency DESC, Named.LabUnits
+                )
+            ) AS CanonicalUnits
+            FROM (
+                SELECT Pairs.LabName, Pairs.LabUnits, Pairs.Frequency,
+                (
+                    SELECT Catalog.CanonicalUnits
+                    FROM UnitCatalog AS Catalog
+                    WHERE instr(upper(Pairs.LabName), Catalog.Analyte) > 0
+                    ORDER BY length(Catalog.Analyte) DESC
+                    LIMIT 1
+                ) AS CatalogUnits
+                FROM (
+                    SELECT LabName, COALESCE(LabUnits, '') AS LabUnits,
+                    COUNT(*) AS Frequency
+                    FROM {source}
+                    GROUP BY 1, 2
+                ) AS Pairs
+            ) AS Named
+        )"""
+
+
+def canonical_value_sql(row: str) -> str:
+    """Get sql converting the value of row to its canonical units."""
+    return f"""CASE WHEN typeof({row}.LabValue) IN ('integer', 'real')
+        THEN {row}.LabValue * (
+            SELECT Factor
+            FROM UnitConversions
+            WHERE LabName = {row}.LabName
+            AND LabUnits = COALESCE({row}.LabUnits, '')
+        )
+    END"""
+
+
+def create_unit_conversions(cursor: sqlite3.Cursor) -> None:
+    """Build the UnitConversions table and the triggers that apply it.
+
+    UnitConversions maps each (LabName, LabUnits) seen in Labs to the
+    lab's canonical units and a factor, and LabCanonicalValue stores every
+    value converted once at ingest. Thresholds and LabSummary read only
+    that column, so reads never convert units. The table is built with
+    one grouped pass when missing; triggers register new units and
+    convert rows inserted or updated without a canonical value.
+    """
+    cursor.execute(
+        """CREATE TABLE IF NOT EXISTS UnitFactors(
+            Analyte VARCHAR,
+            FromUnits VARCHAR,
+            ToUnits VARCHAR,
+            Factor REAL,
+            PRIMARY KEY (Analyte, FromUnits, ToUnits))"""
+    )
+    cursor.execute("DELETE FROM UnitFactors")
+    cursor.executemany(
+        "INSERT OR REPLACE INTO UnitFactors VALUES(?, ?, ?, ?)",
+        unit_factor_rows(),
+    )
+    cursor.execute(
+        """CREATE TABLE IF NOT EXISTS UnitCatalog(
+            Analyte VARCHAR PRIMARY KEY,
+            CanonicalUnits VARCHAR)"""
+    )
+    cursor.execute("DELETE FROM UnitCatalog")
+    cursor.executemany(
+        "INSERT INTO UnitCatalog VALUES(?, ?)",
+        [(analyte.upper(), units) for analyte, units in CANONICAL_UNITS],
+    )
+    exists = cursor.execute(
+        """SELECT 1 FROM sqlite_master
+        WHERE type = 'table' AND name = 'UnitConversions'"""
+    ).fetchone()
+    if exists is None:
         cursor.execute(
-            "INSERT INTO Patients VALUES(?, ?, ?, ?)",
-            (
-                patient_info[0],  # ID
-                patient_info[1],  # Gender
-                patient_info[2],  # DOB
-                patient_info[3],  # Race
-            ),
+            """CREATE TABLE UnitConversions(
+                LabName VARCHAR,
+                LabUnits VARCHAR,
+                CanonicalUnits VARCHAR,
+                Factor REAL,
+                PRIMARY KEY (LabName, LabUnits))"""
         )
+        cursor.execute(register_units_sql("Labs"))  # O(I log I)
+        cursor.execute(
+            f"""UPDATE Labs
+            SET LabCanonicalValue = {canonical_value_sql("Labs")}"""
+        )  # O(I)
+    new_units = "(SELECT NEW.LabName AS LabName, NEW.LabUnits AS LabUnits)"
+    cursor.execute(
+        f"""CREATE TRIGGER IF NOT EXISTS unit_conversion_insert
+        AFTER INSERT ON Labs
+        WHEN NEW.LabCanonicalValue IS NULL
+        AND typeof(NEW.LabValue) IN ('integer', 'real')
+        AND (
+            SELECT Factor IS NOT NULL
+            FROM UnitConversions
+            WHERE LabName = NEW.LabName
+            AND LabUnits = COALESCE(NEW.LabUnits, '')
+        ) IS NOT 0
+        BEGIN
+            {register_units_sql(new_units)};
+            UPDATE Labs
+            SET LabCanonicalValue = {canonical_value_sql("NEW")}
+            WHERE LabID = NEW.LabID;
+        END"""
+    )
+    cursor.execute(
+        f"""CREATE TRIGGER IF NOT EXISTS unit_conversion_update
+        AFTER UPDATE OF LabName, LabValue, LabUnits ON Labs
+        BEGIN
+            {register_units_sql(new_units)};
+            UPDATE Labs
+            SET LabCanonicalValue = {canonical_value_sql("NEW")}
+            WHERE LabID = NEW.LabID;
+        END"""
+    )
+
+
+def summarize_labs_sql(where: str) -> str:
+    """Get sql inserting LabSummary rows for the labs matching where."""
+    return f"""INSERT INTO LabSummary
+        SELECT PatientID, LabName, COUNT(*), MIN(LabCanonicalValue),
+        MAX(LabCanonicalValue), SUM(LabCanonicalValue),
+        (
+            SELECT Latest.LabCanonicalValue
+            FROM Labs AS Latest
+            WHERE Latest.PatientID = Labs.PatientID
+            AND Latest.LabName = Labs.LabName
+            AND Latest.LabCanonicalValue IS NOT NULL
+            ORDER BY Latest.LabEpoch DESC, Latest.LabID DESC
+            LIMIT 1
+        ),
+        MAX(LabEpoch)
+        FROM Labs
+        WHERE LabCanonicalValue IS NOT NULL
+        AND {where}
+        GROUP BY PatientID, LabName"""
+
 
-    # add lab for each lab
-    unique_id = 0
-    for lab in lab_values:
+def resummarize_sql(row: str) -> str:
+    """Get trigger sql recomputing the LabSummary row of OLD or NEW."""
+    pair = f"PatientID = {row}.PatientID AND LabName = {row}.LabName"
+    return f"""DELETE FROM LabSummary WHERE {pair};
+        {summarize_labs_sql(pair)};"""
+
+
+def create_lab_summary(cursor: sqlite3.Cursor) -> None:
+    """Build the LabSummary table and the triggers that maintain it.
+
+    LabSummary holds one row of aggregates per patient and lab name over
+    the values converted to the lab's canonical units. It is built with
+    one grouped pass over Labs when missing; afterwards an insert (as from
+    add_labs) folds into its row in O(log I) and an update or delete
+    recomputes just the affected row.
+    """
+    exists = cursor.execute(
+        """SELECT 1 FROM sqlite_master
+        WHERE type = 'table' AND name = 'LabSummary'"""
+    ).fetchone()
+    if exists is None:
         cursor.execute(
-            "INSERT INTO Labs VALUES(?, ?, ?, ?, ?, ?)",
-            (
-                unique_id,  # lab_id
-                lab[0],  # ID
-                lab[2],  # LabName
-                lab[3],  # LabValue
-                lab[4],  # LabUnits
-                lab[5],  # LabTime
+            """CREATE TABLE LabSummary(
+                PatientID VARCHAR,
+                LabName VARCHAR,
+                LabCount INTEGER,
+                LabMin REAL,
+                LabMax REAL,
+                LabSum REAL,
+                LatestValue REAL,
+                LatestEpoch INTEGER,
+                PRIMARY KEY (PatientID, LabName))"""
+        )
+        cursor.execute(summarize_labs_sql("1"))  # O(I log I)
+    cursor.execute(
+        """CREATE INDEX IF NOT EXISTS idx_lab_summary_name
+        ON LabSummary(LabName, PatientID)"""
+    )
+    cursor.execute(
+        """CREATE TRIGGER IF NOT EXISTS lab_summary_insert
+        AFTER INSERT ON Labs
+        WHEN NEW.LabCanonicalValue IS NOT NULL
+        BEGIN
+            INSERT INTO LabSummary VALUES(
+                NEW.PatientID, NEW.LabName, 1, NEW.LabCanonicalValue,
+                NEW.LabCanonicalValue, NEW.LabCanonicalValue,
+                NEW.LabCanonicalValue, NEW.LabEpoch
+            )
+            ON CONFLICT (PatientID, LabName) DO UPDATE SET
+                LabCount = LabCount + 1,
+                LabMin = MIN(LabMin, excluded.LabMin),
+                LabMax = MAX(LabMax, excluded.LabMax),
+                LabSum = LabSum + excluded.LabSum,
+                LatestValue = CASE
+                    WHEN excluded.LatestEpoch >= LatestEpoch
+                    OR LatestEpoch IS NULL
+                    THEN excluded.LatestValue
+                    ELSE LatestValue
+                END,
+                LatestEpoch = MAX(
+                    COALESCE(LatestEpoch, excluded.LatestEpoch),
+                    excluded.LatestEpoch
+                );
+        END"""
+    )
+    cursor.execute(
+        f"""CREATE TRIGGER IF NOT EXISTS lab_summary_update
+        AFTER UPDATE OF PatientID, LabName, LabEpoch, LabCanonicalValue
+        ON Labs
+        BEGIN
+            {resummarize_sql("OLD")}
+            {resummarize_sql("NEW")}
+        END"""
+    )
+    cursor.execute(
+        f"""CREATE TRIGGER IF NOT EXISTS lab_summary_delete
+        AFTER DELETE ON Labs
+        BEGIN
+            {resummarize_sql("OLD")}
+        END"""
+    )
+
+
+def summarize_admissions_sql(where: str) -> str:
+    """Get sql inserting Admissions rows for the labs matching where."""
+    return f"""INSERT INTO Admissions
+        SELECT PatientID, AdmissionID, MIN(LabEpoch), MAX(LabEpoch), COUNT(*)
+        FROM Labs
+        WHERE AdmissionID IS NOT NULL
+        AND LabEpoch IS NOT NULL
+        AND {where}
+        GROUP BY PatientID, AdmissionID"""
+
+
+def readmit_sql(row: str) -> str:
+    """Get trigger sql recomputing the Admissions row of OLD or NEW."""
+    pair = f"PatientID = {row}.PatientID AND AdmissionID = {row}.AdmissionID"
+    return f"""DELETE FROM Admissions WHERE {pair};
+        {summarize_admissions_sql(pair)};"""
+
+
+def create_admissions(cursor: sqlite3.Cursor) -> None:
+    """Build the Admissions dimension and the triggers that maintain it.
+
+    Admissions has one row per (PatientID, AdmissionID) seen in Labs with
+    the admission's first and last lab times and lab count. Like
+    LabSummary it is built in one grouped pass when missing and kept
+    current by triggers on Labs.
+    """
+    exists = cursor.execute(
+        """SELECT 1 FROM sqlite_master
+        WHERE type = 'table' AND name = 'Admissions'"""
+    ).fetchone()
+    if exists is None:
+        cursor.execute(
+            """CREATE TABLE Admissions(
+                PatientID VARCHAR,
+                AdmissionID VARCHAR,
+                FirstLabEpoch INTEGER,
+                LastLabEpoch INTEGER,
+                AdmissionLabCount INTEGER,
+                PRIMARY KEY (PatientID, AdmissionID))"""
+        )
+        cursor.execute(summarize_admissions_sql("1"))  # O(I log I)
+    cursor.execute(
+        """CREATE TRIGGER IF NOT EXISTS admissions_insert
+        AFTER INSERT ON Labs
+        WHEN NEW.AdmissionID IS NOT NULL AND NEW.LabEpoch IS NOT NULL
+        BEGIN
+            INSERT INTO Admissions VALUES(
+                NEW.PatientID, NEW.AdmissionID, NEW.LabEpoch, NEW.LabEpoch, 1
+            )
+            ON CONFLICT (PatientID, AdmissionID) DO UPDATE SET
+                FirstLabEpoch = MIN(FirstLabEpoch, excluded.FirstLabEpoch),
+                LastLabEpoch = MAX(LastLabEpoch, excluded.LastLabEpoch),
+                AdmissionLabCount = AdmissionLabCount + 1;
+        END"""
+    )
+    cursor.execute(
+        f"""CREATE TRIGGER IF NOT EXISTS admissions_update
+        AFTER UPDATE OF PatientID, AdmissionID, LabEpoch ON Labs
+        BEGIN
+            {readmit_sql("OLD")}
+            {readmit_sql("NEW")}
+        END"""
+    )
+    cursor.execute(
+        f"""CREATE TRIGGER IF NOT EXISTS admissions_delete
+        AFTER DELETE ON Labs
+        BEGIN
+            {readmit_sql("OLD")}
+        END"""
+    )
+
+
+PATIENT_INSERT = "INSERT INTO Patients VALUES(?, ?, ?, ?, ?, ?, ?, ?)"
+LAB_INSERT = """INSERT INTO Labs
+    (PatientID, AdmissionID, LabName, LabValue, LabUnits, LabDateTime,
+    LabEpoch)
+    VALUES(?, ?, ?, ?, ?, ?, ?)"""
+# converts with the known factor so the insert triggers see the canonical
+# value; new units are registered by the unit_conversion_insert trigger
+LAB_INSERT_CONVERTED = """INSERT INTO Labs
+    (PatientID, AdmissionID, LabName, LabValue, LabUnits, LabDateTime,
+    LabEpoch, LabCanonicalValue)
+    VALUES(?1, ?2, ?3, ?4, ?5, ?6, ?7, ?4 * (
+        SELECT Factor
+        FROM UnitConversions
+        WHERE LabName = ?3 AND LabUnits = COALESCE(?5, '')
+    ))"""
+
+
+def dedupe_staged_sql(table: str, natural_key: str) -> str:
+    """Get sql keeping only the last staged row for each natural key."""
+    return f"""DELETE FROM temp.{table}
+        WHERE rowid NOT IN (
+            SELECT MAX(rowid)
+            FROM temp.{table}
+            GROUP BY {natural_key}
+        )"""
+
+
+def merge_patients(
+    cursor: sqlite3.Cursor, staged: int, report: LoadReport
+) -> None:
+    """Upsert the staged rows in StagedPatients by PatientID.
+
+    A PatientID staged more than once is merged from its last row and the
+    others are skipped, so replaying a delta changes nothing.
+    """
+    cursor.execute(dedupe_staged_sql("StagedPatients", "PatientID"))
+    updated = cursor.execute(
+        """UPDATE Patients
+        SET PatientGender = Staged.PatientGender,
+            PatientDateOfBirth = Staged.PatientDateOfBirth,
+            PatientRace = Staged.PatientRace,
+            PatientBirthEpoch = Staged.PatientBirthEpoch,
+            PatientMaritalStatus = Staged.PatientMaritalStatus,
+            PatientLanguage = Staged.PatientLanguage,
+            PatientPopulationPercentageBelowPoverty
+                = Staged.PatientPopulationPercentageBelowPoverty
+        FROM temp.StagedPatients AS Staged
+        WHERE Patients.PatientID = Staged.PatientID
+        AND (Patients.PatientGender IS NOT Staged.PatientGender
+            OR Patients.PatientDateOfBirth IS NOT Staged.PatientDateOfBirth
+            OR Patients.PatientRace IS NOT Staged.PatientRace
+            OR Patients.PatientMaritalStatus IS NOT Staged.PatientMaritalStatus
+            OR Patients.PatientLanguage IS NOT Staged.PatientLanguage
+            OR Patients.PatientPopulationPercentageBelowPoverty
+                IS NOT Staged.PatientPopulationPercentageBelowPoverty)"""
+    ).rowcount
+    inserted = cursor.execute(
+        """INSERT OR IGNORE INTO Patients
+        SELECT * FROM temp.StagedPatients"""
+    ).rowcount
+    report.updated += updated
+    report.inserted += inserted
+    report.skipped += staged - updated - inserted
+
+
+def merge_labs(
+    cursor: sqlite3.Cursor, staged: int, report: LoadReport
+) -> None:
+    """Upsert the staged rows in StagedLabs by natural key.
+
+    The key is (PatientID, AdmissionID, LabName, LabEpoch). A key staged
+    more than once is merged from its last row and the others are
+    skipped, so replaying a delta changes nothing.
+    """
+    cursor.execute(
+        dedupe_staged_sql(
+            "StagedLabs", "PatientID, AdmissionID, LabName, LabEpoch"
+        )
+    )  # O(K log K)
+    cursor.execute(register_units_sql("temp.StagedLabs"))
+    natural_key = """Labs.PatientID = Staged.PatientID
+        AND Labs.LabName = Staged.LabName
+        AND Labs.LabEpoch = Staged.LabEpoch
+        AND Labs.AdmissionID IS Staged.AdmissionID"""
+    updated = cursor.execute(
+        f"""UPDATE Labs
+        SET LabValue = Staged.LabValue, LabUnits = Staged.LabUnits
+        FROM temp.StagedLabs AS Staged
+        WHERE {natural_key}
+        AND (Labs.LabValue IS NOT Staged.LabValue
+            OR Labs.LabUnits IS NOT Staged.LabUnits)"""
+    ).rowcount  # O(K log I) with idx_labs_admission
+    inserted = cursor.execute(
+        f"""INSERT INTO Labs
+        (PatientID, AdmissionID, LabName, LabValue, LabUnits, LabDateTime,
+        LabEpoch, LabCanonicalValue)
+        SELECT PatientID, AdmissionID, LabName, LabValue, LabUnits,
+        LabDateTime, LabEpoch, {canonical_value_sql("Staged")}
+        FROM temp.StagedLabs AS Staged
+        WHERE NOT EXISTS (SELECT 1 FROM Labs WHERE {natural_key})"""
+    ).rowcount  # O(K log I) with idx_labs_admission
+    report.updated += updated
+    report.inserted += inserted
+    report.skipped += staged - updated - inserted
+
+
+def write_tables(
+    database: Database,
+    options: LoadOptions,
+    subject_chunks: Iterable[TypedChunk],
+    lab_chunks: Iterable[TypedChunk],
+) -> dict[str, LoadReport]:
+    """Write typed chunks to Patients and Labs in one transaction.
+
+    This is the single serialized writer behind parse_data and
+    parse_files. In "replace" mode the tables are rebuilt and indexed
+    after the load; in "append" mode the whole delta is staged, then
+    merged by natural key with the indexes kept in place. It uses its own
+    connection so the load pragmas never leak onto the shared connections.
+    """
+    reports = {"Patients": LoadReport(), "Labs": LoadReport()}
+    append = options.mode == "append"
+    if database.concurrent:  # leaving WAL would block concurrent readers
+        options = replace(options, journal_mode="WAL")
+    connection = database.connect(isolation_level=None)
+    cursor = connection.cursor()
+    try:
+        options.apply(cursor)
+        cursor.execute("BEGIN")
+        if not append:
+            cursor.execute("DROP TABLE IF EXISTS Patients")
+            cursor.execute("DROP TABLE IF EXISTS Labs")
+            cursor.execute("DROP TABLE IF EXISTS Quarantine")
+            cursor.execute("DROP TABLE IF EXISTS LabSummary")
+            cursor.execute("DROP TABLE IF EXISTS Admissions")
+            cursor.execute("DROP TABLE IF EXISTS UnitConversions")
+        create_tables(cursor)
+        if append:
+            create_indexes(cursor)
+            create_unit_conversions(cursor)
+            create_lab_summary(cursor)
+            create_admissions(cursor)
+            cursor.execute(
+                """CREATE TEMP TABLE StagedPatients
+                AS SELECT * FROM Patients WHERE 0"""
+            )
+            cursor.execute(
+                "CREATE TEMP TABLE StagedLabs AS SELECT * FROM Labs WHERE 0"
+            )
+
+        # adds patient for each patient, typing DOB once at load; a delta
+        # is staged whole so duplicate keys across chunks merge once
+        staged = 0
+        for rows, quarantined in subject_chunks:  # O(MJ)
+            if append:
+                cursor.executemany(
+                    PATIENT_INSERT.replace("Patients", "temp.StagedPatients"),
+                    rows,
+                )
+                staged += len(rows)
+            else:
+                cursor.executemany(PATIENT_INSERT, rows)
+                reports["Patients"].inserted += len(rows)
+            cursor.executemany(
+                "INSERT INTO Quarantine VALUES(?, ?, ?)", quarantined
+            )
+            reports["Patients"].quarantined += len(quarantined)
+        if append:
+            merge_patients(cursor, staged, reports["Patients"])
+
+        # add lab for each lab, letting sqlite allocate LabID
+        staged = 0
+        for rows, quarantined in lab_chunks:  # O(NI)
+            if append:
+                cursor.executemany(
+                    LAB_INSERT.replace("Labs", "temp.StagedLabs"), rows
+                )
+                staged += len(rows)
+            else:
+                cursor.executemany(LAB_INSERT, rows)
+                reports["Labs"].inserted += len(rows)
+            cursor.executemany(
+                "INSERT INTO Quarantine VALUES(?, ?, ?)", quarantined
+            )
+            reports["Labs"].quarantined += len(quarantined)
+        if append:
+            merge_labs(cursor, staged, reports["Labs"])
+
+        # normalize, index and summarize after the bulk load so inserts
+        # don't maintain them row by row
+        create_unit_conversions(cursor)  # O(I log I)
+        create_indexes(cursor)  # O(I log I)
+        create_lab_summary(cursor)  # O(I log I)
+        create_admissions(cursor)  # O(I log I)
+        cursor.execute("COMMIT")
+        database.cache.clear()
+    except BaseException:
+        if connection.in_transaction:
+            cursor.execute("ROLLBACK")
+        raise
+    finally:
+        connection.close()
+    return reports
+
+
+# Big O: O(MJ + NI + I log I), memory O(chunk_size)
+def parse_data(
+    subjects_file_name: str,
+    labs_file_name: str,
+    options: LoadOptions | None = None,
+    database: Database | None = None,
+) -> dict[str, LoadReport]:
+    """Parse subjects and labs files into the sqlite database.
+
+    Rows are streamed in chunks and written with executemany inside a
+    single transaction. Dates are stored alongside their integer epoch and
+    values as REAL, so reads never re-parse them. Returns a LoadReport
+    per table.
+    """
+    options = options or LoadOptions()
+    return write_tables(
+        database or get_database(),
+        options,
+        type_file(subjects_file_name, "Patients", options),
+        type_file(labs_file_name, "Labs", options),
+    )
+
+
+def expand_files(files: str | Iterable[str]) -> list[str]:
+    """Expand a glob pattern, or a list of paths and patterns, to paths."""
+    patterns = [files] if isinstance(files, str) else list(files)
+    filenames: list[str] = []
+    for pattern in patterns:
+        if glob.has_magic(pattern):
+            matches = sorted(glob.glob(pattern))
+            if not matches:
+                raise ValueError(f"No files match '{pattern}'.")
+            filenames.extend(matches)
+        else:
+            filenames.append(pattern)
+    return filenames
+
+
+def type_files_parallel(
+    executor: concurrent.futures.Executor,
+    filenames: list[str],
+    table: str,
+    options: LoadOptions,
+    prefetch: int,
+) -> Iterator[TypedChunk]:
+    """Type shards in the executor, yielding chunks in file order.
+
+    At most prefetch shards are in flight, which bounds memory to roughly
+    prefetch shards of typed rows.
+    """
+    pending: collections.deque[
+        concurrent.futures.Future[list[TypedChunk]]
+    ] = collections.deque()
+    remaining = iter(filenames)
+    for filename in itertools.islice(remaining, prefetch):
+        pending.append(
+            executor.submit(type_file_chunks, filename, table, options)
+        )
+    while pending:
+        chunks = pending.popleft().result()
+        for filename in itertools.islice(remaining, 1):
+            pending.append(
+                executor.submit(type_file_chunks, filename, table, options)
+            )
+        yield from chunks
+
+
+def parse_files(
+    subjects_files: str | Iterable[str],
+    labs_files: str | Iterable[str],
+    processes: int | None = None,
+    options: LoadOptions | None = None,
+    database: Database | None = None,
+) -> dict[str, LoadReport]:
+    """Parse sharded subjects and labs files into the sqlite database.
+
+    Each argument is a glob pattern or a list of paths/patterns. Shards are
+    read, validated and typed in a process pool, and a single writer in
+    this process bulk-inserts them in one transaction.
+    """
+    options = options or LoadOptions()
+    subject_filenames = expand_files(subjects_files)
+    lab_filenames = expand_files(labs_files)
+    processes = processes or os.cpu_count() or 1
+    with concurrent.futures.ProcessPoolExecutor(processes) as executor:
+        return write_tables(
+            database or get_database(),
+            options,
+            type_files_parallel(
+                executor, subject_filenames, "Patients", options, 2 * processes
+            ),
+            type_files_parallel(
+                executor, lab_filenames, "Labs", options, 2 * processes
             ),
         )
-        unique_id += 1
-    connection.commit()
-    connection.close()
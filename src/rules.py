@@ -0,0 +1,280 @@
+"""Boolean rules over lab thresholds, compiled to one SQL query.
+
+A rule such as
+
+    CREATININE > 1.5 AND (POTASSIUM > 5.5 OR SODIUM < 130)
+
+is parsed (without eval) into conditions joined by AND, OR and NOT. Lab
+names that are not a single word are quoted: "METABOLIC: POTASSIUM" > 5.
+Each distinct condition becomes one aggregate column of a single grouped
+query, so a condition used several times is evaluated once per patient.
+Thresholds are in each lab's canonical units.
+"""
+
+from dataclasses import dataclass
+import re
+from typing import Iterator, Union
+
+import functionality
+
+TOKEN = re.compile(
+    r"""\s*(?:
+    (?P<number>[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)
+    |(?P<string>"[^"]*"|'[^']*')
+    |(?P<operator><=|>=|==|!=|<|>)
+    |(?P<paren>[()])
+    |(?P<word>[A-Za-z_][A-Za-z0-9_.]*)
+    )""",
+    re.VERBOSE,
+)
+KEYWORDS = {"AND", "OR", "NOT"}
+
+
+@dataclass(frozen=True)
+class Condition:
+    """A lab threshold: any lab_name value compared to threshold."""
+
+    lab_name: str
+    operator: str
+    threshold: float
+
+
+@dataclass(frozen=True)
+class And:
+    """True when every term is true."""
+
+    terms: tuple["Rule", ...]
+
+
+@dataclass(frozen=True)
+class Or:
+    """True when any term is true."""
+
+    terms: tuple["Rule", ...]
+
+
+@dataclass(frozen=True)
+class Not:
+    """True when term is false."""
+
+    term: "Rule"
+
+
+Rule = Union[Condition, And, Or, Not]
+
+
+def tokenize(text: str) -> list[tuple[str, str, int]]:
+    """Split a rule into (kind, text, position) tokens."""
+    tokens = []
+    position = 0
+    while text[position:].strip():
+        match = TOKEN.match(text, position)
+        if match is None or match.lastgroup is None:
+            raise ValueError(f"Unexpected character at {position} in rule.")
+        kind, value = match.lastgroup, match.group(match.lastgroup)
+        if kind == "word" and value.upper() in KEYWORDS:
+            kind, value = "keyword", value.upper()
+        elif kind == "string":
+            kind, value = "word", value[1:-1]
+        tokens.append((kind, value, match.start(match.lastgroup)))
+        position = match.end()
+    return tokens
+
+
+class Parser:
+    """Recursive descent parser; NOT binds tighter than AND, then OR."""
+
+    def __init__(self, text: str):
+        """Tokenize text for parsing."""
+        self.tokens = tokenize(text)
+        self.index = 0
+
+    def peek(self) -> tuple[str, str, int]:
+        """Get the next token without consuming it."""
+        if self.index < len(self.tokens):
+            return self.tokens[self.index]
+        return ("end", "", -1)
+
+    def take(self, kind: str, value: str | None = None) -> str:
+        """Consume the next token, which must be of kind (and value)."""
+        token_kind, token_value, position = self.peek()
+        if token_kind != kind or value not in (None, token_value):
+            expected = value or kind
+            where = "end" if position < 0 else position
+            raise ValueError(
+                f"Expected {expected} at {where} in rule, got "
+                f"'{token_value}'."
+            )
+        self.index += 1
+        return token_value
+
+    def parse(self) -> Rule:
+        """Parse the whole rule."""
+        rule = self.disjunction()
+        self.take("end")
+        return rule
+
+    def disjunction(self) -> Rule:
+        """Parse terms joined by OR."""
+        terms = [self.conjunction()]
+        while self.peek()[:2] == ("keyword", "OR"):
+            self.take("keyword", "OR")
+            terms.append(self.conjunction())
+        return terms[0] if len(terms) == 1 else Or(tuple(terms))
+
+    def conjunction(self) -> Rule:
+        """Parse terms joined by AND."""
+        terms = [self.negation()]
+        while self.peek()[:2] == ("keyword", "AND"):
+            self.take("keyword", "AND")
+            terms.append(self.negation())
+        return terms[0] if len(terms) == 1 else And(tuple(terms))
+
+    def negation(self) -> Rule:
+        """Parse an optionally negated term."""
+        if self.peek()[:2] == ("keyword", "NOT"):
+            self.take("keyword", "NOT")
+            return Not(self.negation())
+        if self.peek()[0] == "paren":
+            self.take("paren", "(")
+            rule = self.disjunction()
+            self.take("paren", ")")
+            return rule
+        lab_name = self.take("word")
+        operator = functionality.check_operator(self.take("operator"))
+        threshold = functionality.check_threshold(self.take("number"))
+        return Condition(lab_name, operator, threshold)
+
+
+def parse(text: str) -> Rule:
+    """Parse a rule string, raising ValueError if it is malformed."""
+    return Parser(text).parse()
+
+
+def conditions(rule: Rule) -> list[Condition]:
+    """Get the distinct conditions of a rule in first-seen order."""
+    if isinstance(rule, Condition):
+        return [rule]
+    terms = (rule.term,) if isinstance(rule, Not) else rule.terms
+    return list(dict.fromkeys(c for term in terms for c in conditions(term)))
+
+
+def evaluate(rule: Rule, truth: dict[Condition, bool]) -> bool:
+    """Evaluate a rule given the truth of each condition."""
+    if isinstance(rule, Condition):
+        return truth.get(rule, False)
+    if isinstance(rule, Not):
+        return not evaluate(rule.term, truth)
+    results = (evaluate(term, truth) for term in rule.terms)
+    return all(results) if isinstance(rule, And) else any(results)
+
+
+def to_sql(rule: Rule, columns: dict[Condition, str]) -> str:
+    """Write a rule as a boolean sql expression over condition columns."""
+    if isinstance(rule, Condition):
+        return columns[rule]
+    if isinstance(rule, Not):
+        return f"NOT {to_sql(rule.term, columns)}"
+    joiner = " AND " if isinstance(rule, And) else " OR "
+    return (
+        "(" + joiner.join(to_sql(term, columns) for term in rule.terms) + ")"
+    )
+
+
+def rule_query(
+    rule: Rule, every_patient: bool
+) -> tuple[str, tuple[str | float, ...]]:
+    """Compile a rule to one grouped query of (PatientID, matches) rows.
+
+    The query has a {pat_filter} slot for Cohort batches. With
+    every_patient it covers each Patients row, including patients with
+    none of the rule's labs; otherwise only patients with at least one.
+    """
+    distinct = conditions(rule)
+    columns = {condition: f"c{i}" for i, condition in enumerate(distinct)}
+    aggregates = ",\n".join(
+        f"""COALESCE(MAX(Labs.LabName = ?
+            AND Labs.LabCanonicalValue {condition.operator} ?), 0)
+            AS {column}"""
+        for condition, column in columns.items()
+    )
+    lab_names = list(dict.fromkeys(c.lab_name for c in distinct))
+    placeholders = ", ".join("?" * len(lab_names))
+    lab_filter = f"""Labs.LabName IN ({placeholders})
+        AND Labs.LabCanonicalValue IS NOT NULL"""
+    if every_patient:
+        source = f"""Patients
+            LEFT JOIN Labs ON Labs.PatientID = Patients.PatientID
+            AND {lab_filter}
+            WHERE 1"""
+        key = "Patients.PatientID"
+    else:
+        source = f"Labs WHERE {lab_filter}"
+        key = "Labs.PatientID"
+    parameters: tuple[str | float, ...] = ()
+    for condition in distinct:
+        parameters += (condition.lab_name, condition.threshold)
+    sql = f"""SELECT PatientID, {to_sql(rule, columns)}
+        FROM (
+            SELECT {key} AS PatientID,
+            {aggregates}
+            FROM {source}
+            {{pat_filter}}
+            GROUP BY {key}
+        )
+        ORDER BY PatientID"""
+    return sql, parameters + tuple(lab_names)
+
+
+def as_rule(rule: Rule | str) -> Rule:
+    """Parse rule if it is a string."""
+    return parse(rule) if isinstance(rule, str) else rule
+
+
+def evaluate_cohort(
+    rule: Rule | str, cohort: functionality.Cohort | None = None
+) -> Iterator[tuple[str, bool]]:  # O(P log I + K)
+    """Stream (patient id, matches) for every cohort patient.
+
+    Patients come from the Patients table (or the cohort's pat_ids found
+    in it); all conditions are evaluated by one grouped query per batch.
+    """
+    rule = as_rule(rule)
+    cohort = cohort or functionality.Cohort()
+    sql, parameters = rule_query(rule, True)
+    for pat_filter, batch in cohort._batches("Patients.PatientID"):
+        rows = cohort._stream(
+            sql.format(pat_filter=pat_filter), parameters + batch
+        )
+        for pat_id, matches in rows:
+            yield pat_id, bool(matches)
+
+
+def matching(
+    rule: Rule | str, cohort: functionality.Cohort | None = None
+) -> Iterator[str]:  # O(log I + K) when the rule needs a lab
+    """Stream ids of cohort patients matching the rule."""
+    rule = as_rule(rule)
+    cohort = cohort or functionality.Cohort()
+    if evaluate(rule, {}):  # patients without these labs match too
+        for pat_id, matches in evaluate_cohort(rule, cohort):
+            if matches:
+                yield pat_id
+        return
+    sql, parameters = rule_query(rule, False)
+    for pat_filter, batch in cohort._batches("Labs.PatientID"):
+        rows = cohort._stream(
+            sql.format(pat_filter=pat_filter), parameters + batch
+        )
+        for pat_id, matches in rows:
+            if matches:
+                yield pat_id
+
+
+def patient_matches(rule: Rule | str, patient: functionality.Patient) -> bool:
+    """Check whether one patient matches the rule."""
+    rule = as_rule(rule)
+    cohort = functionality.Cohort([patient.pat_id], patient.db)
+    for _, matches in evaluate_cohort(rule, cohort):
+        return matches
+    return evaluate(rule, {})
@@ -0,0 +1,169 @@
+"""Synthetic EHR files at scale for tests and benchmarks."""
+import argparse
+from contextlib import contextmanager
+import datetime
+import math
+import pathlib
+import random
+import tempfile
+import typing
+
+SUBJECT_HEADER = [
+    "PatientID",
+    "PatientGender",
+    "PatientDateOfBirth",
+    "PatientRace",
+    "PatientMaritalStatus",
+    "PatientLanguage",
+    "PatientPopulationPercentageBelowPoverty",
+]
+LAB_HEADER = [
+    "PatientID",
+    "AdmissionID",
+    "LabName",
+    "LabValue",
+    "LabUnits",
+    "LabDateTime",
+]
+
+# (name, units, mean, standard deviation, relative ordering frequency)
+LAB_PANEL = [
+    ("METABOLIC: POTASSIUM", "mmol/L", 4.2, 0.5, 10),
+    ("METABOLIC: SODIUM", "mmol/L", 139.0, 3.5, 10),
+    ("METABOLIC: CHLORIDE", "mmol/L", 102.0, 3.0, 9),
+    ("METABOLIC: BUN", "mg/dL", 15.0, 6.0, 9),
+    ("METABOLIC: CREATININE", "mg/dL", 1.0, 0.35, 9),
+    ("METABOLIC: GLUCOSE", "mg/dL", 105.0, 30.0, 8),
+    ("METABOLIC: CALCIUM", "mg/dL", 9.4, 0.5, 6),
+    ("CBC: HEMOGLOBIN", "gm/dl", 13.2, 1.8, 8),
+    ("CBC: WHITE BLOOD CELL COUNT", "k/cumm", 7.5, 2.5, 8),
+    ("CBC: PLATELET COUNT", "k/cumm", 250.0, 65.0, 8),
+    ("URINALYSIS: PH", "no unit", 6.0, 0.7, 3),
+    ("URINALYSIS: SPECIFIC GRAVITY", "no unit", 1.015, 0.006, 3),
+]
+ABNORMAL_RATE = 0.05  # share of values drawn from a widened tail
+GENDERS = (["Male", "Female"], [49, 51])
+RACES = (
+    ["White", "African American", "Asian", "Unknown"],
+    [60, 20, 12, 8],
+)
+MARITAL_STATUSES = ["Single", "Married", "Divorced", "Widowed", "Unknown"]
+LANGUAGES = (["English", "Spanish", "Icelandic", "Unknown"], [80, 12, 2, 6])
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S.%f"
+
+
+def format_time(time: datetime.datetime) -> str:
+    """Format a timestamp with millisecond precision like the source data."""
+    return time.strftime(TIME_FORMAT)[:-3]
+
+
+def lab_counts(rng: random.Random, n_patients: int, n_labs: int) -> list[int]:
+    """Split n_labs across patients with a heavy-tailed distribution."""
+    weights = [rng.lognormvariate(0, 1) for _ in range(n_patients)]
+    total = sum(weights)
+    counts = [int(n_labs * weight / total) for weight in weights]
+    for i in rng.choices(range(n_patients), k=n_labs - sum(counts)):
+        counts[i] += 1
+    return counts
+
+
+def lab_value(rng: random.Random, mean: float, sd: float) -> float:
+    """Draw a lab value, occasionally from an abnormal tail."""
+    spread = sd * 3 if rng.random() < ABNORMAL_RATE else sd
+    value = abs(rng.gauss(mean, spread))
+    digits = max(0, 2 - int(math.floor(math.log10(max(sd, 1e-9)))))
+    return round(value, digits)
+
+
+def write_synthetic_files(
+    dirname: str, n_patients: int, n_labs: int, seed: int = 0
+) -> tuple[str, str]:
+    """Write synthetic subjects and labs tsv files into dirname.
+
+    Patients get a heavy-tailed number of labs grouped into admissions a
+    few days long; memory stays O(n_patients) however many labs are
+    written.
+    """
+    rng = random.Random(seed)
+    subjects_path = pathlib.Path(dirname) / "subjects.tsv"
+    labs_path = pathlib.Path(dirname) / "labs.tsv"
+    names, units, means, sds, frequencies = zip(*LAB_PANEL)
+    earliest_dob = datetime.datetime(1930, 1, 1)
+    counts = lab_counts(rng, n_patients, n_labs)
+    with open(subjects_path, "w") as subjects, open(labs_path, "w") as labs:
+        subjects.write("\t".join(SUBJECT_HEADER) + "\n")
+        labs.write("\t".join(LAB_HEADER) + "\n")
+        for patient in range(n_patients):
+            pat_id = f"P{patient:08d}"
+            dob = earliest_dob + datetime.timedelta(
+                days=rng.uniform(0, 75 * 365.25)
+            )
+            subjects.write(
+                "\t".join(
+                    [
+                        pat_id,
+                        rng.choices(*GENDERS)[0],
+                        format_time(dob),
+                        rng.choices(*RACES)[0],
+                        rng.choice(MARITAL_STATUSES),
+                        rng.choices(*LANGUAGES)[0],
+                        f"{rng.uniform(0, 40):.2f}",
+                    ]
+                )
+                + "\n"
+            )
+            admissions = max(1, round(rng.expovariate(1 / 3)))
+            admission_starts = sorted(
+                dob + datetime.timedelta(days=rng.uniform(365, 80 * 365.25))
+                for _ in range(admissions)
+            )
+            rows = []
+            for _ in range(counts[patient]):
+                admission = rng.randrange(admissions)
+                time = admission_starts[admission] + datetime.timedelta(
+                    hours=rng.uniform(0, 24 * 7)
+                )
+                lab = rng.choices(range(len(names)), frequencies)[0]
+                rows.append(
+                    "\t".join(
+                        [
+                            pat_id,
+                            str(admission + 1),
+                            names[lab],
+                            str(lab_value(rng, means[lab], sds[lab])),
+                            units[lab],
+                            format_time(time),
+                        ]
+                    )
+                )
+            if rows:
+                labs.write("\n".join(rows) + "\n")
+    return str(subjects_path), str(labs_path)
+
+
+@contextmanager
+def synthetic_files(
+    n_patients: int, n_labs: int, seed: int = 0
+) -> typing.Generator[tuple[str, str], None, None]:
+    """Generate synthetic subjects and labs files in a temporary directory."""
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        yield write_synthetic_files(tmpdirname, n_patients, n_labs, seed)
+
+
+def main() -> None:
+    """Write synthetic files from the command line."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("dirname")
+    parser.add_argument("--patients", type=int, default=10_000)
+    parser.add_argument("--labs", type=int, default=1_000_000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    print(
+        *write_synthetic_files(
+            args.dirname, args.patients, args.labs, args.seed
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+"""Tests for arrow_io.py."""
+import datetime
+import functionality
+import make_fake_files
+import pathlib
+import pytest
+
+pa = pytest.importorskip("pyarrow")
+pq = pytest.importorskip("pyarrow.parquet")
+import arrow_io  # noqa: E402
+
+SUB_TABLE = [
+    functionality.SUBJECT_COLUMNS,
+    ["1A", "Male", "2000-06-15 02:45:40.547", "White", "S", "E", "1"],
+    ["2B", "Female", "1990-01-01 00:00:00.000", "Asian", "M", "E", "2"],
+    ["3C", "Female", "1990-01-01 00:00:00.000", "Asian", "M", "E", "2"],
+]
+LAB_TABLE = [
+    functionality.LAB_COLUMNS,
+    ["2B", "1", "SODIUM", "140", "mmol/L", "2001-07-01 03:20:24.070"],
+    ["1A", "2", "POTASSIUM", "6", "mmol/L", "2010-06-16 00:00:00.000"],
+    ["2B", "1", "POTASSIUM", "4", "mmol/L", "2001-07-02 03:20:24.070"],
+    ["1A", "1", "POTASSIUM", "5.5", "mmol/L", "2009-06-16 00:00:00.000"],
+]
+
+
+def make_database(tmp_path: pathlib.Path, name: str) -> functionality.Database:
+    """Load the shared fake files into a fresh database."""
+    database = functionality.Database(str(tmp_path / name))
+    with make_fake_files.fake_files(SUB_TABLE, LAB_TABLE) as (
+        sub_filename,
+        lab_filename,
+    ):
+        functionality.parse_data(sub_filename, lab_filename, None, database)
+    return database
+
+
+def test_export_parquet_typed_columns(tmp_path: pathlib.Path) -> None:
+    """Test Parquet export writes typed columns in bounded row groups."""
+    database = make_database(tmp_path, "export.db")
+    labs_path = str(tmp_path / "labs.parquet")
+    assert arrow_io.export_parquet("Labs", labs_path, database, 3) == 4
+    assert pq.ParquetFile(labs_path).metadata.num_row_groups == 2
+    labs = pq.read_table(labs_path)
+    assert labs.schema.field("LabValue").type == pa.float64()
+    assert labs.schema.field("LabDateTime").type == pa.timestamp("us")
+    assert pa.types.is_dictionary(labs.schema.field("LabName").type)
+    assert labs.column("LabValue").to_pylist() == [140.0, 6.0, 4.0, 5.5]
+    assert labs.column("LabDateTime")[0].as_py() == datetime.datetime(
+        2001, 7, 1, 3, 20, 24, 70000
+    )
+    patients_path = str(tmp_path / "patients.parquet")
+    assert arrow_io.export_parquet("Patients", patients_path, database) == 3
+    patients = pq.read_table(patients_path)
+    assert patients.column("PatientGender").to_pylist() == [
+        "Male",
+        "Female",
+        "Female",
+    ]
+    database.close()
+
+
+def test_export_import_round_trip(tmp_path: pathlib.Path) -> None:
+    """Test exported files import back to the same Patient API answers."""
+    source = make_database(tmp_path, "source.db")
+    for suffix, export in [
+        (".parquet", arrow_io.export_parquet),
+        (".arrows", arrow_io.export_arrow),
+    ]:
+        patients_path = str(tmp_path / f"patients{suffix}")
+        labs_path = str(tmp_path / f"labs{suffix}")
+        export("Patients", patients_path, source, 2)
+        export("Labs", labs_path, source, 2)
+        target = functionality.Database(str(tmp_path / f"target{suffix}.db"))
+        reports = arrow_io.import_files(
+            patients_path,
+            labs_path,
+            functionality.LoadOptions(chunk_size=2),
+            target,
+        )
+        assert reports == {
+            "Patients": functionality.LoadReport(inserted=3),
+            "Labs": functionality.LoadReport(inserted=4),
+        }
+        for pat_id in ["1A", "2B"]:
+            expected = functionality.Patient(pat_id, source)
+            actual = functionality.Patient(pat_id, target)
+            assert actual.dob == expected.dob
+            assert actual.race == expected.race
+            assert actual.marital_status == expected.marital_status
+            assert actual.poverty_percentage == expected.poverty_percentage
+            assert actual.get_lab_test_values("POTASSIUM") == (
+                expected.get_lab_test_values("POTASSIUM")
+            )
+        assert target.execute(
+            "SELECT LabDateTime, AdmissionID FROM Labs ORDER BY LabID"
+        )[0] == ("2001-07-01 03:20:24.070", "1")
+        target.close()
+    source.close()
+
+
+def test_import_quarantines_bad_rows(tmp_path: pathlib.Path) -> None:
+    """Test rows with missing or non-finite values are quarantined.
+
+    A bad poverty percentage quarantines only that field.
+    """
+    patients_path = str(tmp_path / "patients.parquet")
+    labs_path = str(tmp_path / "labs.parquet")
+    pq.write_table(
+        pa.table(
+            {
+                "PatientID": ["1A", "2B", "3C"],
+                "PatientGender": ["Male", "Female", "Female"],
+                "PatientDateOfBirth": [
+                    "2000-06-15 02:45:40.547",
+                    None,
+                    "1990-01-01 00:00:00.000",
+                ],
+                "PatientRace": ["White", "Asian", "Asian"],
+                "PatientMaritalStatus": ["Single", "Married", "Married"],
+                "PatientLanguage": ["English", "English", "English"],
+                "PatientPopulationPercentageBelowPoverty": [12.5, None, 101.0],
+            }
+        ),
+        patients_path,
+    )
+    pq.write_table(
+        pa.table(
+            {
+                "PatientID": ["1A", "1A", "1A"],
+                "AdmissionID": [1, 1, 2],
+                "LabName": ["POTASSIUM"] * 3,
+                "LabValue": [4.0, float("nan"), None],
+                "LabUnits": ["mmol/L"] * 3,
+                "LabDateTime": [datetime.datetime(2001, 7, 1)] * 3,
+            }
+        ),
+        labs_path,
+    )
+    database = functionality.Database(str(tmp_path / "bad.db"))
+    reports = arrow_io.import_files(patients_path, labs_path, None, database)
+    assert reports == {
+        "Patients": functionality.LoadReport(inserted=2, quarantined=2),
+        "Labs": functionality.LoadReport(inserted=1, quarantined=2),
+    }
+    with pytest.raises(ValueError):
+        arrow_io.import_files(
+            patients_path,
+            labs_path,
+            functionality.LoadOptions(bad_rows="raise"),
+            database,
+        )
+    assert functionality.Patient("1A", database).get_lab_test_values(
+        "POTASSIUM"
+    ) == [4.0]
+    assert functionality.Patient("3C", database).poverty_percentage is None
+    database.close()
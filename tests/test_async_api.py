@@ -0,0 +1,116 @@
+"""Tests for async_api.py."""
+import asyncio
+import async_api
+import functionality
+import make_fake_files
+import pathlib
+import pytest
+
+SUB_TABLE = [
+    functionality.SUBJECT_COLUMNS,
+    ["1A", "Male", "2000-06-15 02:45:40.547", "White", "S", "E", "1"],
+    ["2B", "Female", "1990-01-01 00:00:00.000", "Asian", "M", "E", "2"],
+    ["3C", "Female", "1990-01-01 00:00:00.000", "Asian", "M", "E", "2"],
+]
+LAB_TABLE = [
+    functionality.LAB_COLUMNS,
+    ["2B", "1", "SODIUM", "140", "mmol/L", "2001-07-01 03:20:24.070"],
+    ["1A", "1", "POTASSIUM", "6", "mmol/L", "2010-06-16 00:00:00.000"],
+    ["2B", "1", "POTASSIUM", "4", "mmol/L", "2001-07-02 03:20:24.070"],
+    ["1A", "1", "POTASSIUM", "5", "mmol/L", "2009-06-16 00:00:00.000"],
+]
+
+
+def make_database(tmp_path: pathlib.Path) -> functionality.Database:
+    """Load the shared fake files into a fresh database."""
+    database = functionality.Database(str(tmp_path / "async.db"))
+    with make_fake_files.fake_files(SUB_TABLE, LAB_TABLE) as (
+        sub_filename,
+        lab_filename,
+    ):
+        functionality.parse_data(sub_filename, lab_filename, None, database)
+    return database
+
+
+def test_async_patient_api(tmp_path: pathlib.Path) -> None:
+    """Test the awaitable Patient API matches the blocking one."""
+    database = make_database(tmp_path)
+    async_db = async_api.AsyncDatabase(database)
+
+    async def run() -> None:
+        pat_1a = async_db.patient("1A")
+        assert await pat_1a.gender() == "Male"
+        assert await pat_1a.race() == "White"
+        assert (await pat_1a.dob()).year == 2000
+        assert await pat_1a.age() == functionality.Patient("1A", database).age
+        assert await pat_1a.get_lab_test_values("POTASSIUM") == [5.0, 6.0]
+        assert await pat_1a.get_lab_test_values(
+            "POTASSIUM", "2010-01-01 00:00:00.000"
+        ) == [6.0]
+        assert (
+            await pat_1a.is_sick(
+                "POTASSIUM", ">", 5.5, end="2010-01-01 0:0:0.0"
+            )
+            is False
+        )
+        assert await pat_1a.get_lab_test_values("SODIUM") == (
+            "Patient has no tests for SODIUM"
+        )
+        assert await pat_1a.is_sick("POTASSIUM", ">", 5.5) is True
+        assert await pat_1a.get_age_at_first_lab() == 9
+        await pat_1a.add_labs("SODIUM", 150, "mmol/L", "2011-01-01 00:00:00.0")
+        assert await pat_1a.get_lab_test_values("SODIUM") == [150.0]
+        lab = await async_db.lab((await pat_1a.labs())["SODIUM"][0].lab_id)
+        assert (lab.pat_id, lab.value) == ("1A", 150.0)
+        with pytest.raises(ValueError):
+            await async_db.patient("9Z").gender()
+        with pytest.raises(ValueError):
+            await async_db.patient("3C").get_age_at_first_lab()
+        with pytest.raises(ValueError):
+            await pat_1a.is_sick("POTASSIUM", "=>", 5.5)
+        cohort = async_db.cohort()
+        assert await cohort.is_sick("POTASSIUM", "<", 5.5) == ["1A", "2B"]
+        assert await cohort.age_at_first_lab() == [("1A", 9), ("2B", 11)]
+
+    asyncio.run(run())
+    async_db.close()
+    database.close()
+
+
+def test_async_requests_are_batched(tmp_path: pathlib.Path) -> None:
+    """Test concurrent per-patient requests share one IN (...) query."""
+    database = make_database(tmp_path)
+    async_db = async_api.AsyncDatabase(database, max_workers=2)
+    patients = [async_db.patient(pat_id) for pat_id in ["1A", "2B", "3C"]]
+
+    async def run() -> None:
+        with database.profile() as profiler:
+            genders = await asyncio.gather(
+                *(patient.gender() for patient in patients)
+            )
+            labs = await asyncio.gather(
+                *(patient.labs() for patient in patients * 2)
+            )
+            sick = await asyncio.gather(
+                *(
+                    patient.is_sick("POTASSIUM", ">", 4.5)
+                    for patient in patients
+                )
+            )
+        assert genders == ["Male", "Female", "Female"]
+        assert [sorted(pat_labs) for pat_labs in labs[:3]] == [
+            ["POTASSIUM"],
+            ["POTASSIUM", "SODIUM"],
+            [],
+        ]
+        assert sick == [True, False, False]
+        queries = [event for event in profiler.events if event.kind == "query"]
+        assert len(queries) == 3
+        assert all("IN (?, ?, ?)" in event.sql for event in queries)
+        for threshold in range(20):  # one batch per distinct threshold
+            await patients[0].is_sick("POTASSIUM", ">", threshold)
+        assert async_db._batchers == {}
+
+    asyncio.run(run())
+    async_db.close()
+    database.close()
@@ -0,0 +1,122 @@
+"""Tests for columnar.py."""
+import columnar
+import functionality
+import make_fake_files
+import pathlib
+import pytest
+
+SUB_TABLE = [
+    functionality.SUBJECT_COLUMNS,
+    ["1A", "Male", "2000-06-15 02:45:40.547", "White", "S", "E", "1"],
+    ["2B", "Female", "1990-01-01 00:00:00.000", "Asian", "M", "E", "2"],
+    ["3C", "Female", "1990-01-01 00:00:00.000", "Asian", "M", "E", "2"],
+]
+LAB_TABLE = [
+    functionality.LAB_COLUMNS,
+    ["2B", "1", "SODIUM", "140", "mmol/L", "2001-07-01 03:20:24.070"],
+    ["1A", "1", "POTASSIUM", "6", "mmol/L", "2010-06-16 00:00:00.000"],
+    ["2B", "1", "POTASSIUM", "4", "mmol/L", "2001-07-02 03:20:24.070"],
+    ["1A", "1", "POTASSIUM", "5", "mmol/L", "2009-06-16 00:00:00.000"],
+    ["1A", "1", "POTASSIUM", "bad", "mmol/L", "2009-06-16 00:00:00.000"],
+]
+
+
+def make_store() -> columnar.ColumnarStore:
+    """Build a store from the shared fake files."""
+    with make_fake_files.fake_files(SUB_TABLE, LAB_TABLE) as (
+        sub_filename,
+        lab_filename,
+    ):
+        return columnar.ColumnarStore.from_files(sub_filename, lab_filename)
+
+
+def test_columnar_offsets_slice_patients() -> None:
+    """Test labs are sorted by patient with per-patient offsets."""
+    store = make_store()
+    assert list(store.offsets) == [0, 2, 4, 4]
+    assert store.patient("1A").get_lab_test_values("POTASSIUM") == [5.0, 6.0]
+    assert store.patient("3C").labs == {}
+
+
+def test_columnar_patient_api() -> None:
+    """Test the Patient-style API on a columnar patient."""
+    store = make_store()
+    pat_2b = store.patient("2B")
+    assert sorted(pat_2b.labs) == ["POTASSIUM", "SODIUM"]
+    assert pat_2b.labs["SODIUM"][0].units == "mmol/L"
+    assert pat_2b.is_sick("POTASSIUM", "<", 4.5) is True
+    assert pat_2b.is_sick("SODIUM", ">", 150) is False
+    assert pat_2b.is_sick("CREATININE", ">", 0) is False
+    assert pat_2b.get_lab_test_values("CREATININE") == (
+        "Patient has no tests for CREATININE"
+    )
+    assert pat_2b.get_age_at_first_lab() == 11
+    assert store.patient("1A").get_age_at_first_lab() == 9
+    with pytest.raises(ValueError):
+        store.patient("3C").get_age_at_first_lab()
+
+
+def test_columnar_cohort_is_sick() -> None:
+    """Test the vectorized cohort threshold."""
+    store = make_store()
+    assert store.is_sick("POTASSIUM", ">=", 4) == ["1A", "2B"]
+    assert store.is_sick("POTASSIUM", ">", 5.5) == ["1A"]
+    with pytest.raises(ValueError):
+        store.is_sick("POTASSIUM", "=>", 4)
+
+
+def test_columnar_time_windows() -> None:
+    """Test start/end restrict columnar queries to [start, end)."""
+    store = make_store()
+    pat_1a = store.patient("1A")
+    assert pat_1a.get_lab_test_values(
+        "POTASSIUM", start="2010-01-01 00:00:00.000"
+    ) == [6.0]
+    assert pat_1a.get_lab_test_values(
+        "POTASSIUM", end="2010-06-16 00:00:00.000"
+    ) == [5.0]
+    assert pat_1a.is_sick("POTASSIUM", ">", 5.5, end="2010-01-01 0:0:0.0") is (
+        False
+    )
+    assert store.is_sick("POTASSIUM", "<", 5.5, "2005-01-01 0:0:0.0") == ["1A"]
+    assert store.is_sick("POTASSIUM", "<", 5.5) == ["1A", "2B"]
+
+
+def test_columnar_thresholds_in_canonical_units(
+    tmp_path: pathlib.Path,
+) -> None:
+    """Test columnar thresholds convert units the way parse_data does."""
+    glucose = "METABOLIC: GLUCOSE"
+    lab_table = [
+        functionality.LAB_COLUMNS,
+        ["1A", "1", glucose, "10", "mmol/L", "2009-06-17 00:00:00.000"],
+        ["2B", "1", glucose, "90", "mg/dL", "2001-07-01 00:00:00.000"],
+        ["2B", "1", glucose, "200", "furlongs", "2001-07-02 00:00:00.000"],
+        ["3C", "1", "SODIUM", "150", "mEq/L", "2001-07-02 00:00:00.000"],
+    ]
+    database = functionality.Database(str(tmp_path / "columnar.db"))
+    with make_fake_files.fake_files(SUB_TABLE, lab_table) as (
+        sub_filename,
+        lab_filename,
+    ):
+        store = columnar.ColumnarStore.from_files(sub_filename, lab_filename)
+        functionality.parse_data(sub_filename, lab_filename, None, database)
+    cohort = functionality.Cohort(db=database)
+    for lab_name in [glucose, "SODIUM"]:
+        assert store.canonical_units(lab_name) == (
+            functionality.canonical_units(lab_name, database)
+        )
+        for operator in [">", "!="]:
+            for threshold in [95, 145, 150, 180, 190]:
+                assert store.is_sick(lab_name, operator, threshold) == list(
+                    cohort.is_sick(lab_name, operator, threshold)
+                )
+    assert store.canonical_units(glucose) == "mg/dL"
+    assert store.is_sick(glucose, ">", 150) == ["1A"]  # 10 mmol/L
+    assert store.patient("1A").is_sick(glucose, ">", 150) is True
+    assert store.patient("2B").is_sick(glucose, ">", 150) is False
+    # furlongs have no conversion, so they never meet a threshold, even !=
+    assert store.is_sick(glucose, "!=", 90) == ["1A"]
+    assert store.patient("2B").is_sick(glucose, "!=", 90) is False
+    assert store.patient("1A").get_lab_test_values(glucose) == [10.0]
+    database.close()
@@ -1,8 +1,13 @@
 """Tests for funcitionality.py."""
+import datetime
 import functionality
+import pathlib
 import pytest
 import sqlite3
+import threading
+import typing
 import make_fake_files
+import make_synthetic_data
 
 
 class FunctionError(Exception):
@@ -11,6 +16,24 @@ class FunctionError(Exception):
     pass
 
 
+@pytest.fixture(autouse=True)
+def default_database(
+    tmp_path: pathlib.Path, monkeypatch: pytest.MonkeyPatch
+) -> typing.Iterator[None]:
+    """Run each test against its own ehr.db in a temporary directory.
+
+    Raw sqlite3 writes to it are noticed on the next cached read.
+    """
+    monkeypatch.chdir(tmp_path)
+    database = functionality.set_database(
+        functionality.Database(
+            str(tmp_path / "ehr.db"), cache_check_interval=0
+        )
+    )
+    yield
+    database.close()
+
+
 def test_seperate_lines_check_outer_length() -> None:
     """Test length of output is number of rows."""
     input_list = ["1\t2\t3\t4", "1\t2\t3\t4", "1\t2\t3\t4", "1\t2\t3\t4"]
@@ -125,6 +148,10 @@ def test_patient_cohort_general() -> None:
                 "Male",
                 "2000-06-15 02:45:40.547",
                 "White",
+                961037140547000,
+                "Single",
+                "English",
+                12.2,
             )
         ]
         connection.close()
@@ -174,12 +201,15 @@ def test_parse_data_input_wrong_column_order() -> None:
         pat_1a_labs_row = pat_1a_labs_row_ex.fetchall()
         assert pat_1a_labs_row == [
             (
-                "0",
+                1,
                 "1A",
                 "POTASSIUM",
                 37.0,
                 "mg/dL",
                 "2001-07-01 03:20:24.070",
+                993957624070000,
+                "1",
+                37.0,
             )
         ]
         connection.close()
@@ -195,10 +225,16 @@ def test_patient_age_general() -> None:
                 PatientID VARCHAR PRIMARY KEY,
                 PatientGender VARCHAR,
                 PatientDateOfBirth TIMESTAMP,
-                PatientRace VARCHAR)"""
+                PatientRace VARCHAR,
+                PatientBirthEpoch INTEGER,
+                PatientMaritalStatus VARCHAR,
+                PatientLanguage VARCHAR,
+                PatientPopulationPercentageBelowPoverty REAL)"""
     )
     cursor.execute(
-        "INSERT INTO Patients Values (?, ?, ?, ?)",
+        """INSERT INTO Patients
+        (PatientID, PatientGender, PatientDateOfBirth, PatientRace)
+        Values (?, ?, ?, ?)""",
         ("1A", "Male", "2001-07-01 03:20:24.070", "White"),
     )
     connection.commit()
@@ -216,10 +252,16 @@ def test_patient_age_wrong_format_dob() -> None:
                 PatientID VARCHAR PRIMARY KEY,
                 PatientGender VARCHAR,
                 PatientDateOfBirth TIMESTAMP,
-                PatientRace VARCHAR)"""
+                PatientRace VARCHAR,
+                PatientBirthEpoch INTEGER,
+                PatientMaritalStatus VARCHAR,
+                PatientLanguage VARCHAR,
+                PatientPopulationPercentageBelowPoverty REAL)"""
     )
     cursor.execute(
-        "INSERT INTO Patients Values (?, ?, ?, ?)",
+        """INSERT INTO Patients
+        (PatientID, PatientGender, PatientDateOfBirth, PatientRace)
+        Values (?, ?, ?, ?)""",
         ("1A", "Male", "2000-06-15 02:40.547", "White"),
     )
     connection.commit()
@@ -228,9 +270,6 @@ def test_patient_age_wrong_format_dob() -> None:
         pat_1a.dob
 
 
-test_patient_age_wrong_format_dob()
-
-
 def test_patient_sick() -> None:
     """Test (1) general get if sick patient example & not a patient error."""
     connection = sqlite3.connect("ehr.db")
@@ -242,19 +281,27 @@ def test_patient_sick() -> None:
                 PatientID VARCHAR PRIMARY KEY,
                 PatientGender VARCHAR,
                 PatientDateOfBirth TIMESTAMP,
-                PatientRace VARCHAR)"""
+                PatientRace VARCHAR,
+                PatientBirthEpoch INTEGER,
+                PatientMaritalStatus VARCHAR,
+                PatientLanguage VARCHAR,
+                PatientPopulationPercentageBelowPoverty REAL)"""
     )
     cursor.execute(
         """CREATE TABLE Labs(
-                LabID VARCHAR PRIMARY KEY,
+                LabID INTEGER PRIMARY KEY,
                 PatientID VARCHAR,
                 LabName VARCHAR,
                 LabValue FLOAT,
                 LabUnits VARCHAR,
-                LabDateTime TIMESTAMP)"""
+                LabDateTime TIMESTAMP,
+                LabEpoch INTEGER,
+                AdmissionID VARCHAR)"""
     )
     cursor.execute(
-        "INSERT INTO Patients Values (?, ?, ?, ?)",
+        """INSERT INTO Patients
+        (PatientID, PatientGender, PatientDateOfBirth, PatientRace)
+        Values (?, ?, ?, ?)""",
         ("1A", "Male", "2000-06-15 02:45:40.547", "White"),
     )
     connection.commit()
@@ -281,19 +328,27 @@ def test_get_patient_age_first_lab_general() -> None:
                 PatientID VARCHAR PRIMARY KEY,
                 PatientGender VARCHAR,
                 PatientDateOfBirth TIMESTAMP,
-                PatientRace VARCHAR)"""
+                PatientRace VARCHAR,
+                PatientBirthEpoch INTEGER,
+                PatientMaritalStatus VARCHAR,
+                PatientLanguage VARCHAR,
+                PatientPopulationPercentageBelowPoverty REAL)"""
     )
     cursor.execute(
         """CREATE TABLE Labs(
-                LabID VARCHAR PRIMARY KEY,
+                LabID INTEGER PRIMARY KEY,
                 PatientID VARCHAR,
                 LabName VARCHAR,
                 LabValue FLOAT,
                 LabUnits VARCHAR,
-                LabDateTime TIMESTAMP)"""
+                LabDateTime TIMESTAMP,
+                LabEpoch INTEGER,
+                AdmissionID VARCHAR)"""
     )
     cursor.execute(
-        "INSERT INTO Patients Values (?, ?, ?, ?)",
+        """INSERT INTO Patients
+        (PatientID, PatientGender, PatientDateOfBirth, PatientRace)
+        Values (?, ?, ?, ?)""",
         ("1A", "Male", "2001-07-01 03:20:24.070", "White"),
     )
     connection.commit()
@@ -307,3 +362,1198 @@ def test_get_patient_age_first_lab_general() -> None:
 
     pat_age_first_lab = pat_1a.get_age_at_first_lab()
     assert pat_age_first_lab == 20
+
+
+def test_stream_rows_chunks_and_reorders() -> None:
+    """Test streamed rows are reordered and split into bounded chunks."""
+    table = [["a", "b", "c"]] + [[str(i), str(i + 1), "x"] for i in range(5)]
+    with make_fake_files.fake_files(table) as (filename,):
+        chunks = list(functionality.stream_rows(filename, ["c", "a", "b"], 2))
+    assert list(map(len, chunks)) == [2, 2, 1]
+    assert chunks[0][1] == ["x", "1", "2"]
+
+
+def test_parse_data_bad_header_rolls_back() -> None:
+    """Test a bad labs header leaves the previous load untouched."""
+    test_sub_table = [
+        functionality.SUBJECT_COLUMNS,
+        ["1A", "Male", "2000-06-15 02:45:40.547", "White", "S", "E", "1"],
+    ]
+    test_lab_table = [
+        functionality.LAB_COLUMNS,
+        ["1A", "1", "POTASSIUM", "37", "mg/dL", "2001-07-01 03:20:24.070"],
+    ]
+    bad_lab_table = [["PatientID", "LabName"], ["2B", "SODIUM"]]
+    with make_fake_files.fake_files(
+        test_sub_table, test_lab_table, bad_lab_table
+    ) as (sub_filename, lab_filename, bad_filename):
+        functionality.parse_data(
+            sub_filename,
+            lab_filename,
+            functionality.LoadOptions(chunk_size=1, journal_mode="truncate"),
+        )
+        with pytest.raises(ValueError):
+            functionality.parse_data(sub_filename, bad_filename)
+    connection = sqlite3.connect("ehr.db")
+    labs = connection.execute("SELECT PatientID FROM Labs").fetchall()
+    connection.close()
+    assert labs == [("1A",)]
+
+
+def test_patient_labs_scoped_to_patient() -> None:
+    """Test labs only include the patient's own rows and use the index."""
+    test_sub_table = [
+        functionality.SUBJECT_COLUMNS,
+        ["1A", "Male", "2000-06-15 02:45:40.547", "White", "S", "E", "1"],
+        ["2B", "Female", "1990-01-01 00:00:00.000", "Asian", "M", "E", "2"],
+    ]
+    test_lab_table = [
+        functionality.LAB_COLUMNS,
+        ["1A", "1", "POTASSIUM", "37", "mg/dL", "2001-07-01 03:20:24.070"],
+        ["2B", "1", "SODIUM", "140", "mmol/L", "2001-07-01 03:20:24.070"],
+        ["2B", "1", "POTASSIUM", "4", "mg/dL", "2001-07-02 03:20:24.070"],
+    ]
+    with make_fake_files.fake_files(test_sub_table, test_lab_table) as (
+        sub_filename,
+        lab_filename,
+    ):
+        functionality.parse_data(sub_filename, lab_filename)
+    pat_1a_labs = functionality.Patient(pat_id="1A").labs
+    assert list(pat_1a_labs) == ["POTASSIUM"]
+    assert len(pat_1a_labs["POTASSIUM"]) == 1
+    assert sorted(functionality.Patient(pat_id="2B").labs) == [
+        "POTASSIUM",
+        "SODIUM",
+    ]
+    connection = sqlite3.connect("ehr.db")
+    plan = connection.execute(
+        "EXPLAIN QUERY PLAN SELECT LabID FROM Labs WHERE PatientID = ?",
+        ("1A",),
+    ).fetchall()
+    connection.close()
+    assert "idx_labs_patient" in str(plan)
+
+
+def test_database_reuses_thread_connection(tmp_path: pathlib.Path) -> None:
+    """Test a handle shares one connection per thread at a custom path."""
+    database = functionality.Database(str(tmp_path / "other.db"))
+    assert database.connection is database.connection
+    other_thread: list[sqlite3.Connection] = []
+    thread = threading.Thread(
+        target=lambda: other_thread.append(database.connection)
+    )
+    thread.start()
+    thread.join()
+    assert other_thread[0] is not database.connection
+    database.execute(
+        """CREATE TABLE Patients(
+                PatientID VARCHAR PRIMARY KEY,
+                PatientGender VARCHAR,
+                PatientDateOfBirth TIMESTAMP,
+                PatientRace VARCHAR,
+                PatientBirthEpoch INTEGER,
+                PatientMaritalStatus VARCHAR,
+                PatientLanguage VARCHAR,
+                PatientPopulationPercentageBelowPoverty REAL)"""
+    )
+    database.execute(
+        "INSERT INTO Patients Values (?, ?, ?, ?, ?, ?, ?, ?)",
+        ("1A", "Male", "2001-07-01 03:20:24.070", "White") + (None,) * 4,
+    )
+    assert functionality.Patient("1A", database).race == "White"
+    assert functionality.Patient("1A").db is functionality.get_database()
+    database.close()
+    assert (tmp_path / "other.db").exists()
+
+
+def test_load_labs_hydrated_and_lazy() -> None:
+    """Test batch-loaded labs carry every column and lazy labs agree."""
+    test_sub_table = [
+        functionality.SUBJECT_COLUMNS,
+        ["1A", "Male", "2000-06-15 02:45:40.547", "White", "S", "E", "1"],
+        ["2B", "Female", "1990-01-01 00:00:00.000", "Asian", "M", "E", "2"],
+    ]
+    test_lab_table = [
+        functionality.LAB_COLUMNS,
+        ["1A", "1", "POTASSIUM", "37", "mg/dL", "2001-07-01 03:20:24.070"],
+        ["2B", "1", "SODIUM", "140", "mmol/L", "2001-07-01 03:20:24.070"],
+    ]
+    with make_fake_files.fake_files(test_sub_table, test_lab_table) as (
+        sub_filename,
+        lab_filename,
+    ):
+        functionality.parse_data(sub_filename, lab_filename)
+    labs = functionality.load_labs(["1A", "2B", "3C"])
+    assert labs["3C"] == {}
+    sodium = labs["2B"]["SODIUM"][0]
+    assert not hasattr(sodium, "__dict__")
+    assert (sodium.name, sodium.value, sodium.units) == (
+        "SODIUM",
+        140.0,
+        "mmol/L",
+    )
+    lazy = functionality.Patient("2B").load_labs(lazy=True)["SODIUM"][0]
+    assert lazy.pat_id is None
+    assert lazy.units == "mmol/L"
+    assert lazy.pat_id == "2B"
+    assert lazy.time == sodium.time
+
+
+def test_patient_sick_operators() -> None:
+    """Test every supported operator and rejection of anything else."""
+    test_sub_table = [
+        functionality.SUBJECT_COLUMNS,
+        ["1A", "Male", "2000-06-15 02:45:40.547", "White", "S", "E", "1"],
+    ]
+    test_lab_table = [
+        functionality.LAB_COLUMNS,
+        ["1A", "1", "POTASSIUM", "4", "mmol/L", "2001-07-01 03:20:24.070"],
+        ["1A", "1", "POTASSIUM", "6", "mmol/L", "2001-07-02 03:20:24.070"],
+    ]
+    with make_fake_files.fake_files(test_sub_table, test_lab_table) as (
+        sub_filename,
+        lab_filename,
+    ):
+        functionality.parse_data(sub_filename, lab_filename)
+    pat_1a = functionality.Patient("1A")
+    expected_at_6 = {
+        "<": True,
+        "<=": True,
+        ">": False,
+        ">=": True,
+        "==": True,
+        "!=": True,
+    }
+    for operator, sick in expected_at_6.items():
+        assert pat_1a.is_sick("POTASSIUM", operator, 6) is sick
+    assert pat_1a.is_sick("POTASSIUM", ">", 5.5) is True
+    assert pat_1a.is_sick("POTASSIUM", "==", 5) is False
+    assert pat_1a.is_sick("SODIUM", ">", 0) is False
+    with pytest.raises(ValueError):
+        pat_1a.is_sick("POTASSIUM", "> 0 OR 1 =", 1)
+    with pytest.raises(ValueError):
+        pat_1a.is_sick("POTASSIUM", ">", "1; DROP TABLE Labs")  # type: ignore
+
+
+def test_cohort_is_sick() -> None:
+    """Test cohort-wide thresholds with and without a seed set."""
+    test_sub_table = [functionality.SUBJECT_COLUMNS] + [
+        [pat_id, "Male", "2000-06-15 02:45:40.547", "White", "S", "E", "1"]
+        for pat_id in ["1A", "2B", "3C"]
+    ]
+    test_lab_table = [
+        functionality.LAB_COLUMNS,
+        ["1A", "1", "POTASSIUM", "6", "mmol/L", "2001-07-01 03:20:24.070"],
+        ["1A", "1", "POTASSIUM", "7", "mmol/L", "2001-07-02 03:20:24.070"],
+        ["2B", "1", "POTASSIUM", "4", "mmol/L", "2001-07-01 03:20:24.070"],
+        ["3C", "1", "POTASSIUM", "5.6", "mmol/L", "2001-07-01 03:20:24.070"],
+        ["3C", "1", "SODIUM", "9", "mmol/L", "2001-07-01 03:20:24.070"],
+    ]
+    with make_fake_files.fake_files(test_sub_table, test_lab_table) as (
+        sub_filename,
+        lab_filename,
+    ):
+        functionality.parse_data(sub_filename, lab_filename)
+    cohort = functionality.Cohort(fetch_size=1)
+    assert list(cohort.is_sick("POTASSIUM", ">", 5.5)) == ["1A", "3C"]
+    seeded = functionality.Cohort(["2B", "3C"])
+    assert list(seeded.is_sick("POTASSIUM", ">", 5.5)) == ["3C"]
+    assert list(functionality.Cohort([]).is_sick("POTASSIUM", ">", 0)) == []
+
+
+def test_add_labs_allocates_integer_ids() -> None:
+    """Test lab ids are sqlite-allocated integers that order numerically."""
+    test_sub_table = [
+        functionality.SUBJECT_COLUMNS,
+        ["1A", "Male", "2000-06-15 02:45:40.547", "White", "S", "E", "1"],
+    ]
+    test_lab_table = [functionality.LAB_COLUMNS] + [
+        ["1A", "1", "POTASSIUM", "4", "mmol/L", "2001-07-01 03:20:24.070"]
+    ] * 9
+    with make_fake_files.fake_files(test_sub_table, test_lab_table) as (
+        sub_filename,
+        lab_filename,
+    ):
+        functionality.parse_data(sub_filename, lab_filename)
+    pat_1a = functionality.Patient("1A")
+    pat_1a.add_labs("SODIUM", 140, "mmol/L", "2001-07-03 03:20:24.070")
+    added = pat_1a.add_labs_bulk(
+        ("SODIUM", 130 + i, "mmol/L", "2001-07-04 03:20:24.070")
+        for i in range(1000)
+    )
+    assert added == 1000
+    connection = sqlite3.connect("ehr.db")
+    lab_ids = connection.execute(
+        "SELECT LabID FROM Labs ORDER BY LabID"
+    ).fetchall()
+    connection.close()
+    assert [lab_id[0] for lab_id in lab_ids] == list(range(1, 1011))
+    assert len(pat_1a.labs["SODIUM"]) == 1001
+
+
+def test_parse_data_quarantines_bad_rows() -> None:
+    """Test malformed dates and values are quarantined or rejected."""
+    test_sub_table = [
+        functionality.SUBJECT_COLUMNS,
+        ["1A", "Male", "2000-06-15 02:45:40.547", "White", "S", "E", "1"],
+        ["2B", "Male", "2000-06-15", "White", "S", "E", "1"],
+    ]
+    test_lab_table = [
+        functionality.LAB_COLUMNS,
+        ["1A", "1", "POTASSIUM", "4.5", "mmol/L", "2001-07-01 03:20:24.070"],
+        ["1A", "1", "POTASSIUM", "high", "mmol/L", "2001-07-01 03:20:24.070"],
+        ["1A", "1", "POTASSIUM", "4", "mmol/L", "yesterday"],
+    ]
+    with make_fake_files.fake_files(test_sub_table, test_lab_table) as (
+        sub_filename,
+        lab_filename,
+    ):
+        with pytest.raises(ValueError):
+            functionality.parse_data(
+                sub_filename,
+                lab_filename,
+                functionality.LoadOptions(bad_rows="raise"),
+            )
+        functionality.parse_data(sub_filename, lab_filename)
+    connection = sqlite3.connect("ehr.db")
+    quarantined = connection.execute(
+        "SELECT TableName, RowData FROM Quarantine"
+    ).fetchall()
+    connection.close()
+    assert [row[0] for row in quarantined] == ["Patients", "Labs", "Labs"]
+    assert quarantined[1][1].split("\t")[3] == "high"
+    pat_1a = functionality.Patient("1A")
+    assert pat_1a.get_lab_test_values("POTASSIUM") == [4.5]
+    assert pat_1a.dob == datetime.datetime(2000, 6, 15, 2, 45, 40, 547000)
+    with pytest.raises(ValueError):
+        pat_1a.add_labs("POTASSIUM", 4, "mmol/L", "2001-07-01")
+
+
+def test_parse_data_quarantines_truncated_rows(
+    tmp_path: pathlib.Path,
+) -> None:
+    """Test rows with missing fields are quarantined, not a crash."""
+    database = functionality.Database(str(tmp_path / "truncated.db"))
+    test_sub_table = [
+        functionality.SUBJECT_COLUMNS,
+        ["1A", "Male", "2000-06-15 02:45:40.547", "White", "S", "E", "1"],
+        ["2B", "Female"],
+    ]
+    test_lab_table = [
+        functionality.LAB_COLUMNS,
+        ["1A", "1", "POTASSIUM", "4.5", "mmol/L", "2001-07-01 03:20:24.070"],
+        ["1A", "1", "POTASSIUM", "5"],
+    ]
+    with make_fake_files.fake_files(test_sub_table, test_lab_table) as (
+        sub_filename,
+        lab_filename,
+    ):
+        chunks = list(
+            functionality.stream_rows(lab_filename, functionality.LAB_COLUMNS)
+        )
+        assert chunks[0][1] == functionality.ShortRow(
+            ["1A", "1", "POTASSIUM", "5"]
+        )
+        with pytest.raises(ValueError):
+            functionality.parse_data(
+                sub_filename,
+                lab_filename,
+                functionality.LoadOptions(bad_rows="raise"),
+                database,
+            )
+        reports = functionality.parse_data(
+            sub_filename, lab_filename, None, database
+        )
+    assert reports["Patients"] == functionality.LoadReport(1, 0, 0, 1)
+    assert reports["Labs"] == functionality.LoadReport(1, 0, 0, 1)
+    assert database.execute("SELECT RowData FROM Quarantine") == [
+        ("2B\tFemale",),
+        ("1A\t1\tPOTASSIUM\t5",),
+    ]
+    database.close()
+
+
+def test_age_at_first_lab_patient_and_cohort() -> None:
+    """Test age at first lab for one patient and for a whole cohort."""
+    test_sub_table = [
+        functionality.SUBJECT_COLUMNS,
+        ["1A", "Male", "2000-06-15 02:45:40.547", "White", "S", "E", "1"],
+        ["2B", "Female", "1990-01-01 00:00:00.000", "Asian", "M", "E", "2"],
+        ["3C", "Female", "1990-01-01 00:00:00.000", "Asian", "M", "E", "2"],
+    ]
+    test_lab_table = [
+        functionality.LAB_COLUMNS,
+        ["1A", "1", "SODIUM", "140", "mmol/L", "2030-07-01 03:20:24.070"],
+        ["1A", "1", "POTASSIUM", "4", "mmol/L", "2010-06-16 00:00:00.000"],
+        ["2B", "1", "POTASSIUM", "4", "mmol/L", "2001-07-01 03:20:24.070"],
+    ]
+    with make_fake_files.fake_files(test_sub_table, test_lab_table) as (
+        sub_filename,
+        lab_filename,
+    ):
+        functionality.parse_data(sub_filename, lab_filename)
+    assert functionality.Patient("1A").get_age_at_first_lab() == 10
+    with pytest.raises(ValueError):
+        functionality.Patient("3C").get_age_at_first_lab()
+    cohort = functionality.Cohort()
+    assert list(cohort.age_at_first_lab()) == [("1A", 10), ("2B", 11)]
+    seeded = functionality.Cohort(["2B", "3C"])
+    assert list(seeded.age_at_first_lab()) == [("2B", 11)]
+
+
+def test_patient_cache_hits_and_invalidation(tmp_path: pathlib.Path) -> None:
+    """Test demographics and labs are memoized and invalidated on writes."""
+    database = functionality.Database(str(tmp_path / "cache.db"))
+    test_sub_table = [
+        functionality.SUBJECT_COLUMNS,
+        ["1A", "Male", "2000-06-15 02:45:40.547", "White", "S", "E", "1"],
+    ]
+    test_lab_table = [
+        functionality.LAB_COLUMNS,
+        ["1A", "1", "POTASSIUM", "4", "mmol/L", "2001-07-01 03:20:24.070"],
+    ]
+    with make_fake_files.fake_files(test_sub_table, test_lab_table) as (
+        sub_filename,
+        lab_filename,
+    ):
+        functionality.parse_data(sub_filename, lab_filename, None, database)
+    pat_1a = functionality.Patient("1A", database)
+    with database.profile() as profiler:
+        assert (pat_1a.gender, pat_1a.race, pat_1a.dob.year) == (
+            "Male",
+            "White",
+            2000,
+        )
+    kinds = [event.kind for event in profiler.events]
+    assert kinds.count("query") == 1  # hits run no query at all
+    assert database.cache.info().misses == 1
+    assert database.cache.info().hits == 2
+    assert len(pat_1a.labs["POTASSIUM"]) == 1
+    pat_1a.labs["POTASSIUM"].clear()  # callers get their own lists
+    pat_1a.add_labs("POTASSIUM", 5, "mmol/L", "2001-07-02 03:20:24.070")
+    assert len(pat_1a.labs["POTASSIUM"]) == 2
+    database.cache_check_interval = 0  # notice outside commits at once
+    other = sqlite3.connect(tmp_path / "cache.db")
+    other.execute("UPDATE Patients SET PatientRace = 'Asian'")
+    other.commit()
+    other.close()
+    assert pat_1a.race == "Asian"
+    database.close()
+
+    cache = functionality.LRUCache(maxsize=10, max_weight=5)
+    cache.get(("1A", "labs"), lambda: [1, 2, 3], len)
+    cache.get(("2B", "labs"), lambda: [1, 2], len)
+    assert cache.info().weight == 5
+    cache.get(("3C", "labs"), lambda: [1], len)
+    assert (cache.info().currsize, cache.info().weight) == (2, 3)
+    assert cache.get(("4D", "labs"), lambda: list(range(9)), len) == list(
+        range(9)
+    )
+    assert cache.info().currsize == 2  # too heavy to cache
+
+
+def test_parse_files_sharded_in_process_pool(tmp_path: pathlib.Path) -> None:
+    """Test sharded files are parsed in parallel into one database."""
+    subject_shards = [
+        [
+            functionality.SUBJECT_COLUMNS,
+            [
+                pat_id,
+                "Male",
+                "2000-06-15 02:45:40.547",
+                "White",
+                "S",
+                "E",
+                "1",
+            ],
+        ]
+        for pat_id in ["1A", "2B"]
+    ]
+    lab_shards = [
+        [functionality.LAB_COLUMNS]
+        + [
+            [
+                pat_id,
+                "1",
+                "POTASSIUM",
+                str(i),
+                "mmol/L",
+                "2001-07-01 03:20:24.070",
+            ]
+            for i in range(shard * 10, shard * 10 + 10)
+        ]
+        + [
+            [
+                pat_id,
+                "1",
+                "POTASSIUM",
+                "bad",
+                "mmol/L",
+                "2001-07-01 03:20:24.070",
+            ]
+        ]
+        for shard, pat_id in enumerate(["1A", "2B", "1A"])
+    ]
+    for i, table in enumerate(subject_shards):
+        (tmp_path / f"subjects_{i}.tsv").write_text(
+            "\n".join("\t".join(row) for row in table)
+        )
+    for i, table in enumerate(lab_shards):
+        (tmp_path / f"labs_{i}.tsv").write_text(
+            "\n".join("\t".join(row) for row in table)
+        )
+    database = functionality.Database(str(tmp_path / "shards.db"))
+    functionality.parse_files(
+        [str(tmp_path / "subjects_0.tsv"), str(tmp_path / "subjects_1.tsv")],
+        str(tmp_path / "labs_*.tsv"),
+        processes=2,
+        options=functionality.LoadOptions(chunk_size=3),
+        database=database,
+    )
+    assert database.execute("SELECT COUNT(*) FROM Patients") == [(2,)]
+    assert database.execute("SELECT COUNT(*) FROM Quarantine") == [(3,)]
+    assert functionality.Patient("1A", database).get_lab_test_values(
+        "POTASSIUM"
+    ) == [float(i) for i in list(range(10)) + list(range(20, 30))]
+    with pytest.raises(ValueError):
+        functionality.parse_files(
+            str(tmp_path / "subjects_*.tsv"),
+            str(tmp_path / "missing_*.tsv"),
+            database=database,
+        )
+    database.close()
+
+
+def test_parse_data_append_mode_merges_by_natural_key() -> None:
+    """Test append mode inserts, updates and skips by natural key."""
+    test_sub_table = [
+        functionality.SUBJECT_COLUMNS,
+        ["1A", "Male", "2000-06-15 02:45:40.547", "White", "S", "E", "1"],
+    ]
+    test_lab_table = [
+        functionality.LAB_COLUMNS,
+        ["1A", "1", "POTASSIUM", "4", "mmol/L", "2001-07-01 03:20:24.070"],
+        ["1A", "1", "SODIUM", "140", "mmol/L", "2001-07-01 03:20:24.070"],
+    ]
+    delta_sub_table = [
+        functionality.SUBJECT_COLUMNS,
+        ["1A", "Male", "2000-06-15 02:45:40.547", "Asian", "S", "E", "1"],
+        ["2B", "Female", "1990-01-01 00:00:00.000", "Asian", "M", "E", "2"],
+    ]
+    delta_lab_table = [
+        functionality.LAB_COLUMNS,
+        ["1A", "1", "POTASSIUM", "4", "mmol/L", "2001-07-01 03:20:24.07"],
+        ["1A", "1", "SODIUM", "135", "mmol/L", "2001-07-01 03:20:24.070"],
+        ["1A", "2", "SODIUM", "138", "mmol/L", "2001-07-01 03:20:24.070"],
+        ["2B", "1", "SODIUM", "141", "mmol/L", "2001-07-01 03:20:24.070"],
+    ]
+    with make_fake_files.fake_files(
+        test_sub_table, test_lab_table, delta_sub_table, delta_lab_table
+    ) as (sub_filename, lab_filename, delta_sub_filename, delta_lab_filename):
+        functionality.parse_data(sub_filename, lab_filename)
+        pat_1a = functionality.Patient("1A")
+        assert pat_1a.race == "White"
+        reports = functionality.parse_data(
+            delta_sub_filename,
+            delta_lab_filename,
+            functionality.LoadOptions(mode="append"),
+        )
+    assert reports["Patients"] == functionality.LoadReport(1, 1, 0, 0)
+    assert reports["Labs"] == functionality.LoadReport(2, 1, 1, 0)
+    assert pat_1a.race == "Asian"
+    assert pat_1a.get_lab_test_values("SODIUM") == [135.0, 138.0]
+    assert functionality.Patient("2B").get_lab_test_values("SODIUM") == [141.0]
+    assert pat_1a.get_lab_test_values("POTASSIUM") == [4.0]  # same epoch
+    indexes = functionality.get_database().execute("PRAGMA index_list(Labs)")
+    assert sorted(row[1] for row in indexes) == [
+        "idx_labs_admission",
+        "idx_labs_name_canonical",
+        "idx_labs_patient",
+        "idx_labs_patient_epoch",
+    ]
+
+
+def test_append_mode_dedupes_delta_keys(tmp_path: pathlib.Path) -> None:
+    """Test a delta with repeated keys merges its last row, idempotently."""
+    database = functionality.Database(str(tmp_path / "dedupe.db"))
+    test_sub_table = [
+        functionality.SUBJECT_COLUMNS,
+        ["1A", "Male", "2000-06-15 02:45:40.547", "White", "S", "E", "1"],
+    ]
+    test_lab_table = [
+        functionality.LAB_COLUMNS,
+        ["1A", "1", "POTASSIUM", "4", "mmol/L", "2001-07-01 03:20:24.070"],
+    ]
+    delta_sub_table = [
+        functionality.SUBJECT_COLUMNS,
+        ["2B", "Female", "1990-01-01 00:00:00.000", "Asian", "M", "E", "2"],
+        ["2B", "Female", "1990-01-01 00:00:00.000", "White", "M", "E", "2"],
+    ]
+    delta_lab_table = [
+        functionality.LAB_COLUMNS,
+        ["1A", "1", "SODIUM", "140", "mmol/L", "2001-07-02 00:00:00.000"],
+        ["1A", "1", "SODIUM", "141", "mmol/L", "2001-07-02 00:00:00.000"],
+        ["1A", "1", "POTASSIUM", "5", "mmol/L", "2001-07-01 03:20:24.070"],
+        ["1A", "1", "POTASSIUM", "6", "mmol/L", "2001-07-01 03:20:24.070"],
+    ]
+    append = functionality.LoadOptions(mode="append", chunk_size=1)
+    with make_fake_files.fake_files(
+        test_sub_table, test_lab_table, delta_sub_table, delta_lab_table
+    ) as (sub_filename, lab_filename, delta_sub_filename, delta_lab_filename):
+        functionality.parse_data(sub_filename, lab_filename, None, database)
+        first = functionality.parse_data(
+            delta_sub_filename, delta_lab_filename, append, database
+        )
+        second = functionality.parse_data(
+            delta_sub_filename, delta_lab_filename, append, database
+        )
+    assert first["Patients"] == functionality.LoadReport(1, 0, 1, 0)
+    assert first["Labs"] == functionality.LoadReport(1, 1, 2, 0)
+    assert second["Patients"] == functionality.LoadReport(0, 0, 2, 0)
+    assert second["Labs"] == functionality.LoadReport(0, 0, 4, 0)
+    pat_1a = functionality.Patient("1A", database)
+    assert pat_1a.get_lab_test_values("SODIUM") == [141.0]
+    assert pat_1a.get_lab_test_values("POTASSIUM") == [6.0]
+    assert functionality.Patient("2B", database).race == "White"
+    database.close()
+
+
+def test_mmap_rows_matches_stream_rows(tmp_path: pathlib.Path) -> None:
+    """Test the mmap reader agrees with stream_rows and skips unused text."""
+    table = [["a", "b", "c"]] + [[str(i), str(i + 1), "x"] for i in range(5)]
+    with make_fake_files.fake_files(table) as (filename,):
+        assert list(functionality.mmap_rows(filename, ["c", "a", "b"], 2)) == (
+            list(functionality.stream_rows(filename, ["c", "a", "b"], 2))
+        )
+    raw = tmp_path / "raw.tsv"
+    raw.write_bytes(
+        b"\xef\xbb\xbfPatientID\tPatientLanguage\tPatientRace\r\n"
+        b"1A\t\xff\xfe\tWhite\r\n\r\n"
+    )
+    rows = functionality.mmap_rows(
+        str(raw),
+        ["PatientID", "PatientRace", "PatientLanguage"],
+        used_columns=["PatientID", "PatientRace"],
+    )
+    assert list(rows) == [[["1A", "White", ""]]]
+    empty = tmp_path / "empty.tsv"
+    empty.write_bytes(b"")
+    with pytest.raises(ValueError):
+        list(functionality.mmap_rows(str(empty), ["PatientID"]))
+
+
+def test_synthetic_files_load_cleanly() -> None:
+    """Test synthetic data has the requested size and loads cleanly."""
+    with make_synthetic_data.synthetic_files(50, 1000, seed=1) as (
+        sub_filename,
+        lab_filename,
+    ):
+        reports = functionality.parse_data(sub_filename, lab_filename)
+    assert reports["Patients"] == functionality.LoadReport(inserted=50)
+    assert reports["Labs"] == functionality.LoadReport(inserted=1000)
+
+
+def test_database_profile_groups_queries_by_call_site(
+    tmp_path: pathlib.Path,
+) -> None:
+    """Test profiled queries are timed and attributed to the calling API."""
+    database = functionality.Database(str(tmp_path / "profile.db"))
+    test_sub_table = [
+        functionality.SUBJECT_COLUMNS,
+        ["1A", "Male", "2000-06-15 02:45:40.547", "White", "S", "E", "1"],
+    ]
+    test_lab_table = [
+        functionality.LAB_COLUMNS,
+        ["1A", "1", "POTASSIUM", "4", "mmol/L", "2001-07-01 03:20:24.070"],
+    ]
+    with make_fake_files.fake_files(test_sub_table, test_lab_table) as (
+        sub_filename,
+        lab_filename,
+    ):
+        with database.profile() as profiler:
+            functionality.parse_data(
+                sub_filename, lab_filename, None, database
+            )
+            pat_1a = functionality.Patient("1A", database)
+            assert pat_1a.gender == "Male"
+            assert pat_1a.race == "White"
+            assert len(pat_1a.labs["POTASSIUM"]) == 1
+            assert list(
+                functionality.Cohort(db=database).is_sick("POTASSIUM", ">", 3)
+            ) == ["1A"]
+            pat_1a.add_labs("POTASSIUM", 5, "mmol/L", "2001-07-02 03:20:24.07")
+    assert not database.listeners
+    summary = profiler.summary()
+    assert summary["parse_data"].connections == 1
+    sites = [
+        (event.site, event.sql.split()[0])
+        for event in profiler.events
+        if event.kind == "query"
+    ]
+    assert ("Patient.gender", "SELECT") in sites
+    assert ("Patient.race", "SELECT") not in sites  # served from the cache
+    assert [
+        event.rows
+        for event in profiler.events
+        if event.site == "Patient.labs" and event.sql.startswith("SELECT La")
+    ] == [1]
+    assert summary["Cohort.is_sick"].rows == 1
+    assert summary["Patient.add_labs"].rows == 1
+    assert all(event.seconds >= 0 for event in profiler.events)
+    assert "Patient.labs" in profiler.report()
+    database.close()
+
+
+def test_time_windowed_lab_queries(tmp_path: pathlib.Path) -> None:
+    """Test start/end restrict labs to [start, end) in time order."""
+    database = functionality.Database(str(tmp_path / "window.db"))
+    test_sub_table = [
+        functionality.SUBJECT_COLUMNS,
+        ["1A", "Male", "2000-06-15 02:45:40.547", "White", "S", "E", "1"],
+        ["2B", "Female", "1990-01-01 00:00:00.000", "Asian", "M", "E", "2"],
+    ]
+    test_lab_table = [
+        functionality.LAB_COLUMNS,
+        ["1A", "1", "POTASSIUM", "6", "mmol/L", "2001-07-03 00:00:00.000"],
+        ["1A", "1", "POTASSIUM", "4", "mmol/L", "2001-07-01 00:00:00.000"],
+        ["1A", "1", "POTASSIUM", "5", "mmol/L", "2001-07-02 00:00:00.000"],
+        ["1A", "1", "SODIUM", "140", "mmol/L", "2001-07-02 12:00:00.000"],
+        ["2B", "1", "POTASSIUM", "6", "mmol/L", "2001-07-01 00:00:00.000"],
+    ]
+    with make_fake_files.fake_files(test_sub_table, test_lab_table) as (
+        sub_filename,
+        lab_filename,
+    ):
+        functionality.parse_data(sub_filename, lab_filename, None, database)
+    pat_1a = functionality.Patient("1A", database)
+    start = datetime.datetime(2001, 7, 2)
+    assert pat_1a.get_lab_test_values("POTASSIUM") == [4.0, 5.0, 6.0]
+    assert pat_1a.get_lab_test_values("POTASSIUM", start) == [5.0, 6.0]
+    assert pat_1a.get_lab_test_values(
+        "POTASSIUM", "2001-07-01 00:00:00.000", "2001-07-03 00:00:00.000"
+    ) == [4.0, 5.0]
+    assert pat_1a.get_lab_test_values(
+        "POTASSIUM", end="2001-01-01 0:0:0.0"
+    ) == ("Patient has no tests for POTASSIUM")
+    window = pat_1a.load_labs(start=start, end=datetime.datetime(2001, 7, 3))
+    assert {
+        name: [lab.value for lab in labs] for name, labs in window.items()
+    } == {
+        "POTASSIUM": [5.0],
+        "SODIUM": [140.0],
+    }
+    lazy = pat_1a.load_labs(lazy=True, start=start)
+    assert [lab.value for lab in lazy["POTASSIUM"]] == [5.0, 6.0]
+    assert pat_1a.is_sick("POTASSIUM", "<", 4.5) is True
+    assert pat_1a.is_sick("POTASSIUM", "<", 4.5, start=start) is False
+    cohort = functionality.Cohort(db=database)
+    assert list(cohort.is_sick("POTASSIUM", ">", 5.5)) == ["1A", "2B"]
+    assert list(cohort.is_sick("POTASSIUM", ">", 5.5, start)) == ["1A"]
+    plan = database.execute(
+        "EXPLAIN QUERY PLAN SELECT LabValue FROM Labs WHERE PatientID = ?"
+        " AND LabName = ? AND LabEpoch >= ? ORDER BY LabEpoch",
+        ("1A", "POTASSIUM", 0),
+    )
+    assert "idx_labs_patient (" in str(plan)
+    assert "TEMP B-TREE" not in str(plan)
+    database.close()
+
+
+def test_lab_summary_materialized_and_maintained(
+    tmp_path: pathlib.Path,
+) -> None:
+    """Test LabSummary is built on load and kept current by writes."""
+    database = functionality.Database(str(tmp_path / "summary.db"))
+    test_sub_table = [
+        functionality.SUBJECT_COLUMNS,
+        ["1A", "Male", "2000-06-15 02:45:40.547", "White", "S", "E", "1"],
+        ["2B", "Female", "1990-01-01 00:00:00.000", "Asian", "M", "E", "2"],
+    ]
+    test_lab_table = [
+        functionality.LAB_COLUMNS,
+        ["1A", "1", "POTASSIUM", "6", "mmol/L", "2001-07-03 00:00:00.000"],
+        ["1A", "1", "POTASSIUM", "3", "mmol/L", "2001-07-01 00:00:00.000"],
+        ["1A", "1", "SODIUM", "140", "mmol/L", "2001-07-02 12:00:00.000"],
+        ["2B", "1", "POTASSIUM", "5", "mmol/L", "2001-07-01 00:00:00.000"],
+    ]
+    with make_fake_files.fake_files(test_sub_table, test_lab_table) as (
+        sub_filename,
+        lab_filename,
+    ):
+        functionality.parse_data(sub_filename, lab_filename, None, database)
+    pat_1a = functionality.Patient("1A", database)
+    assert pat_1a.lab_summary("POTASSIUM") == functionality.LabSummary(
+        2, 3.0, 6.0, 4.5, 6.0, datetime.datetime(2001, 7, 3)
+    )
+    assert pat_1a.lab_summary("CREATININE") is None
+    assert sorted(pat_1a.lab_summaries()) == ["POTASSIUM", "SODIUM"]
+
+    pat_1a.add_labs("POTASSIUM", 9, "mmol/L", "2001-07-02 00:00:00.000")
+    pat_1a.add_labs("CREATININE", 1, "mg/dL", "2001-07-02 00:00:00.000")
+    assert pat_1a.lab_summary("POTASSIUM") == functionality.LabSummary(
+        3, 3.0, 9.0, 6.0, 6.0, datetime.datetime(2001, 7, 3)
+    )
+    assert pat_1a.lab_summary("CREATININE") == functionality.LabSummary(
+        1, 1.0, 1.0, 1.0, 1.0, datetime.datetime(2001, 7, 2)
+    )
+
+    delta_lab_table = [
+        functionality.LAB_COLUMNS,
+        ["1A", "1", "POTASSIUM", "2", "mmol/L", "2001-07-03 00:00:00.000"],
+        ["2B", "1", "POTASSIUM", "7", "mmol/L", "2001-08-01 00:00:00.000"],
+    ]
+    with make_fake_files.fake_files(test_sub_table, delta_lab_table) as (
+        sub_filename,
+        lab_filename,
+    ):
+        functionality.parse_data(
+            sub_filename,
+            lab_filename,
+            functionality.LoadOptions(mode="append"),
+            database,
+        )
+    cohort = functionality.Cohort(db=database)
+    assert list(cohort.lab_summary("POTASSIUM")) == [
+        (
+            "1A",
+            functionality.LabSummary(
+                3, 2.0, 9.0, 14 / 3, 2.0, datetime.datetime(2001, 7, 3)
+            ),
+        ),
+        (
+            "2B",
+            functionality.LabSummary(
+                2, 5.0, 7.0, 6.0, 7.0, datetime.datetime(2001, 8, 1)
+            ),
+        ),
+    ]
+    database.execute("DELETE FROM Labs WHERE LabName = 'CREATININE'")
+    assert pat_1a.lab_summary("CREATININE") is None
+    database.close()
+
+
+def test_admissions_and_demographics_retained(tmp_path: pathlib.Path) -> None:
+    """Test admissions and all patient columns are kept and indexed."""
+    database = functionality.Database(str(tmp_path / "admissions.db"))
+    test_sub_table = [
+        functionality.SUBJECT_COLUMNS,
+        ["1A", "Male", "2000-06-15 02:45:40.547", "White", "S", "En", "9.5"],
+        ["2B", "Female", "1990-01-01 00:00:00.000", "Asian", "M", "Es", ""],
+        ["3C", "Female", "1990-01-01 00:00:00.000", "Asian", "M", "Es", "101"],
+        ["4D", "Male", "1990-01-01 00:00:00.000", "Asian", "M", "Es", "N/A"],
+    ]
+    test_lab_table = [
+        functionality.LAB_COLUMNS,
+        ["1A", "2", "POTASSIUM", "6", "mmol/L", "2010-06-16 00:00:00.000"],
+        ["1A", "1", "POTASSIUM", "5", "mmol/L", "2009-06-16 00:00:00.000"],
+        ["1A", "1", "SODIUM", "140", "mmol/L", "2009-06-18 00:00:00.000"],
+        ["1A", "2", "POTASSIUM", "4", "mmol/L", "2010-06-15 00:00:00.000"],
+        ["2B", "1", "POTASSIUM", "4", "mmol/L", "2001-07-02 03:20:24.070"],
+    ]
+    with make_fake_files.fake_files(test_sub_table, test_lab_table) as (
+        sub_filename,
+        lab_filename,
+    ):
+        reports = functionality.parse_data(
+            sub_filename, lab_filename, None, database
+        )
+    # bad poverty values are quarantined alone; their patients are kept
+    assert reports["Patients"].inserted == 4
+    assert reports["Patients"].quarantined == 2
+    reasons = database.execute("SELECT Reason FROM Quarantine")
+    assert all(
+        reason.startswith("PatientPopulationPercentageBelowPoverty")
+        for reason, in reasons
+    )
+    pat_1a = functionality.Patient("1A", database)
+    pat_2b = functionality.Patient("2B", database)
+    assert (pat_1a.marital_status, pat_1a.language) == ("S", "En")
+    assert pat_1a.poverty_percentage == 9.5
+    assert pat_2b.poverty_percentage is None
+    pat_3c = functionality.Patient("3C", database)
+    assert (pat_3c.gender, pat_3c.poverty_percentage) == ("Female", None)
+    assert functionality.Patient("4D", database).poverty_percentage is None
+    assert pat_1a.admissions() == [
+        functionality.Admission(
+            "1",
+            datetime.datetime(2009, 6, 16),
+            datetime.datetime(2009, 6, 18),
+            2,
+        ),
+        functionality.Admission(
+            "2",
+            datetime.datetime(2010, 6, 15),
+            datetime.datetime(2010, 6, 16),
+            2,
+        ),
+    ]
+    second = pat_1a.admission_labs("2")
+    assert [lab.value for lab in second["POTASSIUM"]] == [4.0, 6.0]
+    assert list(pat_1a.admission_labs("1")) == ["POTASSIUM", "SODIUM"]
+    assert pat_1a.admission_labs("3") == {}
+
+    pat_1a.add_labs("SODIUM", 135, "mmol/L", "2010-06-20 00:00:00.000", "2")
+    pat_1a.add_labs("SODIUM", 135, "mmol/L", "2011-01-01 00:00:00.000")
+    assert pat_1a.admissions()[1] == functionality.Admission(
+        "2",
+        datetime.datetime(2010, 6, 15),
+        datetime.datetime(2010, 6, 20),
+        3,
+    )
+    database.execute("DELETE FROM Labs WHERE AdmissionID = '1'")
+    assert [admission.admission_id for admission in pat_1a.admissions()] == [
+        "2"
+    ]
+    plan = database.execute(
+        "EXPLAIN QUERY PLAN "
+        + functionality.LAB_SELECT
+        + " WHERE PatientID = ? AND AdmissionID = ?"
+        " ORDER BY LabName, LabEpoch",
+        ("1A", "2"),
+    )
+    assert "idx_labs_admission" in str(plan)
+    assert "TEMP B-TREE" not in str(plan)
+    database.close()
+
+
+def test_concurrent_mode_group_commits_writes(tmp_path: pathlib.Path) -> None:
+    """Test WAL mode groups queued writes and readers see snapshots."""
+    database = functionality.Database(
+        str(tmp_path / "concurrent.db"), concurrent=True
+    )
+    test_sub_table = [
+        functionality.SUBJECT_COLUMNS,
+        ["1A", "Male", "2000-06-15 02:45:40.547", "White", "S", "E", "1"],
+        ["2B", "Female", "1990-01-01 00:00:00.000", "Asian", "M", "E", "2"],
+    ]
+    test_lab_table = [
+        functionality.LAB_COLUMNS,
+        ["1A", "1", "POTASSIUM", "5", "mmol/L", "2009-06-16 00:00:00.000"],
+    ]
+    with make_fake_files.fake_files(test_sub_table, test_lab_table) as (
+        sub_filename,
+        lab_filename,
+    ):
+        functionality.parse_data(sub_filename, lab_filename, None, database)
+    assert database.execute("PRAGMA journal_mode")[0][0] == "wal"
+    pat_1a = functionality.Patient("1A", database)
+
+    # writes queued while another connection holds the lock share a commit
+    blocker = database.connect(isolation_level=None)
+    blocker.execute("BEGIN IMMEDIATE")
+    writer = database.writer
+    futures = [
+        writer.submit(
+            functionality.LAB_INSERT,
+            [("2B", "1", "SODIUM", 130 + i, "mmol/L", "2001-07-01", i)],
+        )
+        for i in range(5)
+    ]
+    failing = writer.submit("INSERT INTO Missing VALUES (?)", [(1,)])
+    blocker.execute("COMMIT")
+    blocker.close()
+    writer.flush()
+    assert [future.result() for future in futures] == [1] * 5
+    with pytest.raises(sqlite3.OperationalError):
+        failing.result()
+    assert (writer.commits, writer.writes) == (1, 6)
+    assert functionality.Patient("2B", database).get_lab_test_values(
+        "SODIUM"
+    ) == [130.0, 131.0, 132.0, 133.0, 134.0]
+
+    # concurrent add_labs callers and readers never see "database is locked"
+    errors: list[Exception] = []
+
+    def add() -> None:
+        try:
+            for _ in range(10):
+                pat_1a.add_labs(
+                    "POTASSIUM", 4, "mmol/L", "2010-06-16 00:00:00.000"
+                )
+        except Exception as error:
+            errors.append(error)
+
+    def read() -> None:
+        try:
+            for _ in range(20):
+                reader = functionality.Patient("1A", database)
+                with database.snapshot():
+                    values = reader.get_lab_test_values("POTASSIUM")
+                    summary = reader.lab_summary("POTASSIUM")
+                assert summary is not None
+                assert summary.n_labs == len(values)
+        except Exception as error:
+            errors.append(error)
+
+    threads = [threading.Thread(target=add) for _ in range(4)]
+    threads += [threading.Thread(target=read) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    assert len(pat_1a.get_lab_test_values("POTASSIUM")) == 41
+    assert writer.writes == 46
+
+    with database.snapshot():
+        before = pat_1a.get_lab_test_values("POTASSIUM")
+        pat_2b = functionality.Patient("2B", database)
+        writing = threading.Thread(
+            target=lambda: pat_1a.add_labs(
+                "POTASSIUM", 3, "mmol/L", "2011-01-01 00:00:00.000"
+            )
+        )
+        writing.start()
+        writing.join()
+        assert pat_1a.get_lab_test_values("POTASSIUM") == before
+        with pytest.raises(RuntimeError):
+            with database.snapshot():
+                pass
+    assert pat_2b.gender == "Female"
+    assert len(pat_1a.get_lab_test_values("POTASSIUM")) == 42
+    with database.snapshot():  # the writer commits on its own connection
+        assert len(pat_1a.get_lab_test_values("POTASSIUM")) == 42
+        pat_1a.add_labs("POTASSIUM", 3, "mmol/L", "2012-01-01 00:00:00.000")
+        assert len(pat_1a.get_lab_test_values("POTASSIUM")) == 42
+    assert len(pat_1a.get_lab_test_values("POTASSIUM")) == 43
+    database.close()
+
+
+def test_snapshot_rejects_writes_without_concurrent(
+    tmp_path: pathlib.Path,
+) -> None:
+    """Test writing inside a rollback-journal snapshot raises cleanly."""
+    database = functionality.Database(str(tmp_path / "snapshot.db"))
+    test_sub_table = [
+        functionality.SUBJECT_COLUMNS,
+        ["1A", "Male", "2000-06-15 02:45:40.547", "White", "S", "E", "1"],
+    ]
+    test_lab_table = [
+        functionality.LAB_COLUMNS,
+        ["1A", "1", "POTASSIUM", "5", "mmol/L", "2009-06-16 00:00:00.000"],
+    ]
+    with make_fake_files.fake_files(test_sub_table, test_lab_table) as (
+        sub_filename,
+        lab_filename,
+    ):
+        functionality.parse_data(sub_filename, lab_filename, None, database)
+    pat_1a = functionality.Patient("1A", database)
+    with database.snapshot():
+        with pytest.raises(RuntimeError, match="snapshot"):
+            pat_1a.add_labs(
+                "POTASSIUM", 4, "mmol/L", "2010-06-16 00:00:00.000"
+            )
+        assert pat_1a.get_lab_test_values("POTASSIUM") == [5.0]
+    assert not database.connection.in_transaction
+    pat_1a.add_labs("POTASSIUM", 4, "mmol/L", "2010-06-16 00:00:00.000")
+    assert pat_1a.get_lab_test_values("POTASSIUM") == [5.0, 4.0]
+    database.close()
+
+
+def test_cohort_ages_and_histogram(tmp_path: pathlib.Path) -> None:
+    """Test cohort ages come from one query at a fixed reference time."""
+    database = functionality.Database(str(tmp_path / "ages.db"))
+    test_sub_table = [
+        functionality.SUBJECT_COLUMNS,
+        ["1A", "Male", "2000-06-15 02:45:40.547", "White", "S", "E", "1"],
+        ["2B", "Female", "1990-01-01 00:00:00.000", "Asian", "M", "E", "2"],
+        ["3C", "Female", "1995-01-01 00:00:00.000", "Asian", "M", "E", "2"],
+        ["4D", "Male", "1979-12-31 00:00:00.000", "White", "M", "E", "2"],
+        ["5E", "Female", "1980-02-01 00:00:00.000", "White", "M", "E", "2"],
+    ]
+    with make_fake_files.fake_files(
+        test_sub_table, [functionality.LAB_COLUMNS]
+    ) as (sub_filename, lab_filename):
+        functionality.parse_data(sub_filename, lab_filename, None, database)
+    cohort = functionality.Cohort(db=database)
+    as_of = datetime.datetime(2020, 6, 15)
+    with database.profile() as profiler:
+        pat_ids, ages = cohort.ages(as_of)
+    assert [event.kind for event in profiler.events].count("query") == 1
+    assert pat_ids == ["1A", "2B", "3C", "4D", "5E"]
+    assert ages.tolist() == [19, 30, 25, 40, 40]
+    pat_ids, ages = functionality.Cohort(["3C", "9Z", "1A"], database).ages(
+        "2020-06-16 00:00:00.000"
+    )
+    assert (pat_ids, ages.tolist()) == (["1A", "3C"], [20, 25])
+    pat_ids, ages = cohort.ages()
+    assert ages.tolist() == [
+        functionality.Patient(pat_id, database).age for pat_id in pat_ids
+    ]
+
+    assert cohort.age_histogram(10, as_of) == {
+        ("Female", "Asian"): {20: 1, 30: 1},
+        ("Female", "White"): {40: 1},
+        ("Male", "White"): {10: 1, 40: 1},
+    }
+    assert functionality.Cohort(["9Z"], database).age_histogram() == {}
+    with pytest.raises(ValueError):
+        cohort.age_histogram(0)
+    database.close()
+
+
+def test_unit_normalization(tmp_path: pathlib.Path) -> None:
+    """Test thresholds and summaries run on values in canonical units."""
+    database = functionality.Database(str(tmp_path / "units.db"))
+    glucose = "METABOLIC: GLUCOSE"
+    test_sub_table = [
+        functionality.SUBJECT_COLUMNS,
+        ["1A", "Male", "2000-06-15 02:45:40.547", "White", "S", "E", "1"],
+        ["2B", "Female", "1990-01-01 00:00:00.000", "Asian", "M", "E", "2"],
+    ]
+    test_lab_table = [
+        functionality.LAB_COLUMNS,
+        ["1A", "1", glucose, "100", "mg/dL", "2009-06-16 00:00:00.000"],
+        ["1A", "1", glucose, "10", "mmol/L", "2009-06-17 00:00:00.000"],
+        ["2B", "1", glucose, "90", "mg/dL", "2001-07-01 00:00:00.000"],
+        ["2B", "1", glucose, "200", "furlongs", "2001-07-02 00:00:00.000"],
+    ]
+    with make_fake_files.fake_files(test_sub_table, test_lab_table) as (
+        sub_filename,
+        lab_filename,
+    ):
+        functionality.parse_data(sub_filename, lab_filename, None, database)
+    assert functionality.canonical_units(glucose, database) == "mg/dL"
+    assert functionality.canonical_units("SODIUM", database) is None
+    pat_1a = functionality.Patient("1A", database)
+    pat_2b = functionality.Patient("2B", database)
+    assert pat_1a.is_sick(glucose, ">", 150) is True  # 10 mmol/L
+    assert pat_2b.is_sick(glucose, ">", 150) is False  # furlongs ignored
+    assert pat_1a.get_lab_test_values(glucose) == [100.0, 10.0]
+    summary = pat_1a.lab_summary(glucose)
+    assert summary is not None
+    assert (summary.n_labs, summary.minimum) == (2, 100.0)
+    assert summary.maximum == pytest.approx(180.2, abs=0.1)
+    summary = pat_2b.lab_summary(glucose)
+    assert summary is not None and summary.n_labs == 1
+    cohort = functionality.Cohort(db=database)
+    assert list(cohort.is_sick(glucose, ">", 150)) == ["1A"]
+    assert list(cohort.is_sick(glucose, "<", 95)) == ["2B"]
+
+    # new units are registered and converted as labs are added
+    pat_2b.add_labs(glucose, 1.6, "g/L", "2001-07-03 00:00:00.000")
+    pat_2b.add_labs("SODIUM", 140, "mEq/L", "2001-07-03 00:00:00.000")
+    pat_2b.add_labs("SODIUM", 130, "mmol/L", "2001-07-04 00:00:00.000")
+    assert list(cohort.is_sick(glucose, ">", 150)) == ["1A", "2B"]
+    assert functionality.canonical_units("SODIUM", database) == "mmol/L"
+    summary = pat_2b.lab_summary("SODIUM")
+    assert summary is not None
+    assert (summary.minimum, summary.maximum) == (130.0, 140.0)
+
+    # labs missing from the catalog keep their first units
+    pat_2b.add_labs("FERRITIN", 50, "ng/mL", "2001-07-05 00:00:00.000")
+    pat_2b.add_labs("FERRITIN", 0.05, "mg/L", "2001-07-06 00:00:00.000")
+    assert functionality.canonical_units("FERRITIN", database) == "ng/mL"
+    for lab_name, frequencies, expected in [
+        ("SODIUM", {"mEq/L": 3, "mmol/L": 1}, "mmol/L"),
+        (glucose, {"furlongs": 5, "mmol/L": 1}, "mg/dL"),
+        ("CBC: MEAN CORPUSCULAR HEMOGLOBIN", {"pg": 2, "fmol": 1}, "pg"),
+        ("FERRITIN", {"ng/mL": 1, "mg/L": 1}, "mg/L"),
+    ]:
+        assert functionality.choose_canonical_units(lab_name, frequencies) == (
+            expected
+        )
+
+    # mEq/L is mmol/L only for monovalent ions
+    pat_2b.add_labs("MAGNESIUM", 0.9, "mmol/L", "2001-07-07 00:00:00.000")
+    pat_2b.add_labs("MAGNESIUM", 2.0, "mEq/L", "2001-07-08 00:00:00.000")
+    summary = pat_2b.lab_summary("MAGNESIUM")
+    assert summary is not None
+    assert (summary.minimum, summary.maximum) == (0.9, 1.0)
+    pat_2b.add_labs("PHOSPHATE", 1.0, "mmol/L", "2001-07-07 00:00:00.000")
+    pat_2b.add_labs("PHOSPHATE", 5.0, "mEq/L", "2001-07-08 00:00:00.000")
+    assert pat_2b.is_sick("PHOSPHATE", ">", 2) is False  # not converted
+    assert functionality.unit_factor("PHOSPHATE", "mEq/L", "mmol/L") is None
+    assert functionality.unit_factor("MAGNESIUM", "mmol/L", "mEq/L") == 2.0
+    assert functionality.unit_factor("SODIUM", "mEq/L", "mmol/L") == 1.0
+
+    # appends convert staged rows and updated units are reconverted
+    delta = [
+        functionality.LAB_COLUMNS,
+        ["2B", "1", glucose, "5", "mmol/L", "2001-07-01 00:00:00.000"],
+    ]
+    with make_fake_files.fake_files(test_sub_table, delta) as (
+        sub_filename,
+        lab_filename,
+    ):
+        functionality.parse_data(
+            sub_filename,
+            lab_filename,
+            functionality.LoadOptions(mode="append"),
+            database,
+        )
+    summary = pat_2b.lab_summary(glucose)
+    assert summary is not None
+    assert summary.minimum == pytest.approx(90.1, abs=0.1)
+    database.execute("UPDATE Labs SET LabUnits = 'mg/dL' WHERE LabValue = 200")
+    assert pat_2b.is_sick(glucose, ">=", 200) is True
+    plan = database.execute(
+        "EXPLAIN QUERY PLAN SELECT PatientID FROM Labs"
+        " WHERE LabName = ? AND LabCanonicalValue > ?",
+        (glucose, 150.0),
+    )
+    assert "idx_labs_name_canonical" in str(plan)
+    database.close()
+
+
+def test_add_labs_upgrades_files_without_unit_tables(
+    tmp_path: pathlib.Path,
+) -> None:
+    """Test the first write adds the unit schema and converts old labs."""
+    path = tmp_path / "old.db"
+    connection = sqlite3.connect(path)
+    connection.execute(
+        """CREATE TABLE Labs(
+                LabID INTEGER PRIMARY KEY,
+                PatientID VARCHAR,
+                LabName VARCHAR,
+                LabValue FLOAT,
+                LabUnits VARCHAR,
+                LabDateTime TIMESTAMP,
+                LabEpoch INTEGER,
+                AdmissionID VARCHAR)"""
+    )
+    connection.execute(
+        """INSERT INTO Labs
+        (PatientID, LabName, LabValue, LabUnits, LabDateTime, LabEpoch)
+        VALUES ('1A', 'METABOLIC: GLUCOSE', 10, 'mmol/L', '2001', 0)"""
+    )
+    connection.commit()
+    connection.close()
+    database = functionality.Database(str(path))
+    pat_1a = functionality.Patient("1A", database)
+    pat_1a.add_labs(
+        "METABOLIC: GLUCOSE", 90, "mg/dL", "2002-01-01 00:00:00.000"
+    )
+    assert pat_1a.is_sick("METABOLIC: GLUCOSE", ">", 150) is True
+    assert pat_1a.is_sick("METABOLIC: GLUCOSE", "<", 95) is True
+    assert functionality.canonical_units("METABOLIC: GLUCOSE", database) == (
+        "mg/dL"
+    )
+    database.close()
+
+
+@pytest.mark.parametrize(
+    "timestamp",
+    [
+        "2001-07-01 03:20:24.070",
+        "2001-07-01 03:20:24.070123",
+        "2010-01-01 0:0:0.0",
+        "2010-01-01 00:00:00.1",
+    ],
+)
+def test_parse_timestamp_matches_strptime(timestamp: str) -> None:
+    """Test the fromisoformat fast path agrees with strptime."""
+    assert functionality.parse_timestamp(timestamp) == (
+        datetime.datetime.strptime(timestamp, functionality.DATETIME_FORMAT)
+    )
+
+
+@pytest.mark.parametrize(
+    "timestamp",
+    ["2001-13-01 03:20:24.070", "2001-07-01 03:20:24.07Z", "2001-07-01"],
+)
+def test_parse_timestamp_rejects_malformed(timestamp: str) -> None:
+    """Test malformed timestamps raise ValueError on either path."""
+    with pytest.raises(ValueError):
+        functionality.to_epoch(timestamp)
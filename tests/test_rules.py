@@ -0,0 +1,94 @@
+"""Tests for rules.py."""
+import functionality
+import make_fake_files
+import pathlib
+import pytest
+import rules
+
+SUB_TABLE = [
+    functionality.SUBJECT_COLUMNS,
+    ["1A", "Male", "2000-06-15 02:45:40.547", "White", "S", "E", "1"],
+    ["2B", "Female", "1990-01-01 00:00:00.000", "Asian", "M", "E", "2"],
+    ["3C", "Female", "1990-01-01 00:00:00.000", "Asian", "M", "E", "2"],
+    ["4D", "Male", "1990-01-01 00:00:00.000", "Asian", "M", "E", "2"],
+]
+LAB_TABLE = [
+    functionality.LAB_COLUMNS,
+    ["1A", "1", "CREATININE", "2.0", "mg/dL", "2001-07-01 00:00:00.000"],
+    ["1A", "1", "POTASSIUM", "6", "mmol/L", "2001-07-01 00:00:00.000"],
+    ["2B", "1", "CREATININE", "1.8", "mg/dL", "2001-07-01 00:00:00.000"],
+    ["2B", "1", "SODIUM", "135", "mmol/L", "2001-07-01 00:00:00.000"],
+    ["3C", "1", "CREATININE", "1.8", "mg/dL", "2001-07-01 00:00:00.000"],
+    ["3C", "1", "SODIUM", "125", "mmol/L", "2001-07-01 00:00:00.000"],
+    ["4D", "1", "SODIUM", "125", "mmol/L", "2001-07-01 00:00:00.000"],
+]
+PHENOTYPE = "CREATININE > 1.5 AND (POTASSIUM > 5.5 OR SODIUM < 130)"
+
+
+def make_database(tmp_path: pathlib.Path) -> functionality.Database:
+    """Load the shared fake files into a fresh database."""
+    database = functionality.Database(str(tmp_path / "rules.db"))
+    with make_fake_files.fake_files(SUB_TABLE, LAB_TABLE) as (
+        sub_filename,
+        lab_filename,
+    ):
+        functionality.parse_data(sub_filename, lab_filename, None, database)
+    return database
+
+
+def test_parse_rule_precedence_and_sharing() -> None:
+    """Test parsing precedence, quoting and condition de-duplication."""
+    rule = rules.parse('not "METABOLIC: SODIUM" >= 1e2 or K < -1 AND (K < -1)')
+    sodium = rules.Condition("METABOLIC: SODIUM", ">=", 100.0)
+    potassium = rules.Condition("K", "<", -1.0)
+    assert rule == rules.Or(
+        (rules.Not(sodium), rules.And((potassium, potassium)))
+    )
+    assert rules.conditions(rule) == [sodium, potassium]
+    assert rules.evaluate(rule, {}) is True
+    assert rules.evaluate(rule, {sodium: True}) is False
+
+
+@pytest.mark.parametrize(
+    "text",
+    [
+        "",
+        "POTASSIUM >",
+        "POTASSIUM => 5",
+        "POTASSIUM > 5 AND",
+        "(POTASSIUM > 5",
+        "POTASSIUM > 5)",
+        "POTASSIUM > __import__",
+        "POTASSIUM > 5; DROP TABLE Labs",
+    ],
+)
+def test_parse_rule_rejects_malformed(text: str) -> None:
+    """Test malformed rules raise ValueError instead of being run."""
+    with pytest.raises(ValueError):
+        rules.parse(text)
+
+
+def test_rule_runs_as_one_query(tmp_path: pathlib.Path) -> None:
+    """Test a rule matches patients with one grouped query."""
+    database = make_database(tmp_path)
+    cohort = functionality.Cohort(db=database)
+    with database.profile() as profiler:
+        assert list(rules.matching(PHENOTYPE, cohort)) == ["1A", "3C"]
+    assert [event.kind for event in profiler.events].count("query") == 1
+    assert list(rules.evaluate_cohort(PHENOTYPE, cohort)) == [
+        ("1A", True),
+        ("2B", False),
+        ("3C", True),
+        ("4D", False),
+    ]
+    seeded = functionality.Cohort(["2B", "3C", "9Z"], database)
+    assert list(rules.matching(PHENOTYPE, seeded)) == ["3C"]
+    negated = "NOT CREATININE > 1.5"
+    assert list(rules.matching(negated, cohort)) == ["4D"]
+    pat_4d = functionality.Patient("4D", database)
+    assert rules.patient_matches(negated, pat_4d) is True
+    assert rules.patient_matches(PHENOTYPE, pat_4d) is False
+    assert rules.patient_matches(
+        negated, functionality.Patient("9Z", database)
+    )
+    database.close()